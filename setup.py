@@ -24,16 +24,11 @@ def has_developer_tools():
 
 def get_requires(namesonly = False):
 	requires = ['PyYAML>=3.09']
-	if sys.platform.startswith('linux'):
-		if sys.version_info[0] > 2:
-			sys.stderr.write("""
----------------------------------------------------------------------
-WARNING: The "inotifyx" bindings to inotify(7) do not currently
-	 support Python 3.  "taskforce" will still work, but with
-	 a slightly higher overhead and lower responsiveness.
----------------------------------------------------------------------
-""")
-		elif has_developer_tools():
+	#  "inotifyx" does not support Python 3, where the built-in
+	#  taskforce.inotify module is used instead.
+	#
+	if sys.platform.startswith('linux') and sys.version_info[0] == 2:
+		if has_developer_tools():
 			requires += ['inotifyx>=0.2.2']
 		elif not has_inotifyx():
 			sys.stderr.write("""
@@ -42,10 +37,10 @@ WARNING: The "inotifyx" bindings to inotify(7) do not currently
 WARNING: The linux implementation will use the "inotifyx" bindings to
 	 inotify(7) if available.  On this system, "inotifyx" is not
 	 already present and the "python-dev" system is not loaded so
-	 "inotifyx" can't be installed.  "taskforce" will still work,
-	 but with a slightly higher overhead and lower responsiveness.
+	 "inotifyx" can't be installed.  "taskforce" will still use
+	 inotify(7) via its built-in module.
 
-	 If you would like to gain full performance, install the
+	 If you would prefer to use "inotifyx", install the
 	 "python-dev" package which is needed to install "inotifyx",
 	 for example, using:
 
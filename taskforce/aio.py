@@ -0,0 +1,317 @@
+# ________________________________________________________________________
+#
+#  Copyright (C) 2014 Andrew Fullford
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ________________________________________________________________________
+#
+
+"""
+Runs a legion from an asyncio event loop.
+
+legion.manage() owns the process, blocking in its own poll loop.  The
+manage() coroutine here drives the same legion, task and event_target
+objects from a running asyncio loop so taskforce can be embedded in an
+asyncio application:
+
+    l = task.legion(log=log)
+    l.set_config_file(path)
+    await aio.manage(l)
+
+Signals arrive via loop.add_signal_handler(), child exits via the
+legion's SIGCHLD self-pipe or its pidfds, and file, module and output
+watchers via loop.add_reader().  The HTTP services are served with
+asyncio streams using the callbacks registered on each httpd server,
+so no thread is started per request.  Deadlines are woken with
+loop.call_at().
+
+Only processes the legion started are reaped, so subprocesses run by
+the host application are left for asyncio to collect.
+
+As with legion.manage(), a LegionReset is raised when the legion is
+reset.  Only one legion can be managed per process as the legion
+handles process-wide signals.  Requires python 3.8 or later, where
+asyncio's default child watcher no longer handles SIGCHLD itself.
+"""
+
+import asyncio, functools, io, signal, socket, ssl
+from email.utils import formatdate
+from . import task, httpd
+
+#  Marks the end of a streamed HTTP response.
+#
+_end = object()
+
+class _poll_set(object):
+	"""
+	Stands in for the poll.poll() instance the legion registers its
+	watchers with.  Each registered item becomes an asyncio reader that
+	queues the item for legion._event_dispatch() and wakes the runner.
+	The httpd servers are instead served directly by asyncio.
+"""
+	def __init__(self, loop, wake):
+		self._loop = loop
+		self._wake = wake
+		self._readers = {}
+		self._servers = {}
+		self._ready = []
+
+	def _readable(self, item):
+		if item not in self._ready:
+			self._ready.append(item)
+		self._wake.set()
+
+	def register(self, item, mask=None):
+		self.unregister(item)
+		if isinstance(item, httpd.BaseServer):
+			self._servers[item] = self._loop.create_task(_http_serve(item))
+			return
+		fd = item if isinstance(item, int) else item.fileno()
+		self._loop.add_reader(fd, self._readable, item)
+		self._readers[item] = fd
+
+	def unregister(self, item):
+		if item in self._ready:
+			self._ready.remove(item)
+		if item in self._readers:
+			self._loop.remove_reader(self._readers.pop(item))
+		if item in self._servers:
+			serve = self._servers.pop(item)
+			if serve.done():
+				if not serve.cancelled() and serve.exception() is None:
+					serve.result().close()
+			else:
+				serve.cancel()
+
+	def take(self):
+		"""
+		Returns the items that have become readable since the last call.
+	"""
+		ready = self._ready
+		self._ready = []
+		return ready
+
+	def close(self):
+		for item in list(self._readers) + list(self._servers):
+			self.unregister(item)
+
+async def _http_serve(server):
+	"""
+	Start serving a httpd server's listening socket via asyncio.  The
+	socket is duplicated so the server itself, which the legion may
+	later close or detach for a handoff, is left as it was.
+"""
+	context = None
+	if isinstance(server.socket, ssl.SSLSocket):
+		context = server.socket.context
+	sock = socket.fromfd(server.socket.fileno(), server.socket.family, socket.SOCK_STREAM)
+	return await asyncio.start_server(functools.partial(_http_client, server), sock=sock, ssl=context)
+
+async def _http_send(writer, code, content_type, headers, body, timeout):
+	lines = ['HTTP/1.1 %d %s' % (code, httpd.http_server.BaseHTTPRequestHandler.responses.get(code, ('',))[0])]
+	lines.append('Server: taskforce/' + httpd.taskforce_version)
+	lines.append('Date: ' + formatdate(usegmt=True))
+	if content_type:
+		lines.append('Content-Type: ' + content_type)
+	if body is not None:
+		lines.append('Content-Length: %d' % (len(body),))
+	lines.append('Connection: close')
+	lines.extend(headers)
+	writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+	if body:
+		writer.write(body)
+	await asyncio.wait_for(writer.drain(), timeout)
+
+async def _http_stream(writer, content, chunked, timeout):
+	"""
+	Send an iterable response as it is produced, as per
+	httpd.HTTP_handler.send_stream().  Producers may block waiting for
+	output, so each part is fetched in the loop's default executor.
+"""
+	loop = asyncio.get_running_loop()
+	try:
+		it = iter(content)
+		while True:
+			part = await loop.run_in_executor(None, next, it, _end)
+			if part is _end:
+				break
+			if not part:
+				continue
+			if not isinstance(part, bytes):
+				part = part.encode('utf-8')
+			if chunked:
+				part = ('%x\r\n' % (len(part),)).encode('ascii') + part + b'\r\n'
+			writer.write(part)
+			await asyncio.wait_for(writer.drain(), timeout)
+		if chunked:
+			writer.write(b'0\r\n\r\n')
+			await asyncio.wait_for(writer.drain(), timeout)
+	finally:
+		if hasattr(content, 'close'):
+			content.close()
+
+def _addr(addr):
+	if type(addr) is tuple and len(addr) >= 2:
+		return "%s:%d" % (addr[0], addr[1])
+	return str(addr) if addr else 'local'
+
+async def _http_client(server, reader, writer):
+	"""
+	Handle one HTTP request on a connection accepted for "server",
+	calling the same serve_get() and serve_post() callbacks that the
+	threaded httpd.HTTP_handler uses.  The connection is closed after
+	the response.
+"""
+	log = server.log
+	timeout = server.timeout or None
+	path = None
+	try:
+		request = (await asyncio.wait_for(reader.readline(), timeout)).decode('latin-1').strip()
+		if not request:
+			return
+		headers = {}
+		while True:
+			line = await asyncio.wait_for(reader.readline(), timeout)
+			if line in (b'\r\n', b'\n', b''):
+				break
+			tag, _, value = line.decode('latin-1').partition(':')
+			headers[tag.strip().lower()] = value.strip()
+		words = request.split()
+		if len(words) != 3:
+			await _http_send(writer, 400, None, [], b'', timeout)
+			return
+		method, path, version = words
+		log.info("%s>%s \"%s\"", _addr(writer.get_extra_info('peername')), _addr(server.server_address), request)
+
+		params = {}
+		try:
+			if method == 'GET':
+				resp = server.serve_get(path, **params)
+			elif method == 'POST':
+				body = b''
+				if 'content-length' in headers:
+					body = await asyncio.wait_for(reader.readexactly(int(headers['content-length'])), timeout)
+				try:
+					postmap = httpd.parse_post(headers.get('content-type'), headers.get('content-length'),
+										io.BytesIO(body), params)
+				except Exception as e:
+					await _http_fault(server, writer, path, 400, "Parse error -- " + str(e))
+					return
+				resp = server.serve_post(path, postmap, **params)
+			else:
+				await _http_fault(server, writer, path, 501, "Unsupported method (%r)" % (method,))
+				return
+			if not resp:
+				await _http_fault(server, writer, path, 404, path + ' not found')
+				return
+			if type(resp) != tuple or len(resp) != 3:
+				await _http_fault(server, writer, path, 500, 'Bad callback response for ' + path)
+				return
+			code, content, content_type = resp
+		except Exception as e:
+			log.warning("Traceback -- %s", str(e), exc_info=True)
+			await _http_fault(server, writer, path, 500, "Callback error -- " + str(e))
+			return
+		if hasattr(content, 'encode'):
+			await _http_send(writer, code, content_type, [], content.encode('utf-8'), timeout)
+			return
+		chunked = (version == 'HTTP/1.1')
+		await _http_send(writer, code, content_type, ['Transfer-Encoding: chunked'] if chunked else [], None, timeout)
+		await _http_stream(writer, content, chunked, timeout)
+	except Exception as e:
+		log.info("HTTP request on '%s' ended -- %s", path, str(e))
+	finally:
+		try:
+			writer.close()
+		except Exception:
+			pass
+
+async def _http_fault(server, writer, path, code, message):
+	if code < 500:
+		server.log.warning("HTTP %d on '%s' -- %s", code, path, message)
+		await _http_send(writer, code, 'text/plain', [], message.encode('utf-8'), server.timeout or None)
+	else:
+		server.log.error("HTTP %d on '%s' -- %s", code, path, message)
+		await _http_send(writer, code, None, [], b'', server.timeout or None)
+
+def _signal(legion, wake, sig):
+	legion._sig_handler(sig, None)
+	wake.set()
+
+async def manage(legion):
+	"""
+	Manage the legion from the running event loop until it exits, as
+	legion.manage() does from its own loop.
+"""
+	log = legion._params.get('log', legion._discard)
+	loop = asyncio.get_running_loop()
+	wake = asyncio.Event()
+	pset = _poll_set(loop, wake)
+
+	prior = {}
+	sigs = [signal.SIGHUP, signal.SIGTERM]
+	if signal.getsignal(signal.SIGINT) != signal.SIG_IGN:
+		sigs.append(signal.SIGINT)
+	if not legion._pidfd_mode:
+		sigs.append(signal.SIGCHLD)
+	for sig in sigs:
+		prior[sig] = signal.getsignal(sig)
+		loop.add_signal_handler(sig, _signal, legion, wake, sig)
+
+	#  Child processes belonging to the host application must be left
+	#  for it to reap.
+	#
+	legion._reap_known = True
+
+	reset = None
+	try:
+		legion._manage_setup(pset)
+		log.info("File event polling via asyncio %s", type(loop).__name__)
+		if legion._pidfd_mode:
+			log.info("Child processes are reaped via pidfd")
+		while not legion._manage_check():
+			#  Sleep until the same time legion.manage() would, or until
+			#  a watcher becomes readable or a signal arrives.
+			#
+			delay = max(0, legion._manage_wake() - legion._manage_now)
+			timer = loop.call_at(loop.time() + delay, wake.set)
+			try:
+				await wake.wait()
+			finally:
+				timer.cancel()
+			wake.clear()
+
+			ready = pset.take()
+			if not legion._manage_timed(len(ready) > 0):
+				for item in ready:
+					legion._event_dispatch(item)
+	except Exception as e:
+		log.error("unexpected error -- %s", str(e), exc_info=True)
+		raise e
+	finally:
+		reset = legion._manage_finish()
+		pset.close()
+		log.debug("reseting signals")
+		for sig, state in prior.items():
+			loop.remove_signal_handler(sig)
+			if state is not None:
+				signal.signal(sig, state)
+	if legion._resetting:
+		raise reset if reset else task.LegionReset()
+
+def run(legion):
+	"""
+	Manage the legion in a new asyncio event loop, for use in place of
+	legion.manage() when the caller does not already have a loop.
+"""
+	asyncio.run(manage(legion))
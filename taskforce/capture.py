@@ -0,0 +1,343 @@
+# ________________________________________________________________________
+#
+#  Copyright (C) 2014 Andrew Fullford
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ________________________________________________________________________
+#
+
+"""
+Capture of task process output.
+
+Each process of a task with an "output" config gets the write end of a
+pipe as its stdout and stderr.  The legion registers a reader for the
+other end with its poll set and passes what arrives to the task's output,
+which writes it to a rotating file, syslog, and/or an in-memory buffer
+for each process instance.
+
+Reads are non-blocking and take at most one chunk per poll event.  A
+process that writes faster than its output can be handled will block on
+its own full pipe rather than holding up the legion.  Memory held per
+task is limited to the buffer size and one partial line per process.
+"""
+
+import os, errno, fcntl, time, threading, logging, logging.handlers
+
+#  Largest single read from a capture pipe.
+#
+chunk_size = 65536
+
+#  Output with no newline is passed on as a line once it reaches this size.
+#
+max_line = 8192
+
+#  Default size in bytes of the in-memory buffer for each instance.
+#
+def_buffer = 65536
+
+#  Default size at which an output file is rotated, and the number of
+#  rotated files kept.
+#
+def_max_bytes = 10*1024*1024
+def_backups = 5
+
+def pipe():
+	"""
+	Returns (read_fd, write_fd) for a new capture pipe.  Both are
+	close-on-exec, and the read end is non-blocking.
+"""
+	rfd, wfd = os.pipe()
+	for fd in [rfd, wfd]:
+		fl = fcntl.fcntl(fd, fcntl.F_GETFD)
+		fcntl.fcntl(fd, fcntl.F_SETFD, fl | fcntl.FD_CLOEXEC)
+	fl = fcntl.fcntl(rfd, fcntl.F_GETFL)
+	fcntl.fcntl(rfd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+	return (rfd, wfd)
+
+class _rotating_file(object):
+	"""
+	Appends to a file, rotating it to "path.1", "path.2", etc when it
+	reaches "max_bytes".  A "max_bytes" of 0 disables rotation.
+"""
+	def __init__(self, path, max_bytes=def_max_bytes, backups=def_backups):
+		self.path = path
+		self.max_bytes = max_bytes
+		self.backups = backups
+		self._fd = None
+		self._size = 0
+
+	def _open(self):
+		self._fd = os.open(self.path, os.O_WRONLY|os.O_APPEND|os.O_CREAT, 0o644)
+		fl = fcntl.fcntl(self._fd, fcntl.F_GETFD)
+		fcntl.fcntl(self._fd, fcntl.F_SETFD, fl | fcntl.FD_CLOEXEC)
+		self._size = os.fstat(self._fd).st_size
+
+	def _rotate(self):
+		self.close()
+		for gen in range(self.backups - 1, 0, -1):
+			src = '%s.%d' % (self.path, gen)
+			if os.path.exists(src):
+				os.rename(src, '%s.%d' % (self.path, gen + 1))
+		if self.backups > 0:
+			os.rename(self.path, self.path + '.1')
+		else:
+			os.unlink(self.path)
+
+	def write(self, data):
+		if self._fd is None:
+			self._open()
+		if self.max_bytes and self._size > 0 and self._size + len(data) > self.max_bytes:
+			self._rotate()
+			self._open()
+		while data:
+			done = os.write(self._fd, data)
+			self._size += done
+			data = data[done:]
+
+	def close(self):
+		if self._fd is not None:
+			try: os.close(self._fd)
+			except: pass
+			self._fd = None
+
+class ring(object):
+	"""
+	A fixed-size buffer holding the most recent "size" bytes written.
+	Positions are absolute offsets into everything ever written, so
+	"start" is the oldest offset still held and "end" is the offset
+	the next write will have.  Readers may be in other threads, such
+	as HTTP handlers, and can wait for data beyond an offset.
+"""
+	def __init__(self, size=def_buffer):
+		self.size = size
+		self.end = 0
+		self._buf = bytearray(size)
+		self._cond = threading.Condition()
+
+	@property
+	def start(self):
+		return max(0, self.end - self.size)
+
+	def add(self, data):
+		with self._cond:
+			if len(data) > self.size:
+				self.end += len(data) - self.size
+				data = data[-self.size:]
+			pos = self.end % self.size
+			first = min(len(data), self.size - pos)
+			self._buf[pos:pos+first] = data[:first]
+			if first < len(data):
+				self._buf[0:len(data)-first] = data[first:]
+			self.end += len(data)
+			self._cond.notify_all()
+
+	def read(self, offset=None, limit=None):
+		"""
+		Returns (offset, data) for up to "limit" bytes from "offset".
+		An offset of None, or one that has been overwritten, reads from
+		the oldest data held.  A negative offset is relative to the end.
+	"""
+		with self._cond:
+			start = self.start
+			if offset is None:
+				offset = start
+			elif offset < 0:
+				offset = self.end + offset
+			offset = min(max(offset, start), self.end)
+			length = self.end - offset
+			if limit is not None and limit < length:
+				length = limit
+			pos = offset % self.size
+			first = min(length, self.size - pos)
+			data = bytes(self._buf[pos:pos+first])
+			if first < length:
+				data += bytes(self._buf[0:length-first])
+			return (offset, data)
+
+	def wait(self, offset, timeout):
+		"""
+		Wait up to "timeout" seconds for data beyond "offset".  Returns
+		True if there is some.
+	"""
+		with self._cond:
+			if self.end <= offset:
+				self._cond.wait(timeout)
+			return self.end > offset
+
+	def lines(self):
+		"""
+		Returns the complete lines held as a list of strings.
+	"""
+		offset, data = self.read()
+		if offset > 0:
+			nl = data.find(b'\n')
+			data = data[nl+1:] if nl >= 0 else b''
+		return data.decode('utf-8', 'replace').splitlines()
+
+class output(object):
+	"""
+	Delivers the output of a task's processes.  Params are:
+
+	  file		-  Path of a file to append output to.
+	  max_bytes	-  Size at which the file is rotated, default def_max_bytes.
+	  backups	-  Number of rotated files to keep, default def_backups.
+	  syslog	-  If True, each line is sent to syslog.  A string is
+			   taken as the syslog facility name, default "daemon".
+	  buffer	-  Size in bytes of the in-memory buffer of recent output
+			   kept for each process instance.  If no other destination
+			   is given, def_buffer is used.
+	  log		-  A logging instance.
+
+	Write errors are logged, and the output is dropped and counted.
+"""
+	def __init__(self, name, **params):
+		self._name = name
+		self._params = params
+		self._discard = logging.getLogger(__name__)
+		self._discard.addHandler(logging.NullHandler())
+		self.dropped = 0
+		self._last_error = 0
+
+		self._file = None
+		if params.get('file'):
+			self._file = _rotating_file(params['file'],
+						max_bytes=params.get('max_bytes', def_max_bytes),
+						backups=params.get('backups', def_backups))
+
+		self._syslog = None
+		if params.get('syslog'):
+			facility = params['syslog']
+			if facility is True:
+				facility = 'daemon'
+			logparams = {'facility': logging.handlers.SysLogHandler.facility_names[facility]}
+			for addr in ['/dev/log', '/var/run/log']:
+				if os.path.exists(addr):
+					logparams['address'] = addr
+					break
+			handler = logging.handlers.SysLogHandler(**logparams)
+			handler.setFormatter(logging.Formatter(fmt="%(name)s: %(message)s"))
+			self._syslog = logging.Logger(name)
+			self._syslog.addHandler(handler)
+
+		self._buffer_size = params.get('buffer')
+		if self._buffer_size is None and not (self._file or self._syslog):
+			self._buffer_size = def_buffer
+		self.buffers = {}
+
+	def write(self, instance, data):
+		"""
+		Deliver "data", which holds one or more complete lines from
+		process "instance".
+	"""
+		log = self._params.get('log', self._discard)
+		if self._buffer_size:
+			buf = self.buffers.get(instance)
+			if buf is None:
+				buf = self.buffers[instance] = ring(self._buffer_size)
+			buf.add(data)
+		try:
+			if self._file:
+				self._file.write(data)
+			if self._syslog:
+				for line in data.decode('utf-8', 'replace').splitlines():
+					self._syslog.info("[%d] %s", instance, line)
+		except Exception as e:
+			self.dropped += len(data)
+			now = time.time()
+			if self._last_error + 60 < now:
+				log.error("Output for task '%s' failed, %d bytes dropped so far -- %s",
+							self._name, self.dropped, str(e))
+				self._last_error = now
+
+	def close(self):
+		if self._file:
+			self._file.close()
+		if self._syslog:
+			for handler in list(self._syslog.handlers):
+				handler.close()
+				self._syslog.removeHandler(handler)
+
+class reader(object):
+	"""
+	Reads a capture pipe for one process.  The instance has a fileno()
+	method so it can be registered with a poll set.  Complete lines are
+	passed to "sink" as sink(instance, data).  "name" identifies the task
+	when the pipe is handed over to a re-executed legion.
+"""
+	def __init__(self, fd, sink, instance, name=None, **params):
+		self._fd = fd
+		self._sink = sink
+		self.instance = instance
+		self.name = name
+		self._params = params
+		self._discard = logging.getLogger(__name__)
+		self._discard.addHandler(logging.NullHandler())
+		self._partial = b''
+
+	def fileno(self):
+		return self._fd
+
+	def __str__(self):
+		return 'capture fd %s instance %d' % (str(self._fd), self.instance)
+
+	def _deliver(self, data):
+		try:
+			self._sink(self.instance, data)
+		except Exception as e:
+			log = self._params.get('log', self._discard)
+			log.error("Output delivery for instance %d failed -- %s", self.instance, str(e))
+
+	def read(self):
+		"""
+		Read one chunk from the pipe and pass on any complete lines.
+		Returns False once the writing process has gone and all its
+		output has been passed on.
+	"""
+		try:
+			data = os.read(self._fd, chunk_size)
+		except OSError as e:
+			if e.errno in (errno.EAGAIN, errno.EINTR):
+				return True
+			data = b''
+		if not data:
+			if self._partial:
+				self._deliver(self._partial + b'\n')
+				self._partial = b''
+			return False
+		end = data.rfind(b'\n') + 1
+		if end:
+			self._deliver(self._partial + data[:end] if self._partial else data[:end])
+			self._partial = data[end:]
+		else:
+			self._partial += data
+		if len(self._partial) >= max_line:
+			self._deliver(self._partial + b'\n')
+			self._partial = b''
+		return True
+
+	def detach(self):
+		"""
+		Returns the pipe fd, marked so it will survive exec, and
+		releases it from the reader.  Any partial line is discarded.
+	"""
+		fd = self._fd
+		self._fd = None
+		if hasattr(os, 'set_inheritable'):
+			os.set_inheritable(fd, True)
+		return fd
+
+	def close(self):
+		if self._fd is not None:
+			try: os.close(self._fd)
+			except: pass
+			self._fd = None
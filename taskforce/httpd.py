@@ -16,7 +16,7 @@
 # ________________________________________________________________________
 #
 
-import os, sys, stat, errno, re, logging, ssl
+import os, sys, stat, errno, re, socket, logging, ssl
 from cgi import parse_header, parse_multipart
 from . import utils
 try:											# pragma: no cover
@@ -129,6 +129,9 @@ class HTTP_handler(http_server.BaseHTTPRequestHandler):
 			self.server.log.warning("Traceback -- %s", str(e), exc_info=True)
 			self.fault(500, "Callback error -- " + str(e))
 			return
+		if not hasattr(content, 'encode'):
+			self.send_stream(code, content, content_type)
+			return
 		content = content.encode('utf-8')
 		self.send_response(code)
 		self.send_header("Content-Type", content_type)
@@ -137,24 +140,13 @@ class HTTP_handler(http_server.BaseHTTPRequestHandler):
 		self.wfile.write(content)
 
 	def do_POST(self):
-		content_type = self.headers.get('content-type')
-		postmap = {}
 		params = {'handler': self}
-		if content_type:
-			try:
-				ctype, pdict = parse_header(content_type)
-				if ctype == 'multipart/form-data':
-					postmap = parse_multipart(self.rfile, pdict)
-				elif ctype == 'application/x-www-form-urlencoded':
-					length = int(self.headers['content-length'])
-					postmap = parse_qs(self.rfile.read(length), keep_blank_values=1)
-				else:
-					length = int(self.headers['content-length'])
-					params['type'] = ctype
-					params['data'] = self.rfile.read(length)
-			except Exception as e:
-				self.fault(400, "Parse error -- " + str(e))
-				return
+		try:
+			postmap = parse_post(self.headers.get('content-type'), self.headers.get('content-length'),
+									self.rfile, params)
+		except Exception as e:
+			self.fault(400, "Parse error -- " + str(e))
+			return
 		try:
 			resp = self.server.serve_post(self.path, postmap, **params)
 			if not resp:
@@ -175,6 +167,42 @@ class HTTP_handler(http_server.BaseHTTPRequestHandler):
 		self.end_headers()
 		self.wfile.write(content)
 
+	def send_stream(self, code, content, content_type):
+		"""
+		Send a response where the content is an iterable, such as a
+		generator, writing each part as soon as it is produced.  HTTP/1.1
+		clients get a chunked response, older clients get the content as
+		is, ended by closing the connection.
+	"""
+		chunked = (self.request_version == 'HTTP/1.1')
+		if chunked:
+			self.protocol_version = 'HTTP/1.1'
+		self.close_connection = True
+		self.send_response(code)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Connection", "close")
+		if chunked:
+			self.send_header("Transfer-Encoding", "chunked")
+		self.end_headers()
+		try:
+			for part in content:
+				if not part:
+					continue
+				if not isinstance(part, bytes):
+					part = part.encode('utf-8')
+				if chunked:
+					self.wfile.write(('%x\r\n' % (len(part),)).encode('ascii') + part + b'\r\n')
+				else:
+					self.wfile.write(part)
+				self.wfile.flush()
+			if chunked:
+				self.wfile.write(b'0\r\n\r\n')
+		except Exception as e:
+			self.server.log.info("Stream on '%s' ended -- %s", self.path, str(e))
+		finally:
+			if hasattr(content, 'close'):
+				content.close()
+
 	def format_addr(self, addr, showport=False):
 		if type(addr) is tuple and len(addr) == 2:
 			if showport:
@@ -203,6 +231,31 @@ class HTTP_handler(http_server.BaseHTTPRequestHandler):
 
 class BaseServer(object):
 
+	def _inherit(self, fd):
+		"""
+		Replace the unbound socket created by the server class with the
+		listening socket "fd", which was handed over from a prior process.
+	"""
+		self.socket.close()
+		self.socket = socket.fromfd(fd, self.address_family, socket.SOCK_STREAM)
+		os.close(fd)
+		self.server_address = self.socket.getsockname()
+
+	def detach(self):
+		"""
+		Returns a duplicate of the listening socket fd, marked so it will
+		survive exec, and closes the server without removing any udom
+		socket path.  This lets a re-executed process keep serving on the
+		same socket with no gap in which connections would be refused.
+	"""
+		fd = os.dup(self.socket.fileno())
+		if hasattr(os, 'set_inheritable'):
+			os.set_inheritable(fd, True)
+		if hasattr(self, 'path'):
+			self.path = None
+		self.close()
+		return fd
+
 	def register_get(self, regex, callback):
 		"""
 		Register a regex for processing HTTP GET
@@ -253,6 +306,10 @@ class BaseServer(object):
 
 			(code, content, content_type)
 
+		The content is normally a string.  It may instead be an iterable
+		producing strings or bytes, which are sent as they are produced,
+		see HTTP_handler.send_stream().
+
 		If multiple registrations match the path, the one with the longest
 		matching text will be used.  Matches are always anchored at the start
 		of the path.
@@ -294,7 +351,7 @@ class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer, BaseServer)
 	daemon_threads = True
 	allow_reuse_address = True
 
-	def __init__(self, host, port, timeout, log):
+	def __init__(self, host, port, timeout, log, fd=None):
 		self.host = host
 		self.port = port
 		self.timeout = timeout
@@ -302,7 +359,9 @@ class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer, BaseServer)
 		self.get_registrations = {}
 		self.post_registrations = {}
 		self.allow_control = False
-		super(TCPServer, self).__init__((host, port), HTTP_handler)
+		super(TCPServer, self).__init__((host, port), HTTP_handler, bind_and_activate=(fd is None))
+		if fd is not None:
+			self._inherit(fd)
 
 	def close(self):
 		self.server_close()
@@ -317,13 +376,17 @@ class UnixStreamServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServe
 	daemon_threads = True
 	allow_reuse_address = True
 
-	def __init__(self, path, timeout, log):
+	def __init__(self, path, timeout, log, fd=None):
 		self.path = path
 		self.timeout = timeout
 		self.log = log
 		self.get_registrations = {}
 		self.post_registrations = {}
 		self.allow_control = False
+		if fd is not None:
+			super(UnixStreamServer, self).__init__(path, HTTP_handler, bind_and_activate=False)
+			self._inherit(fd)
+			return
 		if os.path.exists(self.path):
 			try:
 				st = os.stat(self.path)
@@ -380,7 +443,7 @@ ssl_ciphers=[
 	'!DES'
 ]
 
-def server(service, log=None):
+def server(service, log=None, fd=None):
 	"""
 	Creates a threaded http service based on the passed HttpService instance.
 
@@ -404,6 +467,8 @@ def server(service, log=None):
 
 	  service	- Service configuration.  See the HttpService class above.
 	  log		- A 'logging' object to log errors and activity.
+	  fd		- An already listening socket to use rather than
+			  binding a new one, as returned by detach().
 """
 	if log:
 		log = log
@@ -417,7 +482,7 @@ def server(service, log=None):
 		service.listen = def_address
 
 	if service.listen.find('/') >=0 :
-		httpd = UnixStreamServer(service.listen, service.timeout, log)
+		httpd = UnixStreamServer(service.listen, service.timeout, log, fd=fd)
 	else:
 		port = None
 		m = re.match(r'^(.*):(.*)$', service.listen)
@@ -433,7 +498,7 @@ def server(service, log=None):
 			log.debug("No match, proceding with host '%s'", host)
 		if not port:
 			port = def_sslport if service.certfile else def_port
-		httpd = TCPServer(host, port, service.timeout, log)
+		httpd = TCPServer(host, port, service.timeout, log, fd=fd)
 	if service.certfile:
 		ciphers = ' '.join(ssl_ciphers)
 		ctx = None
@@ -466,6 +531,27 @@ def server(service, log=None):
 	log.info("HTTP service %s", str(service))
 	return httpd
 
+def parse_post(content_type, content_length, rfile, params):
+	"""
+	Parse the body of a POST request read from "rfile" according to the
+	request's Content-Type and Content-Length header values.  Returns the
+	postmap to pass to serve_post().  A body that is not form data is
+	instead added to "params" as 'type' and 'data'.
+"""
+	postmap = {}
+	if content_type:
+		ctype, pdict = parse_header(content_type)
+		if ctype == 'multipart/form-data':
+			postmap = parse_multipart(rfile, pdict)
+		elif ctype == 'application/x-www-form-urlencoded':
+			length = int(content_length)
+			postmap = parse_qs(rfile.read(length), keep_blank_values=1)
+		else:
+			length = int(content_length)
+			params['type'] = ctype
+			params['data'] = rfile.read(length)
+	return postmap
+
 def _unicode(p):
 	"""
 	Used when force_unicode is True (default), the tags and values in the dict
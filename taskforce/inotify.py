@@ -0,0 +1,212 @@
+# ________________________________________________________________________
+#
+#  Copyright (C) 2014 Andrew Fullford
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ________________________________________________________________________
+#
+
+"""
+Minimal binding to Linux inotify(7) using ctypes.
+
+The interface follows the "inotifyx" C extension closely enough that
+watch_files can use either interchangeably.  It exists because
+"inotifyx" requires a compiler at install time and does not support
+python 3.  The functions are:
+
+    init()                          -  Returns a new inotify file descriptor.
+    add_watch(fd, path, mask)       -  Adds or modifies a watch, returning the
+				       watch descriptor.
+    rm_watch(fd, wd)                -  Removes a watch.
+    get_events(fd, timeout=None)    -  Returns a list of InotifyEvent objects.
+				       Blocks until events are available or
+				       the timeout (in seconds) expires.
+
+Errors are raised as IOError with errno set, matching "inotifyx".
+"""
+
+import sys, os, errno, select, struct
+
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_MASK_ADD = 0x20000000
+IN_ISDIR = 0x40000000
+IN_ONESHOT = 0x80000000
+
+IN_CLOSE = IN_CLOSE_WRITE | IN_CLOSE_NOWRITE
+IN_MOVE = IN_MOVED_FROM | IN_MOVED_TO
+IN_ALL_EVENTS = (IN_ACCESS | IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_CLOSE_NOWRITE | IN_OPEN |
+		 IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+#  Flags for init(), these are the same as O_CLOEXEC and O_NONBLOCK
+#
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+#  struct inotify_event is followed by "len" bytes holding the NUL-padded name.
+#
+_event_hdr = struct.Struct('iIII')
+
+#  Large enough for many events in a single read().  The kernel will only
+#  return whole events, and each one is at most _event_hdr.size + NAME_MAX + 1.
+#
+_read_size = 65536
+
+_event_names = dict((val, nam) for nam, val in globals().items()
+				if nam.startswith('IN_') and nam not in ('IN_CLOSE', 'IN_MOVE', 'IN_ALL_EVENTS',
+									 'IN_CLOEXEC', 'IN_NONBLOCK'))
+_event_bits = list(_event_names)
+_event_bits.sort()
+
+_libc = None
+available = False
+if sys.platform.startswith('linux'):
+	try:
+		import ctypes, ctypes.util
+		_libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+		_libc.inotify_init1.argtypes = [ctypes.c_int]
+		_libc.inotify_init1.restype = ctypes.c_int
+		_libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+		_libc.inotify_add_watch.restype = ctypes.c_int
+		_libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+		_libc.inotify_rm_watch.restype = ctypes.c_int
+		available = True
+	except:
+		_libc = None
+
+class InotifyEvent(object):
+	"""
+	Holds a single decoded inotify event.  "name" is only set
+	for events on files within a watched directory.
+"""
+	def __init__(self, wd, mask, cookie, name):
+		self.wd = wd
+		self.mask = mask
+		self.cookie = cookie
+		self.name = name
+
+	def get_mask_description(self):
+		s = ''
+		for bit in _event_bits:
+			if self.mask & bit:
+				if s:
+					s += '|'
+				s += _event_names[bit]
+		return s
+
+	def __str__(self):
+		return 'InotifyEvent(wd=%d, mask=%s, cookie=%d, name=%s)' % (
+				self.wd, self.get_mask_description(), self.cookie, repr(self.name))
+
+def _raise_errno(call):
+	import ctypes
+	e = ctypes.get_errno()
+	raise IOError(e, "%s failed -- %s" % (call, os.strerror(e)))
+
+def _fsencode(path):
+	if isinstance(path, bytes):
+		return path
+	if hasattr(os, 'fsencode'):
+		return os.fsencode(path)
+	return path.encode('utf-8')									# pragma: no cover
+
+def _fsdecode(name):
+	if hasattr(os, 'fsdecode'):
+		return os.fsdecode(name)
+	return name											# pragma: no cover
+
+def init():
+	if not available:
+		raise IOError(errno.ENOSYS, "inotify is not available on this system")
+	fd = _libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+	if fd < 0:
+		_raise_errno('inotify_init1()')
+	return fd
+
+def add_watch(fd, path, mask=IN_ALL_EVENTS):
+	wd = _libc.inotify_add_watch(fd, _fsencode(path), mask)
+	if wd < 0:
+		_raise_errno('inotify_add_watch()')
+	return wd
+
+def rm_watch(fd, wd):
+	if _libc.inotify_rm_watch(fd, wd) < 0:
+		_raise_errno('inotify_rm_watch()')
+
+def decode_events(data):
+	"""
+	Decode a buffer returned by read() on an inotify descriptor into a
+	list of InotifyEvent objects.
+"""
+	events = []
+	hdr_size = _event_hdr.size
+	pos = 0
+	end = len(data)
+	while pos + hdr_size <= end:
+		wd, mask, cookie, nlen = _event_hdr.unpack_from(data, pos)
+		pos += hdr_size
+		name = None
+		if nlen:
+			name = _fsdecode(data[pos:pos+nlen].rstrip(b'\0'))
+			pos += nlen
+		events.append(InotifyEvent(wd, mask, cookie, name))
+	return events
+
+def get_events(fd, timeout=None):
+	"""
+	Return a list of pending events.  If none are pending, wait up to
+	"timeout" seconds for some to arrive.  A timeout of None will block
+	until an event arrives.
+"""
+	try:
+		data = os.read(fd, _read_size)
+	except OSError as e:
+		if e.errno != errno.EAGAIN:
+			raise IOError(e.errno, e.strerror)
+		data = None
+	if not data:
+		try:
+			if timeout is None:
+				rlist, _, _ = select.select([fd], [], [])
+			else:
+				rlist, _, _ = select.select([fd], [], [], timeout)
+		except (IOError, OSError, select.error) as e:
+			ecode = getattr(e, 'errno', None)
+			if ecode is None:
+				ecode = e.args[0]								# pragma: no cover
+			raise IOError(ecode, os.strerror(ecode))
+		if not rlist:
+			return []
+		try:
+			data = os.read(fd, _read_size)
+		except OSError as e:
+			if e.errno == errno.EAGAIN:
+				return []
+			raise IOError(e.errno, e.strerror)
+	return decode_events(data)
@@ -80,9 +80,9 @@ class http(object):
 			if error_detected:
 				return (404, text, 'text/plain')
 			for taskname in postmap:
-				self._legion.task_get(taskname)._config_pending['control'] = postmap[taskname][0]
+				self._legion.task_get(taskname).update_config(control=postmap[taskname][0])
 			if change_detected:
-				self._legion._apply()
+				self._legion._apply(changed=set(self._legion.task_get(taskname) for taskname in postmap))
 				return (202, text, 'text/plain')
 			else:
 				return (200, text, 'text/plain')
@@ -124,8 +124,8 @@ class http(object):
 				return (404, text, 'text/plain')
 			if change_detected:
 				for taskname in postmap:
-					self._legion.task_get(taskname)._config_pending['count'] = counts[taskname]
-				self._legion._apply()
+					self._legion.task_get(taskname).update_config(count=counts[taskname])
+				self._legion._apply(changed=set(self._legion.task_get(taskname) for taskname in counts))
 				self._legion.next_timeout()
 				return (202, text, 'text/plain')
 			else:
@@ -21,7 +21,7 @@ import sys, os, select, errno
 PL_SELECT = 0
 PL_POLL = 1
 PL_KQUEUE = 2
-#PL_EPOLL = 3	# Possible future implementation
+PL_EPOLL = 3
 
 POLLIN = 1
 POLLPRI = 2
@@ -42,8 +42,8 @@ class Error(Exception):
 class poll(object):
 	"""
 	Presents an interface consitent with select.poll() but uses
-	select.kqueue(), select.poll() or select.select() depending on services
-	availale from the O/S.
+	select.kqueue(), select.epoll(), select.poll() or select.select()
+	depending on services availale from the O/S.
 
 	The service is selected automatically and will typically be the best
 	choice but it may be overridden with the set_mode() method which must
@@ -74,6 +74,17 @@ class poll(object):
 	    This module adopts the select behavior regardless of the underlying
 	    mode, as it is generally more useful.  I'm sure somebody will
 	    explain to me soon why that's not actually true.
+
+	4.  register() accepts "edge" and "oneshot" flags.  With "edge" set, an
+	    event is delivered only when the descriptor state changes, so the
+	    caller must drain the descriptor before waiting again.  With "oneshot"
+	    set, the descriptor is disabled after its first event and must be
+	    rearmed with modify().  The flags are only available in PL_EPOLL and
+	    PL_KQUEUE modes.  Other modes raise poll.Error if they are used.
+
+	    PL_EPOLL is preferred over PL_POLL where available because the kernel
+	    retains the registrations, so the cost of each poll() depends on the
+	    number of ready descriptors rather than the number registered.
 """
 	def __init__(self):
 		self._mode_map = dict((val, nam) for nam, val in globals().items() if nam.startswith('PL_'))
@@ -84,11 +95,20 @@ class poll(object):
 		self._has_registered = False
 		self._fd_map = {}
 
+		#  Holds the (edge, oneshot) flags for each registered fd so that
+		#  modify() can retain them in PL_EPOLL mode.
+		#
+		self._fd_flags = {}
+
 		self._mode = None
 		if 'kqueue' in select.__dict__ and callable(select.kqueue):		# pragma: no cover
 			if self._mode is None:
 				self._mode = PL_KQUEUE
 			self._available_modes.add(PL_KQUEUE)
+		if 'epoll' in select.__dict__ and callable(select.epoll):
+			if self._mode is None:
+				self._mode = PL_EPOLL
+			self._available_modes.add(PL_EPOLL)
 		if 'poll' in select.__dict__ and callable(select.poll):
 			if self._mode is None:
 				self._mode = PL_POLL
@@ -146,7 +166,21 @@ class poll(object):
 				s += self._poll_map[bit]
 		return s
 
-	def register(self, fo, eventmask=POLLIN|POLLOUT):
+	def _epoll_mask(self, eventmask, edge=False, oneshot=False):
+		mask = 0
+		if eventmask & POLLIN:
+			mask |= select.EPOLLIN
+		if eventmask & POLLPRI:
+			mask |= select.EPOLLPRI
+		if eventmask & POLLOUT:
+			mask |= select.EPOLLOUT
+		if edge:
+			mask |= select.EPOLLET
+		if oneshot:
+			mask |= select.EPOLLONESHOT
+		return mask
+
+	def register(self, fo, eventmask=POLLIN|POLLOUT, edge=False, oneshot=False):
 		fd = None
 		try:
 			#  This tests that the fd is an int type
@@ -168,9 +202,15 @@ class poll(object):
 		#
 		os.fstat(fd)
 
+		if (edge or oneshot) and self._mode not in (PL_EPOLL, PL_KQUEUE):
+			raise Error("Edge-triggered and one-shot registration are not supported in %s mode" %
+					(self.get_mode_name(self._mode),))
+
 		if not self._has_registered:
 			if self._mode == PL_KQUEUE:					# pragma: no cover
 				self._kq = select.kqueue()
+			elif self._mode == PL_EPOLL:
+				self._epoll = select.epoll()
 			elif self._mode == PL_POLL:
 				self._poll = select.poll()
 			elif self._mode == PL_SELECT:
@@ -182,13 +222,38 @@ class poll(object):
 			if eventmask & POLLPRI:
 				raise Error("POLLPRI is not supported in %s mode", self.get_mode_name(self._mode))
 			self.unregister(fo)
+			flags = select.KQ_EV_ADD
+			if edge:
+				flags |= select.KQ_EV_CLEAR
+			if oneshot:
+				flags |= select.KQ_EV_ONESHOT
 			kl = []
 			if eventmask & POLLIN:
-				kl.append(select.kevent(fo, filter=select.KQ_FILTER_READ, flags=select.KQ_EV_ADD))
+				kl.append(select.kevent(fo, filter=select.KQ_FILTER_READ, flags=flags))
 			if eventmask & POLLOUT:
-				kl.append(select.kevent(fo, filter=select.KQ_FILTER_WRITE, flags=select.KQ_EV_ADD))
+				kl.append(select.kevent(fo, filter=select.KQ_FILTER_WRITE, flags=flags))
 			self._fd_map[fd] = fo
+			self._fd_flags[fd] = (edge, oneshot)
 			self._kq.control(kl, 0, 0)
+		elif self._mode == PL_EPOLL:
+			#  select.poll() allows an fd to be registered again to change
+			#  its event mask, whereas epoll requires modify() for this.
+			#  If the fd was closed and its number reused since it was
+			#  registered, the kernel has already dropped it so it must
+			#  be registered afresh.
+			#
+			mask = self._epoll_mask(eventmask, edge, oneshot)
+			if fd in self._fd_map:
+				try:
+					self._epoll.modify(fd, mask)
+				except (IOError, OSError) as e:
+					if e.errno != errno.ENOENT:
+						raise e
+					self._epoll.register(fd, mask)
+			else:
+				self._epoll.register(fd, mask)
+			self._fd_map[fd] = fo
+			self._fd_flags[fd] = (edge, oneshot)
 		elif self._mode == PL_POLL:
 			self._fd_map[fd] = fo
 			return self._poll.register(fo, eventmask)
@@ -204,7 +269,16 @@ class poll(object):
 
 	def modify(self, fo, eventmask):
 		if self._mode == PL_KQUEUE:
-			self.register(fo, eventmask)
+			fd = fo if isinstance(fo, int) else fo.fileno()
+			edge, oneshot = self._fd_flags.get(fd, (False, False))
+			self.register(fo, eventmask, edge=edge, oneshot=oneshot)
+		elif self._mode == PL_EPOLL:
+			#  Retains any edge or one-shot flags from registration.  For a
+			#  one-shot registration, this rearms the fd.
+			#
+			fd = fo if isinstance(fo, int) else fo.fileno()
+			edge, oneshot = self._fd_flags.get(fd, (False, False))
+			self.register(fo, eventmask, edge=edge, oneshot=oneshot)
 		elif self._mode == PL_POLL:
 			return self._poll.modify(fo, eventmask)
 		elif self._mode == PL_SELECT:
@@ -221,8 +295,11 @@ class poll(object):
 				fd = fo.fileno()
 			else:
 				raise Error("File object '%s' is neither 'int' nor object with fileno() method" % (str(fo),))
-		if fd in self._fd_map:
+		known = (fd in self._fd_map)
+		if known:
 			del self._fd_map[fd]
+		if fd in self._fd_flags:
+			del self._fd_flags[fd]
 		if self._mode == PL_KQUEUE:						# pragma: no cover
 			ev = select.kevent(fo, filter=select.KQ_FILTER_READ, flags=select.KQ_EV_DELETE)
 			try: self._kq.control([ev], 0, 0)
@@ -230,6 +307,18 @@ class poll(object):
 			ev = select.kevent(fo, filter=select.KQ_FILTER_WRITE, flags=select.KQ_EV_DELETE)
 			try: self._kq.control([ev], 0, 0)
 			except: pass
+		elif self._mode == PL_EPOLL:
+			if not known:
+				raise KeyError(fd)
+
+			#  The kernel drops the registration when the fd is closed, so
+			#  an fd that was closed before unregister() is not an error.
+			#
+			try:
+				self._epoll.unregister(fd)
+			except (IOError, OSError) as e:
+				if e.errno not in (errno.EBADF, errno.ENOENT):
+					raise e
 		elif self._mode == PL_POLL:
 			return self._poll.unregister(fo)
 		elif self._mode == PL_SELECT:
@@ -259,6 +348,28 @@ class poll(object):
 					else:
 						raise Error("Unexpected filter 0x%x from kevent for fd %d" % (ke.filter, fd))
 				return evlist
+			elif self._mode == PL_EPOLL:
+				if timeout is None or timeout < 0:
+					timeout = -1
+				else:
+					timeout /= 1000.0
+				evlist = []
+				for fd, emask in self._epoll.poll(timeout):
+					if fd not in self._fd_map:			# pragma: no cover
+						raise Error("Unknown fd '%s' in select.epoll()" % (str(fd),))
+					mask = 0
+					if emask & select.EPOLLIN:
+						mask |= POLLIN
+					if emask & select.EPOLLPRI:
+						mask |= POLLPRI
+					if emask & select.EPOLLOUT:
+						mask |= POLLOUT
+					if emask & select.EPOLLERR:
+						mask |= POLLERR
+					if emask & select.EPOLLHUP:
+						mask |= POLLHUP
+					evlist.append((self._fd_map[fd], mask))
+				return evlist
 			elif self._mode == PL_POLL:
 				evlist = []
 				pllist = self._poll.poll(timeout)
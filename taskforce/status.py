@@ -63,6 +63,8 @@ class http(object):
 		self._httpd.register_post(r'/status/tasks', self.tasks)
 		self._httpd.register_get(r'/status/config', self.config)
 		self._httpd.register_post(r'/status/config', self.config)
+		self._httpd.register_get(r'/status/logs', self.logs)
+		self._httpd.register_post(r'/status/logs', self.logs)
 
 		self._formatters = {}
 		for attr in dir(self):
@@ -163,6 +165,13 @@ class http(object):
 		  		  task.  This does not necessarily correspond to the
 				  process list below if tasks are failing or the
 				  control is set to "off".
+		  state		- The task state, one of "idle", "waiting",
+				  "starting", "started", "stopping", "killing" or
+				  "stopped".
+		  start_latency	- Seconds from the first attempt to start the task,
+				  including time waiting for required tasks, until it
+				  was marked started.  Only present once the task has
+				  started.
 		  processes	- A list of the running processes for the task.
 		  		  Each entry may contain:
 				    pid		- The process ID of the process currently
@@ -177,6 +186,22 @@ class http(object):
 				    		  process exited.
 				    exit	- The status translated for human
 				    		  consumption.
+				    restarts	- The number of consecutive rapid exits
+						  counted toward the restart backoff.
+						  Only present when non-zero.
+				    next_start	- The ISO8601 date stamp before which the
+						  process will not be restarted because of
+						  backoff.
+				    next_start_t - The Unix time_t of next_start.
+				    parked	- The ISO8601 date stamp when the slot was
+						  parked for crash-looping.  A parked slot
+						  is not restarted until the task config
+						  changes.
+				    parked_t	- The Unix time_t of parked.
+				    outdated	- Present and true if the process was
+						  started from a config that has since
+						  changed and is waiting to be replaced by
+						  a rolling restart.
 
 		Not that the status and exit values are not cleared if the process
 		has successfully restarted.
@@ -193,6 +218,9 @@ class http(object):
 			if conf:
 				info['control'] = t._get(conf.get('control'))
 				info['count'] = t._get(conf.get('count'), default=1)
+				info['state'] = t.get_state()
+				if t._start_latency is not None:
+					info['start_latency'] = t._start_latency
 				info['processes'] = []
 				for p in t._proc_state:
 					if p is None: continue
@@ -210,7 +238,113 @@ class http(object):
 						proc['exited'] = utils.time2iso(p.exited)
 					if p.pending_sig is not None:				# pragma: no cover
 						proc['exit_pending'] = True
+					if p.restarts:
+						proc['restarts'] = p.restarts
+					if p.next_start is not None and p.pid is None:
+						proc['next_start_t'] = p.next_start
+						proc['next_start'] = utils.time2iso(p.next_start)
+					if p.parked is not None:
+						proc['parked_t'] = p.parked
+						proc['parked'] = utils.time2iso(p.parked)
+					if p.outdated and p.pid is not None:
+						proc['outdated'] = True
 					info['processes'].append(proc)
 			ans[name] = info
 
 		return self._format(ans, q)
+
+	def logs(self, path, postmap=None, **params):
+		"""
+		Return output held in the in-memory buffers of tasks with an
+		"output" config.  A path of just /status/logs returns a map of
+		task names, each a map of instance numbers to the "start" and
+		"end" offsets of the output held.
+
+		A path of /status/logs/<task> returns output for one instance of
+		the task, with these options:
+
+		  instance	- The process instance, default 0.
+		  offset	- Where to start, as an offset into all the output
+		  		  the instance has ever written.  A negative value
+				  is relative to the end.  The default is the oldest
+				  output held.
+		  limit		- The most bytes to return, default 65536.
+		  follow	- If true, the response is text/plain and is sent
+		  		  as the output arrives, until "timeout" seconds
+				  have passed, the task's output is reconfigured,
+				  or the client goes away.
+		  timeout	- Limit in seconds for "follow", default 300.
+
+		Without "follow", the response has the task and instance, the
+		"start" and "end" offsets of the output held, the "offset" of the
+		returned "text", and "next", the offset to use for the following
+		page.
+
+		Supports standard options.
+	"""
+		q = httpd.merge_query(path, postmap)
+		name = httpd.urlparse(path).path[len('/status/logs'):].strip('/')
+
+		if not name:
+			#  This runs in the HTTP handler thread so the dicts are
+			#  copied as the legion may be adding tasks or instances.
+			#
+			ans = {}
+			for tname, tinfo in list(self._legion._tasknames.items()):
+				out = tinfo[0]._output
+				if out is None or not out.buffers:
+					continue
+				ans[tname] = {}
+				for instance, buf in list(out.buffers.items()):
+					ans[tname][str(instance)] = {'start': buf.start, 'end': buf.end}
+			return self._format(ans, q)
+
+		tinfo = self._legion._tasknames.get(name)
+		if not tinfo:
+			return (404, 'Unknown task "%s"\n' % (name,), 'text/plain')
+		t = tinfo[0]
+		out = t._output
+		try:
+			instance = int(q.get('instance', [0])[0])
+			offset = q.get('offset', [None])[0]
+			if offset is not None:
+				offset = int(offset)
+			limit = int(q.get('limit', [65536])[0])
+			timeout = float(q.get('timeout', [300])[0])
+		except Exception as e:
+			return (400, 'Invalid option -- %s\n' % (str(e),), 'text/plain')
+		buf = out.buffers.get(instance) if out else None
+		if buf is None:
+			return (404, 'No output held for task "%s" instance %d\n' % (name, instance), 'text/plain')
+
+		if httpd.truthy(q.get('follow', [None])[0]):
+			return (200, self._follow(t, out, buf, offset, limit, timeout), 'text/plain')
+
+		offset, data = buf.read(offset, limit)
+		ans = {
+			'task': name,
+			'instance': instance,
+			'start': buf.start,
+			'end': buf.end,
+			'offset': offset,
+			'next': offset + len(data),
+			'text': data.decode('utf-8', 'replace'),
+		}
+		return self._format(ans, q)
+
+	def _follow(self, t, out, buf, offset, limit, timeout):
+		"""
+		Generator for the "follow" option of logs().  This runs in the
+		HTTP handler thread, not the legion.
+	"""
+		deadline = time.time() + timeout
+		while True:
+			offset, data = buf.read(offset, limit)
+			if data:
+				offset += len(data)
+				yield data
+				continue
+			remaining = deadline - time.time()
+			if remaining <= 0 or t._output is not out:
+				break
+			buf.wait(offset, min(remaining, 1.0))
@@ -17,8 +17,8 @@
 # ________________________________________________________________________
 #
 
-import sys, os, fcntl, pwd, grp, signal, errno, time, socket, select, yaml, re
-import logging
+import sys, os, stat, fcntl, pwd, grp, signal, errno, time, socket, select, yaml, re, string
+import logging, hashlib, json, heapq, random
 from . import utils
 from .utils import ses, deltafmt, statusfmt
 from . import poll
@@ -27,6 +27,8 @@ from . import watch_modules
 from . import httpd
 from . import manage
 from . import status
+from . import zygote
+from . import capture
 
 #  The seconds before a SIGTERM sent to a task is
 #  escalated to a SIGKILL.
@@ -39,9 +41,9 @@ sigkill_escalation = 5
 #
 sigterm_limit = sigkill_escalation*2
 
-#  These timeouts affect how rapidily the idle management is called.
-#  short_cycle is used when a task requests a rapid revisit, long_cycle
-#  is used otherwise.
+#  short_cycle is how soon a task is revisited when it asks for that.
+#  long_cycle is the period of the idle housekeeping cycle, which reloads
+#  config and scans watched files but does not visit tasks.
 #
 def_short_cycle = 0.25
 def_long_cycle = 5
@@ -50,10 +52,72 @@ def_long_cycle = 5
 #
 reexec_delay = 5
 
+#  Seconds between liveness probes of "nowait" task daemons, and the
+#  most "check" commands that will be run at once.
+#
+def_probe_interval = 5
+def_check_limit = 4
+
+#  Environment variable used to pass the fd holding the legion state to
+#  the re-executed program when the "handoff" param is set.
+#
+handoff_env = 'TASKFORCE_HANDOFF'
+
+#  Task state flags and process slot attributes carried across a handoff.
+#  The times are absolute so they hold in the new program image.
+#
+handoff_task_attrs = ['starting', 'started', 'start_request', 'stopping', 'terminated', 'killed',
+			'stopped', 'dnr', 'limit', 'start_latency', 'last_status']
+handoff_proc_attrs = ['instance', 'pid', 'started', 'exited', 'exit_code', 'restarts',
+			'next_start', 'parked', 'pending_sig', 'next_sig']
+
+#  The first fd passed to a process for socket activation, as defined by
+#  the systemd LISTEN_FDS protocol, and the default listen backlog.
+#
+listen_fds_start = 3
+def_backlog = 128
+
+#  Defaults for the task "backoff" map.  When a process exits before it
+#  has run for "reset" seconds, its restart delay is multiplied by "factor"
+#  up to "max_delay".  A "crash_limit" of 0 means instances are never
+#  parked.
+#
+def_backoff = {
+	'delay': reexec_delay,
+	'factor': 2.0,
+	'max_delay': 300.0,
+	'jitter': 0.0,
+	'reset': 60.0,
+	'crash_limit': 0,
+}
+
+#  Defaults for the task "rolling" map.  "batch" is the most processes
+#  that will be out of service at once during a rolling restart, and
+#  "delay" is how long a replacement must run before the next batch.
+#
+def_rolling = {
+	'batch': 1,
+	'delay': 0.0,
+}
+
 #  Point at which idle processing will be run regardless of other demands.
 #
 idle_starvation = def_long_cycle*3
 
+#  Task states, and the states each may move to.  Any state may also
+#  move to "idle", which is where a task is reset to before it is started
+#  or restarted.
+#
+task_states = {
+	'idle':		set(['waiting', 'starting', 'stopping', 'stopped']),
+	'waiting':	set(['starting', 'stopping', 'stopped']),
+	'starting':	set(['started', 'stopping', 'stopped']),
+	'started':	set(['starting', 'stopping', 'stopped']),
+	'stopping':	set(['killing', 'stopped']),
+	'killing':	set(['stopped']),
+	'stopped':	set(),
+}
+
 #  The module information published into the command formatting context and the environment
 #  of child processes is prefixed with this string to isolate the name space as best as possible.
 #
@@ -85,9 +149,14 @@ class LegionReset(Exception):
 Raised by the legion instance when it is requesting that the caller
 completely reset and restart.  This will happen if a SIGHUP is received
 or in the registered program receives a module change event.
+
+When the legion is handing its state over to the restarted program,
+"fds" lists descriptors that must be left open across the exec and
+"env" holds variables to add to the environment it is given.
 """
-	def __init__(self):
-		pass
+	def __init__(self, fds=None, env=None):
+		self.fds = fds if fds else []
+		self.env = env if env else {}
 	def __str__(self):
 		return "Legion reset"
 
@@ -100,6 +169,93 @@ class TaskError(Exception):
 		return "%s: %s" % ('Legion' if self.name is None else self.name, self.message)
 
 _fmt_context_isvar = re.compile(r'^\{(\w+)\}$')
+_fmt_context_parser = string.Formatter()
+_fmt_context_cache = {}
+_fmt_context_cache_limit = 4096
+_fmt_context_passes = 10
+
+#  Template compilation results other than a list of segments.
+#
+_FMT_CONSTANT = 'constant'		# Contains no braces, formats to itself
+_FMT_NONE_VAR = 'none_var'		# Exactly "{var}", may yield None
+_FMT_GENERAL = 'general'		# Needs str.format()
+_FMT_ERROR = 'error'			# Not formattable
+
+def _fmt_compile(arg):
+	"""
+	Parse a format string once into a plan that can be evaluated
+	against any context.  The result is cached per string, as parsing
+	does not depend on the context.
+
+	The plan is one of the _FMT_* values or a tuple of
+	(literal, name, format_spec) segments where "name" is None for
+	a trailing literal.  Segments are only produced for plain
+	"{name}" or "{name:spec}" fields, anything more involved is
+	left to str.format().
+"""
+	try:
+		return _fmt_context_cache[arg]
+	except KeyError:
+		pass
+	except TypeError:
+		return (_FMT_ERROR, None)
+
+	isvar = None
+	try:
+		if '{' not in arg and '}' not in arg:
+			plan = _FMT_CONSTANT
+		else:
+			m = _fmt_context_isvar.match(arg)
+			if m:
+				isvar = m.group(1)
+			plan = []
+			for literal, name, spec, conversion in _fmt_context_parser.parse(arg):
+				if name is not None:
+					if conversion or '{' in spec or not re.match(r'^\w+$', name) or name.isdigit():
+						plan = _FMT_GENERAL
+						break
+				plan.append((literal, name, spec))
+			if plan is not _FMT_GENERAL:
+				plan = tuple(plan)
+				if isvar:
+					plan = _FMT_NONE_VAR
+	except Exception:
+		plan = _FMT_ERROR
+
+	if len(_fmt_context_cache) >= _fmt_context_cache_limit:
+		_fmt_context_cache.clear()
+	_fmt_context_cache[arg] = (plan, isvar)
+	return (plan, isvar)
+
+def _fmt_pass(arg, context):
+	"""
+	Perform one formatting pass using the compiled plan for "arg".
+	Returns None if "arg" is exactly "{var}" where "var" is None in the
+	context.  Raises an exception for anything str.format() would reject.
+"""
+	plan, isvar = _fmt_compile(arg)
+	if plan is _FMT_CONSTANT:
+		return arg
+	if plan is _FMT_NONE_VAR:
+		#  Handle case where the var is in the context will
+		#  value None.  If this is left to formatting, it
+		#  gets converted to the string value "None".
+		#
+		if isvar in context and context[isvar] is None:
+			return None
+		return format(context[isvar], '')
+	if plan is _FMT_GENERAL:
+		return arg.format(**context)
+	if plan is _FMT_ERROR:
+		raise ValueError("Invalid format string")
+	parts = []
+	for literal, name, spec in plan:
+		if literal:
+			parts.append(literal)
+		if name is not None:
+			parts.append(format(context[name], spec))
+	return ''.join(parts)
+
 def _fmt_context(arg_list, context):
 	"""
 	Iterate on performing a format operation until the formatting makes no
@@ -111,6 +267,11 @@ def _fmt_context(arg_list, context):
 
 	For convenience, if passed a list, each element will be formatted and
 	the resulting list will be returned
+
+	Each string is compiled once by _fmt_compile() so a pass only looks up
+	the fields actually referenced rather than handing the whole context
+	to str.format().  If the passes start repeating, the result the full
+	number of passes would have produced is returned immediately.
 """
 	if arg_list is None:
 		return arg_list
@@ -122,33 +283,130 @@ def _fmt_context(arg_list, context):
 	for arg in arg_list:
 		if arg is None:									# pragma: no cover
 			continue
-		for attempt in range(0, 10):
-			res = None
+		chain = [arg]
+		for attempt in range(0, _fmt_context_passes):
 			try:
-				m = _fmt_context_isvar.match(arg)
-				if m and m.group(1) in context and context[m.group(1)] is None:
-					#  Handle case where the var is in the context will
-					#  value None.  If this is left to formatting, it
-					#  gets converted to the string value "None".
-					#
-					break
-				else:
-					res = arg.format(**context)
-					if res == arg:
-						break
-				arg = res
+				res = _fmt_pass(arg, context)
 			except:
-				if res is None:
-					#  If the formatting fails, revert to
-					#  last successful value and stop.
-					#
-					res = arg
+				#  If the formatting fails, revert to
+				#  last successful value and stop.
+				#
+				res = arg
+				break
+			if res is None or res == arg:
+				break
+			if res in chain:
+				#  The passes have entered a cycle, so the
+				#  outcome of the remaining passes is known.
+				#
+				start = chain.index(res)
+				res = chain[start + (_fmt_context_passes - start) % (len(chain) - start)]
 				break
+			chain.append(res)
+			arg = res
 		ans.append(res)
 	return (ans[0] if just_one else ans)
 
 std_process_dest = '/dev/null'
-def _exec_process(cmd_list, base_context, instance=0, log=None):
+def _config_digest(conf):
+	"""
+	Returns a digest of a config subtree which can be compared to detect
+	changes without holding or walking the previous copy.
+"""
+	text = json.dumps(conf, sort_keys=True, separators=(',', ':'), default=str)
+	return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+#  Stand-in for the child pid when checking whether a command can be
+#  fully formatted before the process exists.
+#
+_spawn_pid_probe = 2147483629
+
+def _spawn_path(prog, env):
+	"""
+	Locate "prog" the way os.execvpe() would, searching the PATH
+	from the new environment.  Returns None if it is not found.
+"""
+	if os.path.dirname(prog):
+		return prog
+	for d in env.get('PATH', os.defpath).split(os.pathsep):
+		path = os.path.join(d, prog)
+		if os.path.isfile(path) and os.access(path, os.X_OK):
+			return path
+	return None
+
+def _spawn_process(cmd_list, context, procname, name, instance, log, output=None):
+	"""
+	Start a process with os.posix_spawn() rather than forking the legion.
+	All formatting and fd setup is done here in the parent so the cost
+	does not depend on the size of the legion's address space.
+	If "output" is an fd, it becomes the process's stdout and stderr.
+
+	Returns the pid, or None if the command cannot be spawned this way,
+	in which case the caller should use the fork path.  This happens if
+	the command args or environment depend on the child's pid, other than
+	the pid itself which is not added to the environment.
+"""
+	probe = str(_spawn_pid_probe)
+	context[context_prefix+'pid'] = _spawn_pid_probe
+
+	prog = _fmt_context(cmd_list[0], context)
+	cmd = []
+	if procname:
+		cmd.append(_fmt_context(context['procname'], context))
+		cmd_list = cmd_list[1:]
+	for a in cmd_list:
+		cmd.append(_fmt_context(a, context))
+	for a in [prog] + cmd:
+		if probe in str(a):
+			log.debug("Command for '%s' uses the pid, can't spawn", name)
+			return None
+
+	env = {}
+	for tag, val in context.items():
+		if val is None or tag == context_prefix+'pid':
+			continue
+		val = _fmt_context(str(val), context)
+		if val is not None:
+			if probe in val:
+				log.debug("Environment for '%s' uses the pid in '%s', can't spawn", name, tag)
+				return None
+			env[tag] = val
+
+	path = _spawn_path(prog, env)
+	if path is None:
+		log.debug("Program '%s' for '%s' not found, leaving failure to fork path", prog, name)
+		return None
+
+	#  Match the fork path which closes everything except stdio and
+	#  redirects stdin, stdout, and stderr to std_process_dest.
+	#
+	open_fds = utils.open_fds()
+	if open_fds is None:
+		log.debug("Can't list open fds, can't spawn")
+		return None
+	file_actions = [(os.POSIX_SPAWN_OPEN, 0, std_process_dest, os.O_RDONLY, 0)]
+	if output is None:
+		file_actions.append((os.POSIX_SPAWN_OPEN, 1, std_process_dest, os.O_WRONLY, 0))
+	else:
+		file_actions.append((os.POSIX_SPAWN_DUP2, output, 1))
+	file_actions.append((os.POSIX_SPAWN_DUP2, 1, 2))
+	for fd in open_fds:
+		if fd > 2:
+			try:
+				if os.get_inheritable(fd):
+					file_actions.append((os.POSIX_SPAWN_CLOSE, fd))
+			except OSError:
+				pass
+
+	log.info("Spawning: %s <%s>", path, utils.format_cmd(cmd))
+	try:
+		return os.posix_spawn(path, cmd, env, file_actions=file_actions)
+	except OSError as e:
+		log.warning("Spawn of '%s' failed for task '%s', instance %d, will fork instead -- %s",
+						path, name, instance, str(e))
+		return None
+
+def _exec_process(cmd_list, base_context, instance=0, log=None, spawn=False, zygote=None, output=None, sockets=None):
 	"""
 	Process execution tool.
 
@@ -162,6 +420,19 @@ def _exec_process(cmd_list, base_context, instance=0, log=None):
 	context		- Task's context
 	instance	- An integer instance number used with multi-process tasks
 	log		- Logging object (default is nothing logged).
+	spawn		- If True, use os.posix_spawn() when the process does not
+			  need a uid, gid, or cwd change and its args do not depend
+			  on its pid.  Otherwise the legion is forked as usual.
+	zygote		- A zygote.spawner instance which will fork the process
+			  if it is available.  It is not used when "output" is
+			  set as the fd can't be passed to the zygote.
+	output		- If not None, an fd to use as the process's stdout and
+			  stderr instead of std_process_dest.  The caller still
+			  owns the fd and should close it after this returns.
+	sockets		- A list of (fd, name) for listening sockets to pass to
+			  the process using the systemd LISTEN_FDS protocol.
+			  The process is always forked by the legion as the
+			  LISTEN_PID value must be its pid.
 
 	The context is used to format command args.  In addition, these values will
 	be used to change the process execution environment:
@@ -253,11 +524,67 @@ def _exec_process(cmd_list, base_context, instance=0, log=None):
 	context[context_prefix+'uid'] = proc_uid
 	context[context_prefix+'gid'] = proc_gid
 
+	if spawn and hasattr(os, 'posix_spawn') and not (do_setuid or do_setgid or cwd is not None or sockets):
+		try:
+			pid = _spawn_process(cmd_list, context.copy(), procname, name, instance, log, output=output)
+		except Exception as e:
+			log.warning("Spawn setup for '%s' failed, will fork instead -- %s", name, str(e))
+			pid = None
+		if pid is not None:
+			return pid
+
+	spec = {
+		'cmd_list': cmd_list,
+		'context': context,
+		'procname': procname,
+		'name': name,
+		'instance': instance,
+		'uid': proc_uid,
+		'gid': proc_gid,
+		'setuid': do_setuid,
+		'setgid': do_setgid,
+		'cwd': cwd,
+		'output': output,
+		'sockets': sockets
+	}
+	if zygote is not None and output is None and not sockets:
+		pid = zygote.spawn(spec)
+		if pid is not None:
+			return pid
+
 	pid = os.fork()
 
 	#  Parent just returns pid
 	if pid > 0:
 		return pid
+	_exec_child(spec, log)
+
+def _set_inheritable(fd):
+	"""
+	Python 3 opens files as non-inheritable, so fds set up for a child
+	process must be marked to survive exec.
+"""
+	if hasattr(os, 'set_inheritable'):
+		os.set_inheritable(fd, True)
+
+def _exec_child(spec, log):
+	"""
+	The child side of _exec_process().  This runs in the forked child,
+	either of the legion or of a zygote, and never returns.  "spec" is
+	built by _exec_process() and describes the process to run.
+"""
+	cmd_list = list(spec['cmd_list'])
+	context = spec['context']
+	procname = spec['procname']
+	name = spec['name']
+	instance = spec['instance']
+	proc_uid = spec['uid']
+	proc_gid = spec['gid']
+	do_setuid = spec['setuid']
+	do_setgid = spec['setgid']
+	cwd = spec['cwd']
+	output = spec.get('output')
+	sockets = spec.get('sockets') or []
 
 	#  This section is processing the child.  Exceptions from this point must
 	#  never escape to outside handlers or we might create zombie init tasks.
@@ -314,6 +641,10 @@ def _exec_process(cmd_list, base_context, instance=0, log=None):
 		os._exit(84)
 	try:
 		retain_fds = [0,1,2]
+		if output is not None:
+			retain_fds.append(output)
+		for fd, fdname in sockets:
+			retain_fds.append(fd)
 		for log_fd in utils.log_filenos(log):
 			if log_fd not in retain_fds:
 				retain_fds.append(log_fd)
@@ -323,19 +654,29 @@ def _exec_process(cmd_list, base_context, instance=0, log=None):
 		except: pass
 		try:
 			fd = os.open(std_process_dest, os.O_RDONLY)
+			_set_inheritable(fd)
 		except Exception as e:
 			log.error("child read open of %s failed -- %s", std_process_dest, str(e))
 		if fd != 0:
 			log.error("child failed to redirect stdin to %s", std_process_dest)
 
-		try: os.close(1)
-		except: pass
-		try:
-			fd = os.open('/dev/null', os.O_WRONLY)
-		except Exception as e:
-			log.error("child write open of %s failed -- %s", std_process_dest, str(e))
-		if fd != 1:
-			log.error("child failed to redirect stdout to %s", std_process_dest)
+		if output is not None:
+			try:
+				fd = os.dup2(output, 1)
+				if output != 1:
+					os.close(output)
+			except Exception as e:
+				log.error("child redirect of stdout to capture pipe failed -- %s", str(e))
+		else:
+			try: os.close(1)
+			except: pass
+			try:
+				fd = os.open('/dev/null', os.O_WRONLY)
+				_set_inheritable(fd)
+			except Exception as e:
+				log.error("child write open of %s failed -- %s", std_process_dest, str(e))
+			if fd != 1:
+				log.error("child failed to redirect stdout to %s", std_process_dest)
 
 		#  Build a fresh environment based on context, with None values excluded and
 		#  all other values as strings, formatted where appropriate:
@@ -347,6 +688,10 @@ def _exec_process(cmd_list, base_context, instance=0, log=None):
 			val = _fmt_context(str(val), context)
 			if val is not None:
 				env[tag] = val
+		if sockets:
+			env['LISTEN_FDS'] = str(len(sockets))
+			env['LISTEN_PID'] = str(os.getpid())
+			env['LISTEN_FDNAMES'] = ':'.join(fdname for fd, fdname in sockets)
 	except Exception as e:
 		#  At this point we can still send logs to stderr, so log these
 		#  too, just in case.
@@ -355,11 +700,20 @@ def _exec_process(cmd_list, base_context, instance=0, log=None):
 			name, instance, str(e), exc_info=log.isEnabledFor(logging.DEBUG))
 		os._exit(85)
 	try:
-		try: os.close(2)
-		except: pass
-		try: os.dup(1)
+		#  dup2() rather than close() and dup() because python3 makes
+		#  a dup()ed fd non-inheritable, so it would be closed by exec.
+		#
+		try: os.dup2(1, 2)
 		except: pass
 
+		#  Move the sockets clear of their target range first so
+		#  none is overwritten before it has been moved.
+		#
+		high = [fcntl.fcntl(fd, fcntl.F_DUPFD, listen_fds_start + len(sockets)) for fd, fdname in sockets]
+		for pos, fd in enumerate(high):
+			os.dup2(fd, listen_fds_start + pos)
+			os.close(fd)
+
 		os.execvpe(prog, cmd, env)
 	except:
 		pass
@@ -368,6 +722,28 @@ def _exec_process(cmd_list, base_context, instance=0, log=None):
 	#
 	os._exit(86)
 
+class _pidfd_watch(object):
+	"""
+	Holds a Linux pidfd for a child process.  The fd becomes readable
+	when the process exits so it can be registered with poll.poll() to
+	wake the event loop for exactly that process.
+"""
+	def __init__(self, pid):
+		self.pid = pid
+		self._fd = os.pidfd_open(pid)
+
+	def fileno(self):
+		return self._fd
+
+	def close(self):
+		if self._fd is not None:
+			try: os.close(self._fd)
+			except: pass
+			self._fd = None
+
+	def __str__(self):
+		return 'pidfd(pid=%d, fd=%s)' % (self.pid, str(self._fd))
+
 class event_target(object):
 	"""
 This class encapsulates an action, providing an opaque object that can be registered
@@ -451,7 +827,9 @@ access must be done with blocking activity fed through the legion event loop.
 			else:
 				log.error("Event parent '%s' has no '%s' command configured", self._name, self._handler_arg)
 			return
-		pid = _exec_process(commands[self._handler_arg], self._parent._context, log=log)
+		pid = _exec_process(commands[self._handler_arg], self._parent._context,
+							log=log, spawn=self._parent._legion._spawn_mode,
+							zygote=self._parent._legion._zygote)
 		log.info("Forked pid %d for %s(%s)", pid, self._name, str(self._handler_arg))
 		self._parent._legion.proc_add(event_target(self._parent, 'command_exit', key=pid, arg=self._handler_arg, log=log))
 
@@ -462,7 +840,7 @@ access must be done with blocking activity fed through the legion event loop.
 		log = self._params.get('log', self._discard)
 		pid = self._key
 		status = details
-		why = statusfmt(status)
+		why = statusfmt(status) if status is not None else 'is no longer being watched'
 		if status:
 			log.warning("pid %d for %s(%s) %s", pid, self._name, str(self._handler_arg), why)
 		else:
@@ -475,18 +853,37 @@ access must be done with blocking activity fed through the legion event loop.
 		log = self._params.get('log', self._discard)
 		pid = self._key
 		exit_code = details
-		why = statusfmt(exit_code)
-		proc = None
-		for p in self._parent._proc_state:
-			if pid == p.pid:
-				proc = p
+		why = statusfmt(exit_code) if exit_code is not None else 'is no longer running'
+
+		#  The process state is normally passed as the handler arg,
+		#  fall back to a search if it no longer matches.
+		#
+		proc = self._handler_arg
+		if not isinstance(proc, ProcessState) or proc.pid != pid:
+			proc = None
+			for p in self._parent._proc_state:
+				if pid == p.pid:
+					proc = p
 		if proc is None:
 			log.error("Legion reported exit of unknown pid %s for task '%s' which %s",
 								str(pid), self._name, why)
 			return
 
+		#  The start command of a "nowait" task normally exits once the
+		#  daemon it starts has written its pidfile.  The daemon then
+		#  takes over the process slot and is watched by the legion probes.
+		#
+		if exit_code == 0 and not proc.daemon and not self._parent._terminated:
+			daemon_pid = self._parent._daemon_find(proc.instance)
+			if daemon_pid:
+				log.info("Task '%s' pid %d %s, daemon pid %d now running", self._name, pid, why, daemon_pid)
+				self._parent._daemon_adopt(proc, daemon_pid)
+				return
+
 		now = time.time()
+		self._parent._backoff(proc, now, expected=(self._parent._terminated or proc.pending_sig is not None))
 		proc.pid = None
+		proc.daemon = False
 		proc.exit_code = exit_code
 		proc.exited = now
 		proc.pending_sig = None
@@ -497,14 +894,42 @@ access must be done with blocking activity fed through the legion event loop.
 			self._parent._started = None
 			self._parent._stopping = None
 			self._parent._stopped = now
+			self._parent._set_state('stopped')
 			self._parent.onexit()
 		else:
 			log.debug("Task '%s' still has %d process%s running", self._name, extant, ses(extant, 'es'))
-		if exit_code and not self._parent._terminated:
+
+		#  Have the task managed straight away so a restart is not left
+		#  to the next idle cycle.
+		#
+		self._parent._legion.task_dirty(self._parent)
+		if exit_code is None and not self._parent._terminated:
+			log.warning("Task '%s' daemon pid %d %s -- unexpected exit", self._name, pid, why)
+		elif exit_code and not self._parent._terminated:
 			log.warning("Task '%s' pid %d %s -- unexpected error exit", self._name, pid, why)
 		else:
 			log.info("Task '%s' pid %d %s", self._name, pid, why)
 
+	def check_exit(self, details):
+		"""
+		Handle the exit of a "check" command run for a "nowait" daemon.
+		A non-zero exit means the daemon should be restarted, so it is
+		sent a SIGTERM, which the probes will escalate if needed.
+	"""
+		log = self._params.get('log', self._discard)
+		proc = self._handler_arg
+		legion = self._parent._legion
+		proc.checking = None
+		legion._checks_running -= 1
+		if details and proc.daemon and proc.pid is not None and proc.pending_sig is None:
+			log.warning("Task '%s' check of daemon pid %d %s, restarting", self._name, proc.pid, statusfmt(details))
+			self._parent._signal(signal.SIGTERM, pid=proc.pid)
+			proc.pending_sig = signal.SIGKILL
+			proc.next_sig = time.time() + sigkill_escalation
+		else:
+			log.debug("Task '%s' check %s", self._name, statusfmt(details))
+		legion._check_start()
+
 	def signal(self, details):
 		"""
 		Send a signal to all task processes.
@@ -684,6 +1109,29 @@ Params are:
 			  because this can cause the list of watched files
 			  to grow very large.  The PYTHONPATH default is
 			  normally a very good choice.
+	module_cache	- path of a file used to persist the import
+			  dependencies found for python modules so they are
+			  only parsed again when they change.  The default
+			  is to hold this information in memory only.
+	pidfd		- If true and the platform supports it, watch each
+			  child process via a pidfd rather than relying on
+			  SIGCHLD.  Each exit then wakes the event loop for
+			  just that process.
+	spawn		- If true, start processes with posix_spawn() where
+			  possible instead of forking the legion.  This is
+			  not possible for processes that change user, group,
+			  or directory, or whose args refer to their own pid.
+			  Spawned processes do not have the pid set in their
+			  environment.
+	zygote		- If true, start a separate zygote process when the
+			  legion starts managing, and have it fork the task
+			  processes so the legion itself is not forked.
+	handoff		- If true, a reset leaves all task processes running
+			  and the LegionReset exception carries the legion
+			  state and HTTP listening sockets.  If the caller
+			  re-execs with the fds and environment given in the
+			  exception, the new legion keeps managing the same
+			  processes and serving on the same sockets.
 	http		- Listen address for HTTP management and statistics
 			  service.
 	control		- If true, allow operations that can change the legion
@@ -784,6 +1232,21 @@ Params are:
 		#
 		self._config_running = None
 
+		#  Digest of the global sections of the running config (everything
+		#  except "tasks").  A change in these sections can affect every
+		#  task so it causes a full apply.
+		#
+		self._config_digest = None
+
+		#  Contexts are cached against a generation number which is
+		#  bumped whenever the legion config, the role set, or the
+		#  environment changes.  Tasks include it in their own cache
+		#  keys so a bump here invalidates every task context.
+		#
+		self._context_generation = 0
+		self._context_environ = None
+		self._context_cache = {}
+
 		#  Currently running http servers, empty list if none.
 		#
 		self._http_servers = []
@@ -803,10 +1266,42 @@ Params are:
 		self._tasks = set()
 		self._tasks_scoped = set()
 
+		#  Start order and dependency index built by task_list(), keyed
+		#  by "pending".  Rebuilt when the task graph generation or the
+		#  context generation changes.
+		#
+		self._task_graph = {}
+		self._task_graph_generation = 0
+
+		#  Tasks with a pending state change, for example because one of
+		#  their processes exited, a scheduled time arrived, or a task they
+		#  require started or stopped.  Only these are managed on each pass
+		#  of the event loop.
+		#
+		self._dirty = set()
+
+		#  Heap of (time, sequence, task) entries for tasks that need to be
+		#  managed at a specific time, for example to escalate a stop or
+		#  end a start delay.  The event loop sleeps until the earliest.
+		#
+		self._deadlines = []
+		self._deadline_seq = 0
+
+		#  The times still pending for each task.  Heap entries not
+		#  listed here have been superseded and are skipped.
+		#
+		self._deadline_pending = {}
+
 		#  Association of all pids with the task that owns the process
 		#
 		self._procs = {}
 
+		#  When set, only the pids in _procs and the zygote are reaped,
+		#  leaving other children to their owner.  The asyncio runner
+		#  sets this as the host application may run its own processes.
+		#
+		self._reap_known = False
+
 		#  The file watcher object.  This covers local watches like
 		#  the config and role files, and files watched on behalf
 		#  of tasks including non-python program executables.
@@ -824,7 +1319,8 @@ Params are:
 		#  modules being watched.
 		#
 		self._watch_modules = watch_modules.watch(log=log, timeout=0.3,
-						module_path=self._params.get('module_path', os.environ.get('PYTHONPATH')))
+						module_path=self._params.get('module_path', os.environ.get('PYTHONPATH')),
+						cache_file=self._params.get('module_cache'))
 		self._module_event_map = {}
 
 		#  The signal watcher.  This uses a self-pipe to cause the select event loop to
@@ -836,6 +1332,58 @@ Params are:
 			fl = fcntl.fcntl(fd, fcntl.F_GETFL)
 			fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
 
+		#  When pidfd reaping is selected, each child process is watched
+		#  by its own pidfd instead of via SIGCHLD, indexed by pid.  The
+		#  idle cycle still reaps any exit not seen via a pidfd.
+		#
+		self._pidfd_mode = False
+		if self._params.get('pidfd'):
+			if hasattr(os, 'pidfd_open'):
+				self._pidfd_mode = True
+			else:
+				log.warning("pidfd reaping is not available on this platform, using SIGCHLD")
+		self._pidfds = {}
+
+		#  Readers for the output capture pipes of task processes.
+		#
+		self._outputs = set()
+
+		#  Daemons of "nowait" tasks are not children of the legion, so
+		#  they are all probed for liveness in a single sweep at this time.
+		#  Queued "check" commands as (task, ProcessState).
+		#
+		self._probe_next = None
+		self._check_queue = []
+		self._checks_running = 0
+
+		#  Processes of "adopt" tasks left running by a prior legion,
+		#  indexed by (task name, instance).  This is built by a single
+		#  /proc scan when first needed.
+		#
+		self._adopt_index = None
+
+		#  Listening sockets opened for task "sockets" configs, indexed
+		#  by (type, listen).  These are kept open as long as any task
+		#  uses them so they survive process restarts.
+		#
+		self._sockets = {}
+
+		#  State handed over by the legion of the prior program image,
+		#  if any.  See _handoff_save().
+		#
+		self._handoff = self._handoff_load()
+
+		self._spawn_mode = False
+		if self._params.get('spawn'):
+			if hasattr(os, 'posix_spawn'):
+				self._spawn_mode = True
+			else:
+				log.warning("posix_spawn() is not available on this platform, processes will be forked")
+
+		#  The zygote.spawner instance when a zygote is running.
+		#
+		self._zygote = None
+
 	def _sig_handler(self, sig, frame):
 		log = self._params.get('log', self._discard)
 		if sig == signal.SIGCHLD:
@@ -888,6 +1436,9 @@ Params are:
 	def is_resetting(self):
 		return (self._exiting is not None and self._resetting is not None)
 
+	def is_handing_off(self):
+		return bool(self._params.get('handoff')) and self.is_resetting()
+
 	def next_timeout(self, timeout = def_short_cycle):
 		prev_timeout = self._timeout
 		if self._timeout > timeout:
@@ -914,6 +1465,30 @@ Params are:
 			return '()'
 		else:
 			return '(' + ', '.join(val) + ')'
+	def _context_invalidate(self):
+		"""
+		Discard all cached legion and task contexts.  This must be
+		called whenever an input to the contexts, other than a task's
+		own config, changes.
+	"""
+		self._context_generation += 1
+		self._context_cache = {}
+
+	def _context_environ_check(self):
+		"""
+		Invalidate the cached contexts if os.environ has changed since
+		the last check.  The environment is only checked when the config
+		is applied so changes made at other times will not be seen
+		until then.
+	"""
+		log = self._params.get('log', self._discard)
+		environ = hash(frozenset(os.environ.items()))
+		if environ != self._context_environ:
+			if self._context_environ is not None:
+				log.info("Environment has changed, contexts will be rebuilt")
+			self._context_environ = environ
+			self._context_invalidate()
+
 	def _context_build(self, pending=False):
 		"""
 		Create a context dict from standard legion configuration.
@@ -923,9 +1498,14 @@ Params are:
 		of pre-defined values which have a common prefix from 'context_prefix'.
 
 		This is similar to the task conext but without the task-specific entries.
+
+		The result is cached until the next call to _context_invalidate()
+		so it must be treated as read-only.
 	"""
 		log = self._params.get('log', self._discard)
 		log.debug("called with pending=%s", pending)
+		if pending in self._context_cache:
+			return self._context_cache[pending]
 		if pending:
 			conf = self._config_pending
 		else:
@@ -950,6 +1530,7 @@ Params are:
 			self._context_defaults(context, conf)
 		else:
 			log.warning("No legion config available for defines") 
+		self._context_cache[pending] = context
 		return context
 
 	def _get_http_services(self, http_list):
@@ -1057,7 +1638,7 @@ Params are:
 
 			#  At this point the service slot exists and is empty.  We'll attempt to fill it.
 			try:
-				server = httpd.server(need[pos], log=log)
+				server = httpd.server(need[pos], log=log, fd=self._handoff_http(need[pos].listen))
 
 				#  Add our own attribute to retain the service information
 				#
@@ -1110,6 +1691,7 @@ Params are:
 			log.info("Roles changing from '%s' to '%s'", self._fmt_set(self._role_set), self._fmt_set(new_role_set))
 		self._prev_role_set = self._role_set
 		self._role_set = new_role_set
+		self._context_invalidate()
 		return True
 
 	def set_roles_file(self, path):
@@ -1146,14 +1728,19 @@ Params are:
 		else:
 			return self._role_set
 
-	def _load_config(self):
+	def _load_config(self, full=False):
 		"""
 
 		Load the config which must contain YAML text.  This is called
 		at startup and whenever it changes.
 
-		Returns True if there was a change in config, False otherwise.
-		On any change, the config should be reapplied.
+		Only tasks whose own config has changed are re-applied, unless
+		the global sections of the config have changed or "full" is
+		True, in which case all tasks are re-applied.  "full" should be
+		set if some other input to the task configs, such as the role
+		set, has changed.
+
+		Returns True if the config was loaded, False otherwise.
 	"""
 		log = self._params.get('log', self._discard)
 
@@ -1172,17 +1759,43 @@ Params are:
 			return False
 
 		self._config_running = new_config
+		self._context_invalidate()
+
+		new_digest = _config_digest(dict((k, v) for k, v in new_config.items() if k != 'tasks'))
+		if new_digest != self._config_digest:
+			if self._config_digest:
+				log.info("Global config sections changed, all tasks will be re-applied")
+			self._config_digest = new_digest
+			full = True
 
-		for name in self._tasknames:
+		changed = set()
+		for name in list(self._tasknames):
 			if name not in new_config['tasks']:
 				self._tasknames[name][0].terminate()
+				full = True
 		for name in new_config['tasks']:
 			if name in self._tasknames:
 				t = self._tasknames[name][0]
+
+				#  Compare against the pending config rather than the last
+				#  config loaded so that changes made via the management
+				#  interface are reverted by a reload, as before.
+				#
+				if not full and t._config_pending is not None and \
+						_config_digest(new_config['tasks'][name]) == _config_digest(t._config_pending):
+					continue
 			else:
 				t = task(name, self, **self._params)
 			t.set_config(new_config['tasks'][name])
-		self._apply()
+			changed.add(t)
+		if full:
+			self._apply()
+		elif changed:
+			log.info("Config changed for %d task%s: %s",
+					len(changed), ses(len(changed)), ', '.join(sorted(t._name for t in changed)))
+			self._apply(changed=changed)
+		else:
+			log.info("Config reload found no task changes")
 		return True
 
 	def set_config_file(self, path):
@@ -1218,7 +1831,19 @@ Params are:
 		return self._config_file
 
 	def stop_all(self):
+		"""
+		Stop all tasks.  When the legion is exiting, "adopt" tasks are
+		left running so they can be adopted when it restarts.  When it
+		is handing off, all tasks are left running.
+	"""
+		log = self._params.get('log', self._discard)
 		for name, tinfo in self._tasknames.items():
+			if self.is_exiting() and tinfo[0]._adoptable():
+				log.debug("Leaving '%s' running for adoption", name)
+				continue
+			if self.is_handing_off():
+				log.debug("Leaving '%s' running for handoff", name)
+				continue
 			tinfo[0].stop()
 			
 	def task_add(self, t, periodic=None):
@@ -1233,6 +1858,7 @@ Params are:
 							(len(self._tasknames), ses(len(self._tasknames))))
 		self._tasknames[name] = (t, periodic)
 		self._tasks.add(t)
+		self._task_graph_invalidate()
 
 	def task_del(self, t):
 		"""
@@ -1245,6 +1871,9 @@ Params are:
 			del self._tasknames[name]
 		self._tasks.discard(t)
 		self._tasks_scoped.discard(t)
+		self._dirty.discard(t)
+		self._deadline_pending.pop(t, None)
+		self._task_graph_invalidate()
 		try:
 			t.stop()
 		except:
@@ -1260,162 +1889,863 @@ Params are:
 		else:
 			return None
 
-	def task_list(self, pending=True):
+	def _task_graph_invalidate(self):
 		"""
-		Return the list of scoped tasks (ie tasks that have
-		appropriate roles set) in correct execution order.
+		Discard the cached start order.  Tasks call this whenever their
+		config changes in a way that could change scope or requirements.
+	"""
+		self._task_graph_generation += 1
 
-		The result is a list of task objects.
+	def _task_graph_build(self, pending):
+		"""
+		Build the start order of the scoped tasks by topological sort.
+		Ties are broken by task name so the order is repeatable.
+
+		Returns a dict holding the "order" list, the scoped tasks by
+		"names", and the scoped tasks that require each task as
+		"dependents".
 	"""
 		log = self._params.get('log', self._discard)
 		tasks = [t for t in self._tasks if t.participant()]
+		names = dict((t._name, t) for t in tasks)
 		requires = {}
+		dependents = dict((t, set()) for t in tasks)
+		waiting = {}
 		for t in tasks:
 			requires[t] = t.get_requires(pending=pending)
-		done = set()
-		start_order = []
-		cycle = 0
-		while len(tasks) > len(start_order):
-			cycle += 1
-			changed = False
-			for t in tasks:
-				if t._name in done:
-					continue
-				needs = 0
-				for req in requires[t]:
-					if req._name in done:
-						needs += 1
-				if needs == len(requires[t]):
-					changed = True
-					start_order.append(t)
-					done.add(t._name)
-					log.debug("Found '%s' in scope", t._name)
-			if not changed:
-				log.error("Cycle %d failed after %s", cycle, str([t._name for t in set(tasks).difference(done)]))
-				raise TaskError(None, "At cycle %d, startup order conflict, processed %s, remaining %s" %
-						(cycle, str(done), str([t._name for t in set(tasks).difference(done)])))
-		log.debug("Cycle %d gave %s", cycle, str([t._name for t in start_order]))
-		return start_order
+			waiting[t] = len(set(requires[t]))
+			for req in set(requires[t]):
+				if req in dependents:
+					dependents[req].add(t)
 
-	def proc_add(self, ev):
+		ready = [t._name for t in tasks if waiting[t] == 0]
+		heapq.heapify(ready)
+		start_order = []
+		while ready:
+			t = names[heapq.heappop(ready)]
+			start_order.append(t)
+			log.debug("Found '%s' in scope", t._name)
+			for dep in dependents[t]:
+				waiting[dep] -= 1
+				if waiting[dep] == 0:
+					heapq.heappush(ready, dep._name)
+
+		if len(start_order) < len(tasks):
+			done = set(start_order)
+			remaining = [t for t in tasks if t not in done]
+			problem = self._task_graph_problem(remaining, requires, names)
+			log.error("Start order failed -- %s", problem)
+			raise TaskError(None, "Startup order conflict, %s, processed %s, remaining %s" %
+					(problem, str(sorted(t._name for t in start_order)), str(sorted(t._name for t in remaining))))
+		log.debug("Start order is %s", str([t._name for t in start_order]))
+		return {'order': start_order, 'names': names, 'dependents': dependents}
+
+	def _task_graph_problem(self, remaining, requires, names):
 		"""
-		Associate a process with the specfied task.  The event is fired
-		when the process exits, with details as the exit status.
+		Describe why the "remaining" tasks could not be ordered.  Either
+		one requires a task that is not in scope, or there is a cycle,
+		in which case the cycle path is given.
 	"""
-		self._procs[ev.get_key()] = ev
+		for t in sorted(remaining, key=lambda t: t._name):
+			for req in requires[t]:
+				if req._name not in names:
+					return "task '%s' requires '%s' which is not in scope" % (t._name, req._name)
+		remaining = set(remaining)
+		t = min(remaining, key=lambda t: t._name)
+		path = []
+		seen = {}
+		while t not in seen:
+			seen[t] = len(path)
+			path.append(t)
+			t = min((req for req in requires[t] if req in remaining), key=lambda t: t._name)
+		cycle = path[seen[t]:] + [t]
+		return "cycle " + ' -> '.join("'%s'" % (t._name,) for t in cycle)
+
+	def _task_graph_get(self, pending):
+		key = (self._task_graph_generation, self._context_generation)
+		cached = self._task_graph.get(pending)
+		if cached and cached[0] == key:
+			return cached[1]
+		graph = self._task_graph_build(pending)
+		self._task_graph[pending] = (key, graph)
+		return graph
 
-	def proc_del(self, pid):
+	def task_list(self, pending=True):
 		"""
-		Disassociate a process from the legion.  Note that is is almost
-		always called by the task -- it doesn't attempt to stop the actual
-		process so a direct call is almost always wrong.
+		Return the list of scoped tasks (ie tasks that have
+		appropriate roles set) in correct execution order.
+
+		The result is a list of task objects.
 	"""
-		if pid in self._procs:
-			del self._procs[pid]
-		else:
-			log = self._params.get('log', self._discard)
-			log.warning("Process %d missing from proc list during deletion", pid)
+		return list(self._task_graph_get(pending)['order'])
 
-	def module_add(self, ev, path=None):
+	def task_scoped(self, taskname, pending=True):
 		"""
-		Register for python module change events.  If there is a module change, the
-		task will be notified with a call t.event(action).
+		Return the task named if it is in scope, otherwise None.
 	"""
-		log = self._params.get('log', self._discard)
-		key = ev.get_key()
-		if key is None:
-			raise TaskError(name, "Attempt to register python module event with no key available")
-		log.debug("Adding path '%s' for task '%s', action %s", str(path), str(ev.get_name()), ev._handler_name)
-		self._watch_modules.add(key, command_path=path)
-		self._module_event_map[key] = ev
+		return self._task_graph_get(pending)['names'].get(taskname)
 
-	def module_del(self, key):
+	def task_dependents(self, t, pending=True):
 		"""
-		Deregister from python module change events.
+		Return the set of scoped tasks that directly require task "t".
 	"""
-		if key in self._module_event_map:
-			del self._module_event_map[key]
-		if key in self._watch_modules.names:
-			self._watch_modules.remove(key)
+		return set(self._task_graph_get(pending)['dependents'].get(t, ()))
 
-	def file_add(self, ev, paths):
+	def _tasks_scoped_ordered(self):
 		"""
-		Register for file change events.  If there is a change to the file, all
-		registered tasks will be notified with a call t.event(action).
-
-		Note that as multiple tasks might register an event on the same
-		path, each path is mapped to a dict of tasks pointing at actions.
-		A task can only register a single action with each path.
+		Return the scoped tasks in start order so that one pass can
+		start a task and then the tasks that require it.
 	"""
 		log = self._params.get('log', self._discard)
-		if not isinstance(paths, list):
-			paths = [paths]
-		for path in paths:
-			if path not in self._file_event_map:
-				self._watch_files.add(path)
-				self._file_event_map[path] = {}
-			self._file_event_map[path][ev.get_key()] = ev
-		log.debug("Added event key '%s', action '%s' to path%s: %s",
-					str(ev.get_key()), ev._handler_name, ses(len(paths)), str(paths))
-
-	def file_del(self, key, paths=None):
+		try:
+			order = [t for t in self.task_list(pending=False) if t in self._tasks_scoped]
+		except Exception as e:
+			log.debug("Start order unavailable -- %s", str(e))
+			return list(self._tasks_scoped)
+		if len(order) < len(self._tasks_scoped):
+			listed = set(order)
+			order.extend(t for t in self._tasks_scoped if t not in listed)
+		return order
+
+	def task_dirty(self, t):
 		"""
-		Deregister a task for file event changes.  If paths is None, all
-		paths assoicated with the task will be deregistered.
+		Queue task "t" to be managed on the next pass of the event loop.
 	"""
-		if paths is None:
-			paths = []
-			for path in self._file_event_map:
-				if key in self._file_event_map[path]:
-					paths.append(path)
-		elif not isinstance(paths, list):
-			paths = [paths]
-		for path in paths:
-			if key in self._file_event_map[path]:
-				del self._file_event_map[path][key]
-			if path in self._file_event_map and not self._file_event_map[path]:
-				self._watch_files.remove(path)
-				del self._file_event_map[path]
+		self._dirty.add(t)
 
-	def _reap(self):
+	def _task_ready(self, t):
 		"""
-		Reap all processes that have exited.  We try to reap bursts of
-		processes so that groups that cluster will tend to restart in the
-		configured order.
+		Called when task "t" has started or stopped so the tasks that
+		require it are checked straight away rather than on the next
+		cycle.
 	"""
-		log = self._params.get('log', self._discard)
 		try:
-			cnt = len(os.read(self._watch_child, 102400))
-			log.debug("%d byte%s read from self-pipe", cnt, ses(cnt))
-		except OSError as e:
-			if e.errno != errno.EAGAIN:
-				log.error("Self-pipe read failed -- %s", str(e))
+			self._dirty.update(self.task_dependents(t, pending=False))
 		except Exception as e:
-			log.error("Self-pipe read failed -- %s", str(e))
-		reaped = False
-		while True:
-			try:
-				(pid, status) = os.waitpid(-1, os.WNOHANG)
-			except OSError as e:
-				if e.errno == errno.ECHILD:
-					log.debug("No children to wait for")
-					pid = 0
-				else:
-					raise e
-			if pid > 0:
-				reaped = True
-				if pid in self._procs:
-					log.debug("Pid %d exited, firing event", pid)
-					self._procs[pid].handle(status)
-					self.proc_del(pid)
-				else:
-					log.error("Unknown pid %d %s, ignoring", pid, statusfmt(status))
-				continue
-			else:
-				return reaped
+			log = self._params.get('log', self._discard)
+			log.debug("Dependents of '%s' unavailable -- %s", t._name, str(e))
 
-	def _apply(self):
-		log = self._params.get('log', self._discard)
+	def _task_manage(self, t):
+		"""
+		Manage task "t".  If it asks to be revisited soon, that is
+		scheduled for the task alone rather than shortening the cycle
+		for every task.  Times already due for the task are satisfied
+		by this call so they are dropped.
+	"""
+		pending = self._deadline_pending.get(t)
+		if pending:
+			now = time.time()
+			self._deadline_pending[t] = set(when for when in pending if when > now)
+		if t.manage():
+			self.schedule(t, time.time() + self._params.get('short_cycle', def_short_cycle))
+
+	def _manage_dirty(self):
+		"""
+		Manage the queued tasks, in start order.  Managing these can
+		queue further tasks, which are handled in the same call, so a
+		chain of requirements starts without waiting for a cycle per link.
+		This continues while the legion is exiting so stopping tasks are
+		escalated on time.  Tasks do not start while the legion exits.
+	"""
+		passes = 0
+		while self._dirty and passes <= len(self._tasks):
+			passes += 1
+			dirty = self._dirty
+			self._dirty = set()
+			for t in self._tasks_scoped_ordered():
+				if t in dirty:
+					self._task_manage(t)
+		self._dirty = set()
+
+	def schedule(self, t, when):
+		"""
+		Arrange for task "t" to be managed at time "when".  Tasks use
+		this for any time-based change so the event loop can sleep until
+		exactly then rather than polling.  A task may be managed earlier
+		than requested, and it may have more than one time pending.
+		A time already pending for the task is not added again.
+	"""
+		pending = self._deadline_pending.setdefault(t, set())
+		if when in pending:
+			return
+		pending.add(when)
+		self._deadline_seq += 1
+		heapq.heappush(self._deadlines, (when, self._deadline_seq, t))
+
+	def _deadline_live(self, entry):
+		return entry[0] in self._deadline_pending.get(entry[2], ())
+
+	def _deadline_next(self):
+		while self._deadlines and not self._deadline_live(self._deadlines[0]):
+			heapq.heappop(self._deadlines)
+		return self._deadlines[0][0] if self._deadlines else None
+
+	def _deadlines_run(self):
+		"""
+		Manage the scoped tasks whose scheduled times have arrived.
+		Returns True if any were due.
+	"""
+		now = time.time()
+		due = False
+		while self._deadlines and self._deadlines[0][0] <= now:
+			entry = heapq.heappop(self._deadlines)
+			if not self._deadline_live(entry):
+				continue
+			self._deadline_pending[entry[2]].discard(entry[0])
+			self._dirty.add(entry[2])
+			due = True
+		if due:
+			self._manage_dirty()
+		return due
+
+	def proc_add(self, ev):
+		"""
+		Associate a process with the specfied task.  The event is fired
+		when the process exits, with details as the exit status.
+	"""
+		pid = ev.get_key()
+		self._procs[pid] = ev
+		if self._pidfd_mode:
+			log = self._params.get('log', self._discard)
+			try:
+				watch = _pidfd_watch(pid)
+			except Exception as e:
+				log.warning("pidfd open failed for pid %d, exit will be seen on idle cycle -- %s", pid, str(e))
+				return
+			self._pidfds[pid] = watch
+			if self._pset is not None:
+				self._pset.register(watch, poll.POLLIN)
+
+	def _pidfd_del(self, pid):
+		watch = self._pidfds.pop(pid, None)
+		if watch:
+			if self._pset is not None:
+				try: self._pset.unregister(watch)
+				except: pass
+			watch.close()
+
+	def _probe_add(self):
+		"""
+		Called when a "nowait" daemon is adopted to make sure a probe
+		sweep is pending.
+	"""
+		if self._probe_next is None:
+			self._probe_next = time.time() + self._params.get('probe_interval', def_probe_interval)
+
+	def _probe_run(self):
+		"""
+		Check the liveness of all "nowait" daemons at once and queue the
+		"check" command for those tasks that have one.  Another sweep is
+		set up if there are still daemons to watch.
+	"""
+		log = self._params.get('log', self._discard)
+		tasks = [t for t in self._tasks_scoped if t._daemon_procs()]
+		self._probe_next = None
+		if not tasks:
+			return
+		pids = []
+		for t in tasks:
+			pids.extend(proc.pid for proc in t._daemon_procs())
+		live = utils.pids_alive(pids)
+		log.debug("Probed %d daemon%s, %d running", len(pids), ses(len(pids)), len(live))
+		for t in tasks:
+			t._daemon_probe(live)
+			conf = t._config_running or {}
+			if 'check' in conf.get('commands', {}):
+				for proc in t._daemon_procs():
+					if proc.checking is None and proc.pending_sig is None:
+						proc.checking = True
+						self._check_queue.append((t, proc))
+		self._check_start()
+		if any(t._daemon_procs() for t in tasks):
+			self._probe_add()
+
+	def _check_start(self):
+		"""
+		Start queued "check" commands, keeping no more than "check_limit"
+		running.  Each is a child process whose exit is handled by
+		event_target.check_exit().
+	"""
+		log = self._params.get('log', self._discard)
+		limit = self._params.get('check_limit', def_check_limit)
+		while self._check_queue and self._checks_running < limit:
+			t, proc = self._check_queue.pop(0)
+			if not proc.daemon or proc.pid is None or not t._config_running:
+				proc.checking = None
+				continue
+			try:
+				pid = _exec_process(t._config_running['commands']['check'], t._context,
+								instance=proc.instance, log=log, spawn=self._spawn_mode,
+								zygote=self._zygote)
+			except Exception as e:
+				log.error("Task '%s' check failed to start -- %s", t._name, str(e))
+				proc.checking = None
+				continue
+			proc.checking = pid
+			self._checks_running += 1
+			self.proc_add(event_target(t, 'check_exit', key=pid, arg=proc, log=log))
+
+	def _adopt_scan(self):
+		"""
+		Build the index of processes left running for "adopt" tasks.  Task
+		processes carry the task name and instance in their environment,
+		so one pass over /proc finds them all.  Only processes owned by
+		the legion's user are considered, unless it is running as root.
+		Where a task's process has started others, the topmost is used.
+	"""
+		log = self._params.get('log', self._discard)
+		self._adopt_index = {}
+		names = set(name for name, tinfo in self._tasknames.items() if tinfo[0]._adoptable(pending=True))
+		if not names:
+			return
+		try:
+			pids = [int(name) for name in os.listdir('/proc') if name.isdigit()]
+		except OSError as e:
+			log.warning("Process scan for adoption failed -- %s", str(e))
+			return
+		euid = os.geteuid()
+		me = os.getpid()
+		found = {}
+		for pid in pids:
+			if pid == me:
+				continue
+			try:
+				if euid != 0 and os.stat('/proc/%d' % (pid,)).st_uid != euid:
+					continue
+			except OSError:
+				continue
+			pstat = utils.proc_stat(pid)
+			if not pstat or pstat[0] == 'Z':
+				continue
+			env = utils.proc_environ(pid)
+			if not env or env.get(context_prefix+'name') not in names:
+				continue
+			try:
+				instance = int(env.get(context_prefix+'instance', 0))
+			except ValueError:
+				continue
+			found[pid] = ((env[context_prefix+'name'], instance), pstat[1])
+		for pid, (key, ppid) in found.items():
+			if ppid in found and found[ppid][0] == key:
+				continue
+			self._adopt_index[key] = pid
+		log.info("Found %d process%s to adopt", len(self._adopt_index), ses(len(self._adopt_index), 'es'))
+
+	def _adopt_pid(self, name, instance):
+		"""
+		Returns the pid of a running process left for "instance" of task
+		"name", or None.  Each pid is returned once.
+	"""
+		if self._adopt_index is None:
+			self._adopt_scan()
+		pid = self._adopt_index.pop((name, instance), None)
+		if pid is not None and not utils.pids_alive([pid]):
+			pid = None
+		return pid
+
+	def socket_get(self, listen, stype='stream', backlog=def_backlog):
+		"""
+		Returns a listening socket for "listen", opening it if no task
+		already has it open.  "listen" is "[host]:port" for TCP or UDP,
+		or a path for a Unix domain socket.  "stype" is "stream" or
+		"dgram".  Raises an exception if the socket can't be opened.
+	"""
+		log = self._params.get('log', self._discard)
+		key = (stype, listen)
+		if key in self._sockets:
+			return self._sockets[key]
+		if stype not in ('stream', 'dgram'):
+			raise TaskError(None, "Unknown socket type '%s' for '%s'" % (stype, listen))
+		socktype = socket.SOCK_STREAM if stype == 'stream' else socket.SOCK_DGRAM
+
+		fd = self._handoff['sockets'].pop('%s %s' % key, None) if self._handoff else None
+		if fd is not None:
+			if '/' in listen:
+				family = socket.AF_UNIX
+			else:
+				family = socket.AF_INET6 if ':' in listen.rsplit(':', 1)[0] else socket.AF_INET
+			sock = socket.fromfd(fd, family, socktype)
+			os.close(fd)
+			log.info("Using handed off %s socket '%s'", stype, listen)
+		elif '/' in listen:
+			sock = socket.socket(socket.AF_UNIX, socktype)
+			try:
+				if stat.S_ISSOCK(os.stat(listen).st_mode):
+					os.unlink(listen)
+			except OSError:
+				pass
+			sock.bind(listen)
+		else:
+			m = re.match(r'^\[?(.*?)\]?:(\d+)$', listen)
+			if not m:
+				raise TaskError(None, "Socket listen '%s' must be '[host]:port' or a path" % (listen,))
+			host = m.group(1) if m.group(1) else None
+			addr = socket.getaddrinfo(host, int(m.group(2)), socket.AF_UNSPEC, socktype, 0, socket.AI_PASSIVE)[0]
+			sock = socket.socket(addr[0], socktype)
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			sock.bind(addr[4])
+		if stype == 'stream' and fd is None:
+			sock.listen(backlog)
+		fl = fcntl.fcntl(sock.fileno(), fcntl.F_GETFD)
+		fcntl.fcntl(sock.fileno(), fcntl.F_SETFD, fl | fcntl.FD_CLOEXEC)
+		log.info("Opened %s socket '%s' for tasks", stype, listen)
+		self._sockets[key] = sock
+		return sock
+
+	def _sockets_prune(self):
+		"""
+		Close any listening sockets no longer used by a task.
+	"""
+		log = self._params.get('log', self._discard)
+		used = set()
+		for t in self._tasks:
+			used.update(t._socket_keys)
+		for key in list(self._sockets):
+			if key not in used:
+				log.info("Closing %s socket '%s', no longer used", key[0], key[1])
+				self._socket_close(key)
+
+	def _socket_close(self, key):
+		sock = self._sockets.pop(key)
+		try: sock.close()
+		except: pass
+		if '/' in key[1]:
+			try: os.unlink(key[1])
+			except: pass
+
+	def _handoff_save(self):
+		"""
+		Write the state needed to carry on managing the task processes to
+		an fd that will survive exec, and detach the HTTP servers and output
+		capture readers so their fds do too.  Returns a LegionReset that
+		passes the fds and environment on to the caller.
+	"""
+		log = self._params.get('log', self._discard)
+		state = {'pid': os.getpid(), 'saved': time.time(), 'tasks': {}, 'http': [], 'outputs': [], 'sockets': []}
+		for name, tinfo in self._tasknames.items():
+			t = tinfo[0]
+			state['tasks'][name] = {
+				'state': t._state,
+				'flags': dict((attr, getattr(t, '_' + attr)) for attr in handoff_task_attrs),
+				'procs': [dict((attr, getattr(proc, attr)) for attr in handoff_proc_attrs)
+										for proc in t._proc_state]
+			}
+		fds = []
+		for server in self._http_servers:
+			if server:
+				if self._pset is not None:
+					try: self._pset.unregister(server)
+					except: pass
+				fd = server.detach()
+				fds.append(fd)
+				state['http'].append({'listen': server._http_service.listen, 'fd': fd})
+		self._http_servers = []
+		for key, sock in self._sockets.items():
+			fd = os.dup(sock.fileno())
+			_set_inheritable(fd)
+			fds.append(fd)
+			state['sockets'].append({'key': '%s %s' % key, 'fd': fd})
+			sock.close()
+		self._sockets = {}
+		for reader in list(self._outputs):
+			if reader.name is None:
+				continue
+			if self._pset is not None:
+				try: self._pset.unregister(reader)
+				except: pass
+			self._outputs.discard(reader)
+			fd = reader.detach()
+			fds.append(fd)
+			state['outputs'].append({'name': reader.name, 'instance': reader.instance, 'fd': fd})
+
+		data = json.dumps(state).encode('utf-8')
+		if hasattr(os, 'memfd_create'):
+			fd = os.memfd_create('taskforce-handoff', 0)
+		else:
+			import tempfile
+			with tempfile.TemporaryFile() as f:
+				fd = os.dup(f.fileno())
+		_set_inheritable(fd)
+		while data:
+			data = data[os.write(fd, data):]
+		os.lseek(fd, 0, os.SEEK_SET)
+		fds.append(fd)
+		log.info("Handing off %d task%s, %d HTTP service%s, %d output%s",
+					len(state['tasks']), ses(len(state['tasks'])),
+					len(state['http']), ses(len(state['http'])),
+					len(state['outputs']), ses(len(state['outputs'])))
+		return LegionReset(fds=fds, env={handoff_env: str(fd)})
+
+	def _handoff_load(self):
+		"""
+		Read the state written by _handoff_save() in the prior program
+		image, if any, and index it for use as tasks and services start.
+	"""
+		log = self._params.get('log', self._discard)
+		val = os.environ.pop(handoff_env, None)
+		if not val:
+			return None
+		try:
+			fd = int(val)
+			os.lseek(fd, 0, os.SEEK_SET)
+			data = b''
+			while True:
+				chunk = os.read(fd, 65536)
+				if not chunk:
+					break
+				data += chunk
+			os.close(fd)
+			state = json.loads(data.decode('utf-8'))
+		except Exception as e:
+			log.error("Could not load handed off state from fd %s -- %s", val, str(e))
+			return None
+		handoff = {'tasks': {}, 'procs': {}, 'http': {}, 'outputs': {}, 'sockets': {}}
+		for name, saved in state.get('tasks', {}).items():
+			#  Older images handed off just the list of running processes.
+			#
+			if isinstance(saved, list):
+				saved = {'procs': saved}
+			handoff['tasks'][name] = saved
+			for proc in saved.get('procs', []):
+				if proc.get('pid') is not None:
+					handoff['procs'][(name, proc['instance'])] = proc
+		for item in state.get('http', []):
+			handoff['http'][item['listen']] = item['fd']
+		for item in state.get('outputs', []):
+			handoff['outputs'][(item['name'], item['instance'])] = item['fd']
+		for item in state.get('sockets', []):
+			handoff['sockets'][item['key']] = item['fd']
+		log.info("Loaded state handed off %s ago by pid %d, %d process%s",
+					deltafmt(time.time() - state.get('saved', time.time())), state.get('pid', 0),
+					len(handoff['procs']), ses(len(handoff['procs']), 'es'))
+		return handoff
+
+	def _handoff_task(self, name):
+		"""
+		Returns the handed off state of task "name", or None if there is
+		none.  The state is only returned once.
+	"""
+		if not self._handoff:
+			return None
+		return self._handoff['tasks'].pop(name, None)
+
+	def _handoff_http(self, listen):
+		if self._handoff:
+			return self._handoff['http'].pop(listen, None)
+		return None
+
+	def _handoff_proc(self, name, instance):
+		"""
+		Returns the handed off state for "instance" of task "name" if the
+		process is still running, otherwise None.  Any handed off output
+		capture fd is returned with it.
+	"""
+		if not self._handoff:
+			return None
+		saved = self._handoff['procs'].pop((name, instance), None)
+		output = self._handoff['outputs'].pop((name, instance), None)
+		if saved and utils.pids_alive([saved['pid']]):
+			saved['output'] = output
+			return saved
+		if output is not None:
+			os.close(output)
+		return None
+
+	def _handoff_finish(self):
+		"""
+		Called once the first config has been applied to close handed off
+		fds that are no longer needed.  Processes of tasks that have not
+		yet started remain available to them.
+	"""
+		log = self._params.get('log', self._discard)
+		if not self._handoff:
+			return
+		for listen, fd in self._handoff['http'].items():
+			log.info("Closing handed off HTTP service '%s' no longer configured", listen)
+			os.close(fd)
+		self._handoff['http'] = {}
+		for name in list(self._handoff['tasks']):
+			if name not in self._tasknames:
+				del self._handoff['tasks'][name]
+		for key in list(self._handoff['procs']):
+			if key[0] not in self._tasknames:
+				log.warning("Handed off task '%s' is no longer configured, pid %d left running",
+								key[0], self._handoff['procs'][key]['pid'])
+				del self._handoff['procs'][key]
+		for key in list(self._handoff['outputs']):
+			if key not in self._handoff['procs']:
+				os.close(self._handoff['outputs'].pop(key))
+		for key, fd in self._handoff['sockets'].items():
+			log.info("Closing handed off socket '%s' no longer used", key)
+			os.close(fd)
+		self._handoff['sockets'] = {}
+
+	def output_add(self, reader):
+		"""
+		Register a capture.reader so the output of a task process is
+		handled by the event loop.
+	"""
+		self._outputs.add(reader)
+		if self._pset is not None:
+			self._pset.register(reader, poll.POLLIN)
+
+	def _output_del(self, reader):
+		if self._pset is not None:
+			try: self._pset.unregister(reader)
+			except: pass
+		reader.close()
+		self._outputs.discard(reader)
+
+	def proc_del(self, pid):
+		"""
+		Disassociate a process from the legion.  Note that is is almost
+		always called by the task -- it doesn't attempt to stop the actual
+		process so a direct call is almost always wrong.
+	"""
+		self._pidfd_del(pid)
+		if pid in self._procs:
+			del self._procs[pid]
+		else:
+			log = self._params.get('log', self._discard)
+			log.warning("Process %d missing from proc list during deletion", pid)
+
+	def module_add(self, ev, path=None):
+		"""
+		Register for python module change events.  If there is a module change, the
+		task will be notified with a call t.event(action).
+	"""
+		log = self._params.get('log', self._discard)
+		key = ev.get_key()
+		if key is None:
+			raise TaskError(name, "Attempt to register python module event with no key available")
+		log.debug("Adding path '%s' for task '%s', action %s", str(path), str(ev.get_name()), ev._handler_name)
+		self._watch_modules.add(key, command_path=path)
+		self._module_event_map[key] = ev
+
+	def module_del(self, key):
+		"""
+		Deregister from python module change events.
+	"""
+		if key in self._module_event_map:
+			del self._module_event_map[key]
+		if key in self._watch_modules.names:
+			self._watch_modules.remove(key)
+
+	def file_add(self, ev, paths):
+		"""
+		Register for file change events.  If there is a change to the file, all
+		registered tasks will be notified with a call t.event(action).
+
+		Note that as multiple tasks might register an event on the same
+		path, each path is mapped to a dict of tasks pointing at actions.
+		A task can only register a single action with each path.
+	"""
+		log = self._params.get('log', self._discard)
+		if not isinstance(paths, list):
+			paths = [paths]
+		for path in paths:
+			if path not in self._file_event_map:
+				self._watch_files.add(path)
+				self._file_event_map[path] = {}
+			self._file_event_map[path][ev.get_key()] = ev
+		log.debug("Added event key '%s', action '%s' to path%s: %s",
+					str(ev.get_key()), ev._handler_name, ses(len(paths)), str(paths))
+
+	def file_del(self, key, paths=None):
+		"""
+		Deregister a task for file event changes.  If paths is None, all
+		paths assoicated with the task will be deregistered.
+	"""
+		if paths is None:
+			paths = []
+			for path in self._file_event_map:
+				if key in self._file_event_map[path]:
+					paths.append(path)
+		elif not isinstance(paths, list):
+			paths = [paths]
+		for path in paths:
+			if key in self._file_event_map[path]:
+				del self._file_event_map[path][key]
+			if path in self._file_event_map and not self._file_event_map[path]:
+				self._watch_files.remove(path)
+				del self._file_event_map[path]
+
+	def _reap(self):
+		"""
+		Reap all processes that have exited.  We try to reap bursts of
+		processes so that groups that cluster will tend to restart in the
+		configured order.
+	"""
+		log = self._params.get('log', self._discard)
+		try:
+			cnt = len(os.read(self._watch_child, 102400))
+			log.debug("%d byte%s read from self-pipe", cnt, ses(cnt))
+		except OSError as e:
+			if e.errno != errno.EAGAIN:
+				log.error("Self-pipe read failed -- %s", str(e))
+		except Exception as e:
+			log.error("Self-pipe read failed -- %s", str(e))
+		reaped = False
+		for (pid, status) in self._reap_wait():
+			reaped = True
+			if self._zygote is not None and pid == self._zygote.pid:
+				log.error("Zygote pid %d %s, processes will be forked by the legion", pid, statusfmt(status))
+				self._zygote_stop()
+			else:
+				self._proc_exit(pid, status)
+		return reaped
+
+	def _reap_wait(self):
+		"""
+		Generates (pid, status) for each child process that has exited.
+		With _reap_known set, each known pid is waited for in turn,
+		otherwise any child is collected.
+	"""
+		log = self._params.get('log', self._discard)
+		if self._reap_known:
+			pids = list(self._procs)
+			if self._zygote is not None:
+				pids.append(self._zygote.pid)
+			for pid in pids:
+				try:
+					(wpid, status) = os.waitpid(pid, os.WNOHANG)
+				except OSError as e:
+					#  Adopted daemons and processes started by the
+					#  zygote are not children of the legion.
+					#
+					if e.errno != errno.ECHILD:
+						raise e
+					continue
+				if wpid == pid:
+					yield (pid, status)
+			return
+		while True:
+			try:
+				(pid, status) = os.waitpid(-1, os.WNOHANG)
+			except OSError as e:
+				if e.errno == errno.ECHILD:
+					log.debug("No children to wait for")
+					pid = 0
+				else:
+					raise e
+			if pid <= 0:
+				return
+			yield (pid, status)
+
+	def _proc_exit(self, pid, status):
+		"""
+		Fire the exit event for a process that has been reaped.
+	"""
+		log = self._params.get('log', self._discard)
+		if pid in self._procs:
+			log.debug("Pid %d exited, firing event", pid)
+			self._procs[pid].handle(status)
+			self.proc_del(pid)
+		else:
+			log.error("Unknown pid %d %s, ignoring", pid, statusfmt(status))
+
+	def _reap_pidfd(self, watch):
+		"""
+		Reap the process whose pidfd became readable.  If it has
+		already been reaped by _reap(), the pidfd is just discarded.
+	"""
+		log = self._params.get('log', self._discard)
+		pid = watch.pid
+		try:
+			(wpid, status) = os.waitpid(pid, os.WNOHANG)
+		except OSError as e:
+			if e.errno != errno.ECHILD:
+				raise e
+			log.debug("Pid %d was already reaped", pid)
+			self._pidfd_del(pid)
+			return False
+		if wpid != pid:
+			return False
+		self._pidfd_del(pid)
+		self._proc_exit(pid, status)
+		return True
+
+	def _zygote_start(self):
+		log = self._params.get('log', self._discard)
+		try:
+			self._zygote = zygote.spawner(log=log)
+			log.info("Task processes will be forked by zygote pid %d", self._zygote.pid)
+		except Exception as e:
+			log.error("Zygote start failed, processes will be forked by the legion -- %s", str(e))
+			self._zygote = None
+
+	def _zygote_stop(self, wait=False):
+		"""
+		Disconnect from the zygote, which will then exit.  If "wait" is
+		True, the zygote is reaped here, being killed if it does not exit
+		promptly.
+
+		Processes the zygote started that are still running will no longer
+		have their exits reported, so task processes are handed to the
+		liveness probes, as adopted daemons are.  Other commands it started
+		are treated as having exited as they can't be followed.
+	"""
+		log = self._params.get('log', self._discard)
+		if self._zygote is None:
+			return
+		if self._pset is not None:
+			try: self._pset.unregister(self._zygote)
+			except: pass
+		exits = self._zygote.get()
+		self._zygote.close()
+		pid = self._zygote.pid
+		orphans = self._zygote.running()
+		self._zygote = None
+		for (opid, status) in exits:
+			self._proc_exit(opid, status)
+		for opid in orphans:
+			ev = self._procs.get(opid)
+			if ev is None:
+				continue
+			self.proc_del(opid)
+			proc = ev._handler_arg
+			if ev._handler_name == 'proc_exit' and isinstance(proc, ProcessState) and proc.pid == opid:
+				log.info("Task '%s' instance %d pid %d was started by the zygote, will be probed",
+								ev._name, proc.instance, opid)
+				ev._parent._daemon_adopt(proc, opid)
+			else:
+				ev.handle(None)
+		if not wait:
+			return
+		try:
+			for attempt in range(0, 20):
+				if os.waitpid(pid, os.WNOHANG)[0] == pid:
+					return
+				time.sleep(0.05)
+			os.kill(pid, signal.SIGKILL)
+			os.waitpid(pid, 0)
+		except Exception as e:
+			log.warning("Reaping zygote pid %d failed -- %s", pid, str(e))
+
+	def _zygote_exits(self):
+		"""
+		Fire exit events for processes reported by the zygote.
+		Returns True if there were any.
+	"""
+		if self._zygote is None:
+			return False
+		exits = self._zygote.get()
+		if self._zygote.closed():
+			log = self._params.get('log', self._discard)
+			log.error("Lost contact with zygote pid %d, processes will be forked by the legion", self._zygote.pid)
+			self._zygote_stop(wait=True)
+		for pid, status in exits:
+			self._proc_exit(pid, status)
+		return len(exits) > 0
+
+	def _apply(self, changed=None):
+		"""
+		Bring the running tasks into line with their pending configs.
+		If "changed" is a set of tasks, only those tasks and tasks newly
+		in scope are applied.  Otherwise, all scoped tasks are applied.
+	"""
+		log = self._params.get('log', self._discard)
+		self._context_environ_check()
 		self._context = self._context_build()
 
 		self._manage_http_servers()
@@ -1430,26 +2760,39 @@ Params are:
 			if t not in self._tasks_scoped:
 				log.info("Adding task '%s' to scope", t.get_name())
 				self._tasks_scoped.add(t)
-			t.apply()
-
-	def manage(self):
-		log = self._params.get('log', self._discard)
-		timeout_short_cycle = self._params.get('short_cycle', def_short_cycle)
-		timeout_long_cycle = self._params.get('long_cycle', def_long_cycle)
+			elif changed is not None and t not in changed:
+				continue
+			if t.apply():
+				self.schedule(t, time.time() + self._params.get('short_cycle', def_short_cycle))
+		self._sockets_prune()
+		self._manage_dirty()
 
-		self._set_handler(signal.SIGHUP)
-		self._set_handler(signal.SIGINT, ignore=True)
-		self._set_handler(signal.SIGCHLD)
-		self._set_handler(signal.SIGTERM)
+	def _manage_setup(self, pset):
+		"""
+		Prepare to manage, with "pset" as the poll set that will deliver
+		events.  This is shared by manage() and the asyncio runner, which
+		passes an object with the same register() and unregister()
+		methods.
+	"""
+		if self._params.get('zygote'):
+			self._zygote_start()
 		self._apply()
-
-		last_timeout = None
-		last_idle_run = time.time()
-		exit_report = 0
-		self._pset = poll.poll()
-		log.info("File event polling via %s from %s available",
-						self._pset.get_mode_name(), self._pset.get_available_mode_names())
-		self._pset.register(self._watch_child, poll.POLLIN)
+		self._handoff_finish()
+
+		self._last_timeout = None
+		self._last_idle_run = time.time()
+		self._exit_report = 0
+		self._manage_now = time.time()
+		self._pset = pset
+		if self._pidfd_mode:
+			for watch in self._pidfds.values():
+				self._pset.register(watch, poll.POLLIN)
+		else:
+			self._pset.register(self._watch_child, poll.POLLIN)
+		if self._zygote is not None:
+			self._pset.register(self._zygote, poll.POLLIN)
+		for reader in self._outputs:
+			self._pset.register(reader, poll.POLLIN)
 		self._pset.register(self._watch_modules, poll.POLLIN)
 		self._pset.register(self._watch_files, poll.POLLIN)
 
@@ -1457,161 +2800,247 @@ Params are:
 			if server:
 				self._pset.register(server, poll.POLLIN)
 
-		try:
-			while True:
-				now = time.time()
-				if self._do_stop_all:
-					self._do_stop_all = False
-					self.stop_all()
+	def _manage_check(self):
+		"""
+		The work done at the top of each pass of the event loop.  Returns
+		True when the loop should end because the legion has finished
+		exiting.
+	"""
+		log = self._params.get('log', self._discard)
+		self._manage_now = now = time.time()
+		if self._zygote is not None and (self._zygote.has_exits() or self._zygote.closed()):
+			self._zygote_exits()
+		if self._dirty:
+			self._manage_dirty()
+		if self._do_stop_all:
+			self._do_stop_all = False
+			self.stop_all()
 
+		if self._exiting:
+			if self._exiting + sigterm_limit < time.time():
+				log.warning("Limit waiting for all tasks to exit was exceeded")
+				return True
+			still_running = 0
+			for t in self._tasks_scoped:
+				if not t._adoptable() and not self.is_handing_off():
+					still_running += len(t.get_pids())
+			if still_running == 0:
+				log.info("All tasks have stopped")
+				return True
+			if self._exit_report + 1 < now:
+				log.warning("Still waiting for %d process%s", still_running, ses(still_running))
+				self._exit_report = now
+			self.next_timeout()
+		if self.expires:
+			if self.expires < now:
 				if self._exiting:
-					if self._exiting + sigterm_limit < time.time():
-						log.warning("Limit waiting for all tasks to exit was exceeded")
-						break
-					still_running = 0
-					for t in self._tasks_scoped:
-						still_running += len(t.get_pids())
-					if still_running == 0:
-						log.info("All tasks have stopped")
-						break
-					if exit_report + 1 < now:
-						log.warning("Still waiting for %d process%s", still_running, ses(still_running))
-						exit_report = now
-					self.next_timeout()
-				if self.expires:
-					if self.expires < now:
-						if self._exiting:
-							log.debug("Legion expiration reached %s ago, still exiting",
-											deltafmt(now - self.expires))
-						else:
-							log.warning("Legion expiration reached %s ago",
-											deltafmt(now - self.expires))
-							self._exiting = now
-						self.stop_all()
-					else:
-						log.debug("expires in %s", deltafmt(self.expires - now))
+					log.debug("Legion expiration reached %s ago, still exiting",
+									deltafmt(now - self.expires))
+				else:
+					log.warning("Legion expiration reached %s ago",
+									deltafmt(now - self.expires))
+					self._exiting = now
+				self.stop_all()
+			else:
+				log.debug("expires in %s", deltafmt(self.expires - now))
 
-				if last_timeout != self._timeout:
-					log.debug("select() timeout is now %s", deltafmt(self._timeout))
-					last_timeout = self._timeout
-				try:
-					evlist = self._pset.poll(self._timeout*1000)
-				except OSError as e:
-					if e.errno != errno.EINTR:
-						raise e
-					else:
-						log.debug("Ignoring %s(%s) during poll", e.__class__.__name__, str(e))
+		if self._last_timeout != self._timeout:
+			log.debug("select() timeout is now %s", deltafmt(self._timeout))
+			self._last_timeout = self._timeout
+		return False
 
-				self._timeout = timeout_long_cycle
+	def _manage_wake(self):
+		"""
+		Returns the time to sleep until, which is the earliest task
+		deadline or legion timer, or the next housekeeping cycle if
+		nothing is due before then.
+	"""
+		wake = self._manage_now if self._dirty else self._last_idle_run + self._timeout
+		for when in [self._deadline_next(), self.expires, self._http_retry, self._probe_next]:
+			if when and when < wake:
+				wake = when
+		return wake
 
-				idle_starving = (last_idle_run + idle_starvation < now)
-				if idle_starving:
-					log.warning("Idle starvation detected, last run was %s ago", deltafmt(now - last_idle_run))
-				if idle_starving or not evlist:
-					log.debug("idle")
-					last_idle_run = now
+	def _manage_timed(self, active):
+		"""
+		The time-driven work done after each wait for events.  "active"
+		is True if events arrived.  Returns True if the idle cycle was
+		run, in which case any events are left to the next pass.
+	"""
+		log = self._params.get('log', self._discard)
+		now = self._manage_now
+		idle_at = self._last_idle_run + self._timeout
+		self._timeout = self._params.get('long_cycle', def_long_cycle)
+
+		if self._deadlines_run():
+			log.debug("scheduled tasks managed")
+		if self._http_retry and self._http_retry < time.time():
+			self._manage_http_servers()
+		if self._probe_next and self._probe_next <= time.time():
+			self._probe_run()
+
+		idle_starving = (self._last_idle_run + idle_starvation < now)
+		if idle_starving:
+			log.warning("Idle starvation detected, last run was %s ago", deltafmt(now - self._last_idle_run))
+		if not idle_starving and (active or time.time() < idle_at):
+			return False
+		log.debug("idle")
+		self._last_idle_run = now
 
-					if self._reap():
-						self.next_timeout()
+		self._reap()
+		self._manage_dirty()
 
-					if self._http_retry and self._http_retry < now:
-						self._manage_http_servers()
+		if self._reload_config:
+			try:
+				log.info("Reloading config for change from %s ago",
+						deltafmt(time.time() - self._reload_config))
+				roles_changed = self._load_roles()
+				self._load_config(full=roles_changed)
+				self._reload_config = None
+			except Exception as e:
 
-					#  Manage tasks.  The tasks themselves figure out what might need to
-					#  happen.
-					#
-					for t in set(self._tasks_scoped):
-						if t.manage():
-							self.next_timeout()
-
-					if self._reload_config:
-						try:
-							log.info("Reloading config for change from %s ago",
-									deltafmt(time.time() - self._reload_config))
-							self._load_roles()
-							self._load_config()
-							self._reload_config = None
-						except Exception as e:
-
-							log.error("Config load sequence failed -- %s", str(e), exc_info=True)
-
-					#  Housekeeping
-					#
-					self._watch_files.scan()
-					self._watch_modules.scan()
+				log.error("Config load sequence failed -- %s", str(e), exc_info=True)
+
+		#  Housekeeping
+		#
+		self._watch_files.scan()
+		self._watch_modules.scan()
+		return True
+
+	def _event_dispatch(self, item):
+		"""
+		Handle an item from the poll set that has become readable.
+	"""
+		log = self._params.get('log', self._discard)
+		if item in self._http_servers:
+			item.handle_request()
+			return
+		if item == self._watch_child:
+			self._reap()
+			return
+		if item is self._zygote:
+			self._zygote_exits()
+			return
+		if isinstance(item, _pidfd_watch):
+			self._reap_pidfd(item)
+			return
+		if isinstance(item, capture.reader):
+			if not item.read():
+				self._output_del(item)
+			return
+
+		log.debug("Activity: %s", str(item))
 
+		#  This may need work.  For now, all selectable events
+		#  give back objects that have a 'get' method, and it
+		#  is possible to choose an action based on the shape
+		#  of the value returned.
+		#
+		if not callable(getattr(item, 'get')):
+			log.error("Selected %s object has no 'get' method", type(item).__name__)
+			return
+		for tgt in item.get():
+			if isinstance(tgt, tuple):
+				name = tgt[0]
+				cmd = tgt[1]
+				paths = tgt[2]
+				if len(paths) > 2:
+					desc = str(len(paths))+' files'
 				else:
+					desc = ','.join(paths)
+				log.info("Handling module %s change for task '%s'", desc, name)
+				if name not in self._module_event_map:
+					log.error("Ignoring unknown python module '%s' in event",
+									name)
+					continue
+				self._module_event_map[name].handle(name)
+			else:
+				path = tgt
+				if path not in self._file_event_map:
+					log.error("Ignoring unknown file path %s from event",
+									repr(path))
+					continue
+				log.info("file_change event for '%s'", path)
+				for key, ev in self._file_event_map[path].items():
+					log.debug("dispatching '%s' event", key)
+					ev.handle(path)
+
+	def _manage_finish(self):
+		"""
+		Shut down after the event loop ends, for whatever reason.  Returns
+		the LegionReset to raise if the legion is handing off, else None.
+	"""
+		log = self._params.get('log', self._discard)
+
+		#  If we reach here and _exiting is not set then something bad
+		#  happened.  Make an attempt to shut everything down before
+		#  leaving.
+		#
+		if not self._exiting:
+			log.warning("Unexpected exit -- attempting to stop all tasks")
+			try:
+				self.stop_all()
+			except Exception as ee:
+				log.error("Failsafe attempt to stop tasks failed -- %s", str(ee))
+		reset = None
+		if self.is_handing_off():
+			try:
+				reset = self._handoff_save()
+			except Exception as ee:
+				log.error("Handoff failed, tasks will be stopped by the restarted program -- %s", str(ee))
+		for server in self._http_servers:
+			if server:
+				try: self._pset.unregister(server)
+				except: pass
+				try: server.server.close()
+				except: pass
+		self._http_servers = []
+		for key in list(self._sockets):
+			self._socket_close(key)
+		self._zygote_stop(wait=True)
+		return reset
+
+	def manage(self):
+		log = self._params.get('log', self._discard)
+
+		self._set_handler(signal.SIGHUP)
+		self._set_handler(signal.SIGINT, ignore=True)
+		if not self._pidfd_mode:
+			self._set_handler(signal.SIGCHLD)
+		self._set_handler(signal.SIGTERM)
+		self._manage_setup(poll.poll())
+		log.info("File event polling via %s from %s available",
+						self._pset.get_mode_name(), self._pset.get_available_mode_names())
+		if self._pidfd_mode:
+			log.info("Child processes are reaped via pidfd")
+
+		reset = None
+		try:
+			while not self._manage_check():
+				wake = self._manage_wake()
+				evlist = []
+				try:
+					evlist = self._pset.poll(max(0, wake - self._manage_now)*1000)
+				except OSError as e:
+					if e.errno != errno.EINTR:
+						raise e
+					else:
+						log.debug("Ignoring %s(%s) during poll", e.__class__.__name__, str(e))
+
+				if not self._manage_timed(len(evlist) > 0):
 					for item, mask in evlist:
-						if item in self._http_servers:
-							item.handle_request()
-							continue
-						if item == self._watch_child:
-							if self._reap():
-								self.next_timeout()
-							continue
-
-						log.debug("Activity: %s", str(item))
-
-						#  This may need work.  For now, all selectable events
-						#  give back objects that have a 'get' method, and it
-						#  is possible to choose an action based on the shape
-						#  of the value returned.
-						#
-						if not callable(getattr(item, 'get')):
-							log.error("Selected %s object has no 'get' method", type(item).__name__)
-							continue
-						for tgt in item.get():
-							if isinstance(tgt, tuple):
-								name = tgt[0]
-								cmd = tgt[1]
-								paths = tgt[2]
-								if len(paths) > 2:
-									desc = str(len(paths))+' files'
-								else:
-									desc = ','.join(paths)
-								log.info("Handling module %s change for task '%s'", desc, name)
-								if name not in self._module_event_map:
-									log.error("Ignoring unknown python module '%s' in event",
-													name)
-									continue
-								self._module_event_map[name].handle(name)
-							else:
-								path = tgt
-								if path not in self._file_event_map:
-									log.error("Ignoring unknown file path %s from event",
-													repr(path))
-									continue
-								log.info("file_change event for '%s'", path)
-								for key, ev in self._file_event_map[path].items():
-									log.debug("dispatching '%s' event", key)
-									ev.handle(path)
+						self._event_dispatch(item)
 		except Exception as e:
 			log.error("unexpected error -- %s", str(e), exc_info=True)
 			raise e
 		finally:
-			#  If we reach here and _exiting is not set then something bad
-			#  happened.  Make an attempt to shut everything down before
-			#  leaving.
-			#
-			if not self._exiting:
-				log.warning("Unexpected exit -- attempting to stop all tasks")
-				try:
-					self.stop_all()
-				except Exception as ee:
-					log.error("Failsafe attempt to stop tasks failed -- %s", str(ee))
-			for server in self._http_servers:
-				if server:
-					try: self._pset.unregister(server)
-					except: pass
-					try: server.server.close()
-					except: pass
-			self._http_servers = []
+			reset = self._manage_finish()
 			#  Reset all signal handlers to their entry states
 			log.debug("reseting signals")
 			for sig, state in self._signal_prior.items():
 				signal.signal(sig, state)
 		if self._resetting:
-			raise LegionReset()
+			raise reset if reset else LegionReset()
 
 class ProcessState(object):
 	"""
@@ -1628,6 +3057,21 @@ class ProcessState(object):
 	exited = None		#  When this slot's process last exited
 	next_sig = None		#  When to send an escalated signal to this process
 	pending_sig = None	#  The signal to send if next_sig doesn't expire
+	restarts = 0		#  Consecutive exits before the "backoff" reset period
+	next_start = None	#  Earliest time this slot may be restarted
+	parked = None		#  When this slot was parked for crash-looping
+	outdated = False	#  Process was started from a config since changed
+	rolled = None		#  When a rolling restart of this slot began
+	daemon = False		#  pid is a "nowait" daemon found via the pidfile
+	checking = None		#  pid of a running "check" command for this slot
+
+	def backoff_clear(self):
+		self.restarts = 0
+		self.next_start = None
+		self.parked = None
+
+	def __str__(self):
+		return 'pid %s' % (str(self.pid),)
 
 class task(Context):
 	"""
@@ -1683,17 +3127,53 @@ Params are:
 		#
 		self._path = None
 
+		#  A capture.output for the task's process output, if configured.
+		#
+		self._output = None
+		self._output_conf = None
+
+		#  The (fd, name) list of listening sockets passed to the task's
+		#  processes, and the legion socket keys they come from.
+		#
+		self._sockets = []
+		self._socket_keys = set()
+
+		#  The current entry in task_states, and when it was entered.
+		#
+		self._state = None
+		self._state_changed = None
+
 		self._reset_state()
 
 		self._last_message = 0
 
 		self._context = None
 
+		#  Seconds from the first start attempt until the task was marked
+		#  started, for the most recent start.
+		#
+		self._start_latency = None
+
+		#  Contexts built by _context_build(), keyed by "pending".  Each
+		#  entry records the config and legion generations it was built
+		#  from, and is discarded when either moves on.
+		#
+		self._context_cache = {}
+		self._config_generation = 0
+		self._config_running_generation = None
+
 		#  Register with legion
 		self._legion.task_add(self, periodic=self._task_periodic)
 
 	def close(self):
 		log = self._params.get('log', self._discard)
+		if self._output:
+			self._output.close()
+			self._output = None
+		if self._socket_keys:
+			self._sockets = []
+			self._socket_keys = set()
+			self._legion._sockets_prune()
 		if self._legion:
 			try:
 				self._event_deregister()
@@ -1737,9 +3217,17 @@ Params are:
 		dnr           - Indicates that this task is scheduled for destruction.  Once all
 				processes have stopped, it should delete itself.
 		limit         - Time after which this task should be stopped.
+		start_request - When a start of the task was first attempted, including
+				any time spent waiting on required tasks.  Used to measure
+				the start latency.
+
+		The task state is also set to "idle".  The state summarizes these flags
+		and is maintained by _set_state() as they change.
 	"""
+		self._set_state('idle')
 		self._starting = None
 		self._started = None
+		self._start_request = None
 		self._stopping = None
 		self._terminated = None
 		self._killed = None
@@ -1750,6 +3238,26 @@ Params are:
 	def get_name(self):
 		return self._name
 
+	def get_state(self):
+		return self._state
+
+	def _set_state(self, state):
+		"""
+		Move the task to a new state from task_states.  Tasks that require
+		this one are queued for management when it starts or stops.
+	"""
+		if state == self._state:
+			return
+		log = self._params.get('log', self._discard)
+		if self._state is not None and state != 'idle' and state not in task_states[self._state]:
+			log.warning("Task '%s' unexpected state change from '%s' to '%s'", self._name, self._state, state)
+		else:
+			log.debug("Task '%s' state '%s' -> '%s'", self._name, self._state, state)
+		self._state = state
+		self._state_changed = time.time()
+		if state in ('started', 'stopped'):
+			self._legion._task_ready(self)
+
 	def _context_build(self, pending=False):
 		"""
 		Create a context dict from standard task configuration.
@@ -1757,9 +3265,20 @@ Params are:
 		The context is constructed in a standard way and is passed to str.format() on configuration.
 		The context consists of the entire os.environ, the config 'defines', and a set
 		of pre-defined values which have a common prefix from 'context_prefix'.
+
+		The result is cached until the task config or any legion-wide
+		input changes so it must be treated as read-only.
 	"""
 		log = self._params.get('log', self._discard)
 		log.debug("called with pending=%s", pending)
+		if pending:
+			key = (self._config_generation, self._legion._context_generation)
+		else:
+			key = (self._config_running_generation, self._legion._context_generation)
+		cached = self._context_cache.get(pending)
+		if cached and cached[0] == key:
+			return cached[1]
+
 		if pending:
 			conf = self._config_pending
 		else:
@@ -1804,6 +3323,7 @@ Params are:
 		else:
 			log.warning("No legion config available for defaults") 
 
+		self._context_cache[pending] = (key, context)
 		return context
 
 	def get_path(self):
@@ -1872,6 +3392,24 @@ Params are:
 		log = self._params.get('log', self._discard)
 		log.debug("for '%s'", self._name)
 		self._config_pending = config.copy()
+		self._config_generation += 1
+		self._legion._task_graph_invalidate()
+
+	def update_config(self, **changes):
+		"""
+		Change individual items in the pending config.  Unlike
+		set_config(), the pending config is modified in place so
+		the change is also seen in the running config until the
+		next config load.
+	"""
+		log = self._params.get('log', self._discard)
+		log.debug("for '%s' -- %s", self._name, changes)
+		if self._config_pending is None:
+			raise TaskError(self._name, "No configuration available to update")
+		self._config_pending.update(changes)
+		self._config_generation += 1
+		self._context_cache = {}
+		self._legion._task_graph_invalidate()
 
 	def participant(self):
 		"""
@@ -2001,7 +3539,7 @@ Params are:
 			#  Ignore these elements as they don't affect the operation of a process
 			#  that is already running
 			#
-			if elem in ['control', 'pidfile', 'onexit', 'requires', 'start_delay']:
+			if elem in ['control', 'pidfile', 'onexit', 'requires', 'start_delay', 'backoff', 'rolling']:
 				continue
 			if self._config_running.get(elem) != self._config_pending.get(elem):
 				log.debug("Task '%s' change - '%s' text change", self._name, elem)
@@ -2087,10 +3625,7 @@ Params are:
 					log.error("Task %s 'onexit' item %d type '%s' task '%s' does not exist",
 										self._name, item, op_type, taskname)
 					continue
-				task = None
-				for t in self._legion.task_list(pending=False):
-					if taskname == t._name:
-						task = t
+				task = self._legion.task_scoped(taskname, pending=False)
 				if not task:
 					log.error("Task %s 'onexit' item %d type '%s' task '%s' exists but is out of scope",
 										self._name, item, op_type, taskname)
@@ -2101,10 +3636,337 @@ Params are:
 					continue
 				log.info("Task '%s' marked to restart by task '%s'", taskname, self._name)
 				task._reset_state()
+				self._legion.task_dirty(task)
 			else:
 				log.error("Unknown type '%s' for task %s 'onexit' item %d", op_type, self._name, item)
 				continue
 
+	def _backoff_conf(self):
+		"""
+		Returns the task's "backoff" settings merged over def_backoff.
+		Invalid values are logged and the default used.
+	"""
+		log = self._params.get('log', self._discard)
+		conf = dict(def_backoff)
+		backoff = self._config_running.get('backoff') if self._config_running else None
+		if not backoff:
+			return conf
+		if not isinstance(backoff, dict):
+			log.error("Task '%s' 'backoff' is not a map, using defaults", self._name)
+			return conf
+		for key, val in backoff.items():
+			if key not in def_backoff:
+				log.error("Task '%s' has unknown 'backoff' key '%s'", self._name, key)
+				continue
+			try:
+				val = float(_fmt_context(self._get(val), self._context))
+				if val < 0:
+					raise ValueError("negative value")
+				conf[key] = val
+			except Exception as e:
+				log.error("Task '%s' has invalid 'backoff' %s '%s' -- %s", self._name, key, val, str(e))
+		return conf
+
+	def _backoff(self, proc, now, expected=False):
+		"""
+		Update the restart history for "proc", whose process exited at
+		"now".  A process that ran for less than the "reset" period bumps
+		the restart count and its next start is pushed out exponentially.
+		Once the count reaches "crash_limit", the slot is parked and will
+		not be restarted until the task config is next changed.  Exits
+		caused by taskforce stopping the process are not counted.
+	"""
+		log = self._params.get('log', self._discard)
+		if expected or not self._config_running:
+			return
+		if self._get(self._config_running.get('control')) in self._legion.once_controls:
+			return
+		conf = self._backoff_conf()
+		if proc.started is not None and now - proc.started >= conf['reset']:
+			proc.restarts = 0
+			return
+		proc.restarts += 1
+		delay = min(conf['max_delay'], conf['delay'] * conf['factor'] ** (proc.restarts - 1))
+		if conf['jitter']:
+			delay += delay * random.uniform(0, conf['jitter'])
+		proc.next_start = now + delay
+		crash_limit = int(conf['crash_limit'])
+		if crash_limit and proc.restarts >= crash_limit:
+			proc.parked = now
+			log.warning("Task '%s' instance %d parked after %d rapid exits",
+						self._name, proc.instance, proc.restarts)
+		elif proc.restarts > 1:
+			log.info("Task '%s' instance %d restart backed off %s after %d rapid exits",
+						self._name, proc.instance, deltafmt(delay), proc.restarts)
+
+	def _pidfile_pid(self, instance):
+		"""
+		Returns the pid recorded in the task's pidfile for "instance" if
+		that process is running, otherwise None.
+	"""
+		if not self._context or not self._context.get(context_prefix+'pidfile'):
+			return None
+		context = self._context.copy()
+		context[context_prefix+'instance'] = instance
+		try:
+			path = _fmt_context(context[context_prefix+'pidfile'], context)
+			with open(path, 'r') as f:
+				pid = int(f.read().split()[0])
+		except Exception:
+			return None
+		if pid <= 1 or pid == os.getpid() or not utils.pids_alive([pid]):
+			return None
+		return pid
+
+	def _adoptable(self, pending=False):
+		conf = self._config_pending if pending else self._config_running
+		return bool(conf) and self._get(conf.get('control')) == 'adopt'
+
+	def _daemon_find(self, instance):
+		"""
+		Returns the pid of a running daemon for "instance" of a "nowait"
+		or "adopt" task, or None if the task has neither control or there
+		is none.  A pid already held by another slot is not returned.
+	"""
+		if not self._config_running or self._get(self._config_running.get('control')) not in ('nowait', 'adopt'):
+			return None
+		pid = self._pidfile_pid(instance)
+		if pid is None or pid in self.get_pids():
+			return None
+		return pid
+
+	def _daemon_adopt(self, proc, pid):
+		proc.pid = pid
+		proc.daemon = True
+		self._legion._probe_add()
+
+	def _adopt_existing(self, proc, now):
+		"""
+		Take over a process already running for the slot.  This may be a
+		daemon named by the pidfile, a process handed off by the prior
+		program image, or a process left by a prior legion for an "adopt"
+		task.  A process that is still a child of the legion, as after a
+		re-exec, is reaped as usual.  Others are watched by the legion
+		probes.  Returns True if the slot was taken over.
+	"""
+		log = self._params.get('log', self._discard)
+		pid = self._daemon_find(proc.instance)
+		if pid:
+			log.info("%s instance %d daemon pid %d is already running", self._name, proc.instance, pid)
+			self._daemon_adopt(proc, pid)
+			if proc.started is None:
+				proc.started = now
+			return True
+		saved = self._legion._handoff_proc(self._name, proc.instance)
+		if saved:
+			pid = saved['pid']
+		elif self._adoptable():
+			pid = self._legion._adopt_pid(self._name, proc.instance)
+		if pid is None or pid in self.get_pids():
+			return False
+		pstat = utils.proc_stat(pid)
+		if pstat and pstat[1] == os.getpid():
+			log.info("%s instance %d pid %d adopted", self._name, proc.instance, pid)
+			self._legion.proc_add(event_target(self, 'proc_exit', key=pid, arg=proc, log=log))
+			proc.pid = pid
+		else:
+			log.info("%s instance %d pid %d adopted, will be probed", self._name, proc.instance, pid)
+			self._daemon_adopt(proc, pid)
+		if saved:
+			proc.started = saved.get('started')
+			proc.restarts = saved.get('restarts', 0)
+			proc.next_start = saved.get('next_start')
+			if saved.get('output') is not None:
+				if self._output:
+					self._legion.output_add(capture.reader(saved['output'], self._output_write,
+										proc.instance, name=self._name, log=log))
+				else:
+					os.close(saved['output'])
+		if proc.started is None:
+			proc.started = now
+		return True
+
+	def _daemon_procs(self):
+		return [proc for proc in self._proc_state if proc.daemon and proc.pid is not None]
+
+	def _daemon_probe(self, live=None):
+		"""
+		Fire the exit event for any of the task's daemons that are no longer
+		running, and escalate signals to any that have not exited in time.
+		"live" is the set of running pids if already known.
+	"""
+		log = self._params.get('log', self._discard)
+		procs = self._daemon_procs()
+		if not procs:
+			return
+		if live is None:
+			live = utils.pids_alive([proc.pid for proc in procs])
+		now = time.time()
+		for proc in procs:
+			if proc.pid not in live:
+				event_target(self, 'proc_exit', key=proc.pid, arg=proc, log=log).handle(None)
+			elif proc.next_sig is not None and proc.next_sig <= now:
+				self._signal(proc.pending_sig, pid=proc.pid)
+				proc.next_sig = None
+
+	def _sockets_build(self):
+		"""
+		Get the listening sockets in the "sockets" config from the legion.
+		A socket that can't be opened is logged and left out.
+	"""
+		log = self._params.get('log', self._discard)
+		conf = self._config_running.get('sockets') if self._config_running else None
+		if conf and not isinstance(conf, list):
+			conf = [conf]
+		sockets = []
+		keys = set()
+		for item in conf or []:
+			try:
+				if not isinstance(item, dict):
+					item = {'listen': item}
+				listen = _fmt_context(self._get(item.get('listen')), self._context)
+				if not listen:
+					raise Exception("no 'listen' address")
+				stype = self._get(item.get('type'), default='stream')
+				backlog = int(self._get(item.get('backlog'), default=def_backlog))
+				fdname = self._get(item.get('name'), default=self._name)
+				sock = self._legion.socket_get(listen, stype, backlog)
+			except Exception as e:
+				log.error("Task '%s' socket %s could not be opened -- %s", self._name, str(item), str(e))
+				continue
+			sockets.append((sock.fileno(), fdname))
+			keys.add((stype, listen))
+		self._sockets = sockets
+		self._socket_keys = keys
+
+	def _output_build(self):
+		"""
+		Set up the task's capture.output from the "output" config, or
+		remove it if there is none.  An unchanged config keeps the
+		current output.
+	"""
+		log = self._params.get('log', self._discard)
+		conf = self._config_running.get('output') if self._config_running else None
+		params = None
+		if conf is True:
+			params = {}
+		elif isinstance(conf, dict):
+			params = {}
+			for key, val in conf.items():
+				try:
+					if key == 'file':
+						params[key] = _fmt_context(self._get(val), self._context)
+					elif key in ('max_bytes', 'backups', 'buffer'):
+						params[key] = int(_fmt_context(self._get(val), self._context))
+					elif key == 'syslog':
+						params[key] = self._get(val)
+					else:
+						log.error("Task '%s' has unknown 'output' key '%s'", self._name, key)
+				except Exception as e:
+					log.error("Task '%s' has invalid 'output' %s '%s' -- %s", self._name, key, val, str(e))
+		elif conf:
+			log.error("Task '%s' 'output' is not a map, output will not be captured", self._name)
+		if params == self._output_conf:
+			return
+		if self._output:
+			self._output.close()
+			self._output = None
+		self._output_conf = params
+		if params is not None:
+			try:
+				self._output = capture.output(self._name, log=log, **params)
+			except Exception as e:
+				log.error("Task '%s' output setup failed -- %s", self._name, str(e))
+
+	def _output_write(self, instance, data):
+		if self._output:
+			self._output.write(instance, data)
+
+	def _rolling_conf(self, pending=False):
+		"""
+		Returns the task's "rolling" settings merged over def_rolling, or
+		None if rolling restarts are not configured.  Invalid values are
+		logged and the default used.
+	"""
+		log = self._params.get('log', self._discard)
+		conf = self._config_pending if pending else self._config_running
+		rolling = conf.get('rolling') if conf else None
+		if rolling is None or rolling is False:
+			return None
+		ans = dict(def_rolling)
+		if rolling is True:
+			return ans
+		if not isinstance(rolling, dict):
+			log.error("Task '%s' 'rolling' is not a map, using defaults", self._name)
+			return ans
+		for key, val in rolling.items():
+			if key not in def_rolling:
+				log.error("Task '%s' has unknown 'rolling' key '%s'", self._name, key)
+				continue
+			try:
+				val = float(_fmt_context(self._get(val), self._context))
+				if val < 0 or (key == 'batch' and val < 1):
+					raise ValueError("out of range")
+				ans[key] = val
+			except Exception as e:
+				log.error("Task '%s' has invalid 'rolling' %s '%s' -- %s", self._name, key, val, str(e))
+		ans['batch'] = int(ans['batch'])
+		return ans
+
+	def _roll(self):
+		"""
+		Advance a rolling restart.  Processes started from an earlier
+		config are sent a SIGTERM, at most "batch" at a time, and the
+		next batch is held off until the replacements have been running
+		for the "delay" period.  The replacement processes are started
+		by _start() as the outdated ones exit.  Exits and the delay are
+		both events that cause the task to be managed again, so no
+		rapid revisit is needed.
+
+		Returns True if any outdated processes remain.
+	"""
+		log = self._params.get('log', self._discard)
+		outdated = [p for p in self._proc_state if p.outdated and p.pid is not None]
+		if not outdated:
+			for proc in self._proc_state:
+				if proc.rolled and proc.pid is not None:
+					proc.rolled = None
+			return False
+		conf = self._rolling_conf()
+		if conf is None:
+			conf = dict(def_rolling)
+		now = time.time()
+		busy = 0
+		for proc in self._proc_state:
+			if not proc.rolled:
+				continue
+			if proc.outdated and proc.pid is not None:
+				if proc.next_sig is not None and proc.next_sig <= now:
+					self._signal(proc.pending_sig, pid=proc.pid)
+					proc.next_sig = None
+				busy += 1
+			elif proc.pid is None:
+				busy += 1
+			elif now < proc.started + conf['delay']:
+				self._legion.schedule(self, proc.started + conf['delay'])
+				busy += 1
+			else:
+				proc.rolled = None
+		for proc in outdated:
+			if busy >= conf['batch']:
+				break
+			if proc.rolled or proc.pending_sig is not None:
+				continue
+			log.info("Rolling restart of task '%s' instance %s pid %d, %d outdated",
+						self._name, proc.instance, proc.pid, len(outdated))
+			self._signal(signal.SIGTERM, pid=proc.pid)
+			proc.rolled = now
+			proc.pending_sig = signal.SIGKILL
+			proc.next_sig = now + sigkill_escalation
+			self._legion.schedule(self, proc.next_sig)
+			busy += 1
+		return True
+
 	def _shrink(self, needed, running):
 		"""
 		Shrink the process pool from the number currently running to
@@ -2126,6 +3988,7 @@ Params are:
 				signalled += 1
 				proc.pending_sig = signal.SIGKILL
 				proc.next_sig = now + sigkill_escalation
+				self._legion.schedule(self, proc.next_sig)
 			else:
 				log.debug("Process instance %d (pid %d) for task '%s' exit pending",
 						proc.instance, proc.pid, self._name)
@@ -2141,6 +4004,10 @@ Params are:
 
 		now = time.time()
 		self._started = now
+		if self._start_request is not None:
+			self._start_latency = now - self._start_request
+			log.debug("Task '%s' start latency %s", self._name, deltafmt(self._start_latency))
+		self._set_state('started')
 
 		limit = self._config_running.get('time_limit')
 		try:
@@ -2148,6 +4015,7 @@ Params are:
 			if limit > 0:
 				log.debug("Applying task '%s' time limit of %s", self._name, deltafmt(limit))
 				self._limit = now + limit
+				self._legion.schedule(self, self._limit)
 		except Exception as e:
 			log.warn("Task '%s' time_limit value '%s' invalid -- %s",
 				self._name, limit, str(e), exc_info=log.isEnabledFor(logging.DEBUG))
@@ -2168,15 +4036,18 @@ Params are:
 		stopped.
 
 		Currently, processes are started via direct fork/exec, with
-		stdin/stdout/stderr all redirected from /dev/null.  In future,
-		will probably add options to redirect stdout/stderr to syslog
-		or files.
+		stdin/stdout/stderr all redirected from /dev/null.  If the task
+		has an "output" config, stdout and stderr are instead a pipe
+		read by the legion, see capture.py.
 
 		Note that processes are intentionally not detached or put in
 		separate process groups or terminal groups.  The presumption is
 		that "async" and "adopt" tasks will handle this themselves, and
 		we need "wait" tasks to not be detached.
 
+		A task waiting on required tasks is not revisited until one of
+		them starts or stops.
+
 		Returns True to request a shorter period before the next call,
 		False if nothing special is needed.
 	"""
@@ -2195,6 +4066,7 @@ Params are:
 		#
 		if control == 'event' and not self._stopped:
 			self._stopped = now
+			self._set_state('stopped')
 		if self._stopped:
 			if self._dnr:
 				log.info("Task '%s' stopped and will now be deleted", self._name)
@@ -2217,6 +4089,8 @@ Params are:
 				start_delay = 0
 		else:
 			start_delay = 0
+		if self._start_request is None:
+			self._start_request = now
 		if self._starting and not self._started:
 			if now > self._starting + start_delay:
 				log.info("%s task marked started after %s", self._name, deltafmt(now - self._starting))
@@ -2224,7 +4098,8 @@ Params are:
 				return False
 			log.debug("%s task has been starting for %s of %s",
 					self._name, deltafmt(now - self._starting), deltafmt(start_delay))
-			return True
+			self._legion.schedule(self, self._starting + start_delay)
+			return False
 
 		#  Check the required state to ensure dependencies have been started.  In the case of
 		#  'once' controls, the dependency must have already stopped, otherwise it must have
@@ -2239,13 +4114,15 @@ Params are:
 						if self._last_message + repetition_limit < time.time():
 							log.info("Task '%s' is waiting on '%s' to complete", self._name, req._name)
 							self._last_message = now
-						return True
+						self._set_state('waiting')
+						return False
 				else:
 					if not req._started:
 						if self._last_message + repetition_limit < time.time():
 							log.info("Task '%s' is waiting on '%s' to start", self._name, req._name)
 							self._last_message = now
-						return True
+						self._set_state('waiting')
+						return False
 
 		self._last_message = 0
 		if once:
@@ -2272,10 +4149,14 @@ Params are:
 				return False
 
 			self._starting = now
-			if not start_delay:
+			self._set_state('starting')
+			if start_delay:
+				self._legion.schedule(self, now + start_delay)
+			else:
 				self._mark_started()
 
 			log.debug("Found %d running, %d needed, starting %d", running, needed, needed-running)
+			backoff_delay = self._backoff_conf()['delay']
 			started = 0
 			for instance in range(needed):
 				if instance < len(self._proc_state):
@@ -2283,6 +4164,8 @@ Params are:
 					if proc.pid is not None:
 						log.debug("%s instance %d already started", self._name, instance)
 						continue
+					if self._adopt_existing(proc, now):
+						continue
 					if proc.started == None:
 						proc.started = now
 					last_start_delta = now - proc.started
@@ -2296,22 +4179,53 @@ Params are:
 						log.warning("Time flowed backwards, resetting %s instance %d start time",
 								self._name, instance)
 						proc.started = now
+						self._legion.schedule(self, proc.started + backoff_delay)
 						continue
-					if last_start_delta < reexec_delay:
+					if proc.parked:
+						log.debug("%s instance %d is parked, restart skipped", self._name, instance)
+						continue
+					if proc.next_start is not None and now < proc.next_start:
+						log.debug("%s instance %d restart backed off for %s",
+								self._name, instance, deltafmt(proc.next_start - now))
+						self._legion.schedule(self, proc.next_start)
+						continue
+					if last_start_delta < backoff_delay:
 						log.debug("%s instance %d restart skipped, last attempt %s ago",
 								self._name, instance, deltafmt(last_start_delta))
+						self._legion.schedule(self, proc.started + backoff_delay)
 						continue
 				else:
 					log.debug("%s growing instance %d", self._name, instance)
 					self._proc_state.append(ProcessState())
 					proc = self._proc_state[instance]
+					proc.instance = instance
+					if self._adopt_existing(proc, now):
+						continue
 
-				pid = _exec_process(start_command, self._context, instance=instance, log=log)
+				output = None
+				if self._output:
+					output = capture.pipe()
+				try:
+					pid = _exec_process(start_command, self._context, instance=instance,
+								log=log, spawn=self._legion._spawn_mode,
+								zygote=self._legion._zygote,
+								output=output[1] if output else None,
+								sockets=self._sockets)
+				except:
+					if output:
+						os.close(output[0])
+						os.close(output[1])
+					raise
+				if output:
+					os.close(output[1])
+					self._legion.output_add(capture.reader(output[0], self._output_write, instance, name=self._name, log=log))
 				log.debug("Forked pid %d for '%s', %d of %d now running",
 							pid, self._name, len(self.get_pids()), needed)
-				self._legion.proc_add(event_target(self, 'proc_exit', key=pid, log=log))
+				self._legion.proc_add(event_target(self, 'proc_exit', key=pid, arg=proc, log=log))
 				proc.pid = pid
 				proc.started = now
+				proc.next_start = None
+				proc.outdated = False
 				started += 1
 
 			log.info("Task %s: %d process%s scheduled to start%s",
@@ -2319,6 +4233,11 @@ Params are:
 					(' with time limit %s' % (deltafmt(self._limit - now),)) if self._limit else '')
 		except Exception as e:
 			log.error("Failed to start task '%s' -- %s", self._name, str(e), exc_info=log.isEnabledFor(logging.DEBUG))
+
+			#  Nothing else will signal that a retry might now succeed,
+			#  so try again after the legion's long cycle.
+			#
+			self._legion.schedule(self, now + self._legion._params.get('long_cycle', def_long_cycle))
 		return False
 
 	def stop(self, task_is_resetting=False):
@@ -2347,6 +4266,7 @@ Params are:
 			log.debug("All '%s' processes are now stopped", self._name)
 			self._reset_state()
 			self._stopped = now
+			self._set_state('stopped')
 			return False
 		if self._config_running:
 			control = self._config_running.get('control')
@@ -2363,9 +4283,12 @@ Params are:
 							running, self._name, ses(running, 'es'))
 				self._signal(signal.SIGKILL)
 				self._killed = now
+				self._set_state('killing')
 			else:
 				log.debug("%d '%s' process%s still running %s after being terminated",
 					running, self._name, ses(running, 'es'), deltafmt(now - self._terminated))
+				self._legion.schedule(self, self._terminated + sigkill_escalation)
+				return False
 			return True
 		if self._limit and now > self._limit:
 			#  These are tasks that have a time limit set and it has expired.
@@ -2383,6 +4306,7 @@ Params are:
 		if not self._stopping:
 			self._stopping = now
 		self._terminated = now
+		self._set_state('stopping')
 		restart_target = None
 		stop_target = None
 		resetting = self._legion.is_resetting() or task_is_resetting
@@ -2402,6 +4326,7 @@ Params are:
 		else:
 			log.debug("Stopping %d '%s' process%s with SIGTERM", running, self._name, ses(running, 'es'))
 			self._signal(signal.SIGTERM)
+		self._legion.schedule(self, self._terminated + sigkill_escalation)
 		return True
 
 	def terminate(self):
@@ -2435,15 +4360,69 @@ Params are:
 		log.debug("for '%s', control '%s'", self._name, control)
 		if self._command_change() and len(self.get_pids()) > 0:
 			self._event_deregister()
-			self.stop(task_is_resetting=True)
+			if (self._rolling_conf(pending=True) is not None and control not in self._legion.once_controls
+											and not self._legion.is_resetting()):
+				log.info("Task '%s' config changed, starting rolling restart", self._name)
+				for proc in self._proc_state:
+					if proc.pid is not None:
+						proc.outdated = True
+			else:
+				self.stop(task_is_resetting=True)
 
 		self._config_running = self._config_pending
+		if self._config_running_generation != self._config_generation:
+			self._config_running_generation = self._config_generation
+			self._legion._task_graph_invalidate()
+			for proc in self._proc_state:
+				if proc.parked:
+					log.info("Task '%s' instance %d unparked by config change", self._name, proc.instance)
+				proc.backoff_clear()
 		self._context = self._context_build()
+		self._output_build()
+		self._sockets_build()
+		self._handoff_restore()
 
 		if control in self._legion.run_controls:
 			self._event_register(control)
 		return self.manage()
 
+	def _handoff_restore(self):
+		"""
+		Take up the state handed off for the task by the prior program
+		image, so finished "once" tasks, parked slots, time limits, and
+		signal escalations carry on where they were.  Handed off processes
+		are adopted here rather than when the task next starts, which
+		would reset the started state.
+	"""
+		saved = self._legion._handoff_task(self._name)
+		if not saved:
+			return
+		log = self._params.get('log', self._discard)
+		now = time.time()
+		for attr, val in saved.get('flags', {}).items():
+			if attr in handoff_task_attrs:
+				setattr(self, '_' + attr, val)
+		if saved.get('state') in task_states:
+			self._state = saved['state']
+			self._state_changed = now
+		for item in saved.get('procs', []):
+			while len(self._proc_state) <= item['instance']:
+				proc = ProcessState()
+				proc.instance = len(self._proc_state)
+				self._proc_state.append(proc)
+			proc = self._proc_state[item['instance']]
+			for attr in handoff_proc_attrs:
+				if attr not in ('instance', 'pid') and attr in item:
+					setattr(proc, attr, item[attr])
+			if item.get('pid') is not None and proc.pid is None:
+				self._adopt_existing(proc, now)
+			if proc.next_sig is not None:
+				self._legion.schedule(self, proc.next_sig)
+		if self._limit:
+			self._legion.schedule(self, self._limit)
+		log.info("Task '%s' restored in state '%s' with %d process%s running",
+				self._name, self._state, len(self.get_pids()), ses(len(self.get_pids()), 'es'))
+
 	def manage(self):
 		"""
 		Manage the task to handle restarts, reconfiguration, etc.
@@ -2453,6 +4432,7 @@ Params are:
 	"""
 		log = self._params.get('log', self._discard)
 		if self._stopping:
+			self._daemon_probe()
 			log.debug("Task '%s', stopping, retrying stop()", self._name)
 			return self.stop()
 		now = time.time()
@@ -2466,4 +4446,6 @@ Params are:
 			log.debug("Not managing '%s', legion is exiting", self._name)
 			return False
 		log.debug("managing '%s'", self._name)
-		return self._start()
+		ans = self._start()
+		self._roll()
+		return ans
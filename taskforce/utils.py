@@ -17,7 +17,7 @@
 # ________________________________________________________________________
 #
 
-import sys, os, re, fcntl, atexit, time, random, signal, inspect, pipes, logging
+import sys, os, re, errno, fcntl, atexit, time, random, signal, inspect, pipes, logging, resource
 from logging.handlers import SysLogHandler
 
 def get_caller(*caller_class, **params):
@@ -398,6 +398,80 @@ def _pick_fd(obj, excludes):
 	except:
 		pass
 
+def open_fds():
+	"""
+	Returns a sorted list of the open file descriptors by reading the
+	per-process fd directory, or None if that is not available on this
+	system.  The descriptor used to read the directory is not included.
+"""
+	try:
+		fds = [int(fd) for fd in os.listdir(open_fds.fd_dir)]
+	except:
+		return None
+	isopen = []
+	for fd in sorted(fds):
+		try:
+			os.fstat(fd)
+			isopen.append(fd)
+		except:
+			pass
+	return isopen
+open_fds.fd_dir = '/proc/self/fd'	  # Only trusted where it lists every fd
+
+def proc_stat(pid):
+	"""
+	Returns (state, ppid) for "pid" from /proc, where "state" is the
+	single-letter process state, or None if the process does not exist
+	or /proc is not available.
+"""
+	try:
+		with open('/proc/%d/stat' % (pid,), 'rb') as f:
+			stat = f.read()
+		fields = stat[stat.rindex(b')')+2:].split()
+		return (fields[0].decode('ascii'), int(fields[1]))
+	except (IOError, OSError, ValueError, IndexError):
+		return None
+
+def proc_environ(pid):
+	"""
+	Returns the environment of "pid" from /proc as a dict, or None if
+	it can't be read.
+"""
+	try:
+		with open('/proc/%d/environ' % (pid,), 'rb') as f:
+			data = f.read()
+	except (IOError, OSError):
+		return None
+	env = {}
+	for item in data.split(b'\0'):
+		if b'=' in item:
+			tag, val = item.split(b'=', 1)
+			env[tag.decode('utf-8', 'replace')] = val.decode('utf-8', 'replace')
+	return env
+
+def pids_alive(pids):
+	"""
+	Returns the set of "pids" that are running processes.  Where /proc is
+	available, each pid's stat file is read so that zombies, which may
+	linger if nothing reaps them, are not counted.  Otherwise each pid is
+	checked with a zero signal.
+"""
+	live = set()
+	use_proc = os.path.isdir('/proc/self')
+	for pid in set(pids):
+		if use_proc:
+			stat = proc_stat(pid)
+			if stat and stat[0] != 'Z':
+				live.add(pid)
+			continue
+		try:
+			os.kill(pid, 0)
+			live.add(pid)
+		except OSError as e:
+			if e.errno == errno.EPERM:
+				live.add(pid)
+	return live
+
 def closeall(**params):
 	"""
 	Close all file descriptors.  This turns out to be harder than you'd
@@ -405,11 +479,16 @@ def closeall(**params):
 
 	http://stackoverflow.com/questions/899038/getting-the-highest-allocated-file-descriptor
 
-	The default algorithm here is to close until "closeall.beyond_last_fd"
-	close failures are registered.  The default value can be overriden.
-	In some cases where a daemon handles a large number of connections,
-	this approach may not be sufficient, so the "maxfd" param below
-	alters the approach.
+	Where open_fds() can list the open file descriptors, exactly those
+	are closed, so the cost does not depend on the NOFILE limit and
+	sparse high descriptors are not missed.  The "beyond" param is not
+	used in this case.
+
+	Otherwise, the default algorithm here is to close until
+	"closeall.beyond_last_fd" close failures are registered.  The
+	default value can be overriden.  In some cases where a daemon
+	handles a large number of connections, this approach may not be
+	sufficient, so the "maxfd" param below alters the approach.
 
 	Supported params are:
 
@@ -451,12 +530,25 @@ def closeall(**params):
 	else:										# pragma: no cover
 		last_exc_fd = None
 
+	highest = -1
+	listed = open_fds()
+	if listed is not None:
+		for fd in listed:
+			if maxfd is not None and maxfd is not True and fd > maxfd:
+				break
+			if not excludes.get(fd):
+				try:
+					os.close(fd)
+					highest = fd
+				except:
+					pass
+		return None if highest == -1 else highest
+
 	#  Find the maximum available fd
 
 	if maxfd is True:
 		maxfd = sys_maxfd()
 
-	highest = -1
 	fd = 0
 	while True:
 		if maxfd is None:
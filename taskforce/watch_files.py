@@ -16,8 +16,9 @@
 # ________________________________________________________________________
 #
 
-import sys, os, time, errno, select, logging
+import sys, os, time, errno, select, logging, array
 from . import utils
+from . import inotify
 from .utils import ses
 
 #  These values are used internally to select watch mode.
@@ -25,6 +26,12 @@ from .utils import ses
 WF_POLLING = 0
 WF_KQUEUE = 1
 WF_INOTIFYX = 2
+WF_INOTIFY = 3
+
+#  Both inotify modes use the same code paths, differing only in
+#  the module that supplies the interface to inotify(7).
+#
+wf_inotify_modes = set([WF_INOTIFYX, WF_INOTIFY])
 
 wf_inotifyx_available = False
 try:
@@ -34,6 +41,195 @@ try:
 except:
 	pass
 
+wf_inotify_available = inotify.available
+
+#  os.scandir() is only available from python 3.5.  Without it, the
+#  polling table falls back to a stat() per path.
+#
+_scandir = getattr(os, 'scandir', None)
+
+class _poll_table(object):
+	"""
+	Holds the stat() signatures of watched paths for WF_POLLING mode.
+
+	Signatures are kept in a single array of doubles with a fixed stride
+	per path, rather than a tuple per path, and slots are reused via a
+	free-list.  Paths are grouped by directory so a sweep can read each
+	directory once with os.scandir() and stat only the entries being
+	watched.  A sweep compares each fresh signature with its slot and
+	only rewrites the slots that differ, so the work done is bounded by
+	the directories swept rather than the size of the table.
+
+	sweep() accepts a time budget in seconds.  When the budget is used up,
+	the sweep stops at a directory boundary and the next sweep resumes
+	with the following directory, so large watch lists are spread across
+	multiple calls.
+"""
+	_stride = 6
+
+	#  Written into a slot to guarantee the next sweep sees a change.
+	#
+	_reset = (-1.0,) * _stride
+
+	def __init__(self):
+		self._sig = array.array('d')
+		self._free = []
+		self._slots = {}
+		self._paths = {}
+		self._dirs = {}
+		self._dir_order = None
+		self._cursor = 0
+
+	def __len__(self):
+		return len(self._slots)
+
+	def __contains__(self, fd):
+		return fd in self._slots
+
+	def _split(self, path):
+		return os.path.split(os.path.normpath(path))
+
+	def _signature(self, path=None, st=None):
+		"""
+		Note that we have to use stat() rather than fstat() because we want
+		to detect file removes and renames.
+	"""
+		if st is None:
+			st = os.stat(path)
+		return (st.st_mode, st.st_nlink, st.st_uid, st.st_gid, st.st_size, st.st_mtime)
+
+	def _store(self, slot, sig):
+		"""
+		Write the signature into the slot, returning True if it differs
+		from the one already there.
+	"""
+		base = slot * self._stride
+		new = array.array('d', sig)
+		if self._sig[base:base+self._stride] == new:
+			return False
+		self._sig[base:base+self._stride] = new
+		return True
+
+	def add(self, fd, path):
+		"""
+		Add an open path.  If the initial stat() fails, the path is
+		reported as gone on the next sweep.
+	"""
+		if fd in self._slots:
+			self.remove(fd)
+		if self._free:
+			slot = self._free.pop()
+		else:
+			slot = len(self._sig) // self._stride
+			self._sig.extend(self._reset)
+		try:
+			sig = self._signature(path)
+		except Exception:
+			sig = self._reset
+		self._store(slot, sig)
+		self._slots[fd] = slot
+		self._paths[fd] = path
+		dirpath, name = self._split(path)
+		if dirpath not in self._dirs:
+			self._dirs[dirpath] = {}
+			self._dir_order = None
+		if name not in self._dirs[dirpath]:
+			self._dirs[dirpath][name] = []
+		self._dirs[dirpath][name].append(fd)
+
+	def remove(self, fd):
+		if fd not in self._slots:
+			return
+		slot = self._slots.pop(fd)
+		path = self._paths.pop(fd)
+		self._store(slot, (0.0,) * self._stride)
+		self._free.append(slot)
+		dirpath, name = self._split(path)
+		names = self._dirs[dirpath]
+		names[name].remove(fd)
+		if not names[name]:
+			del names[name]
+		if not names:
+			del self._dirs[dirpath]
+			self._dir_order = None
+
+	def reset(self, fd):
+		"""
+		Ensure the next sweep reports a change on the path.
+	"""
+		if fd in self._slots:
+			self._store(self._slots[fd], self._reset)
+
+	def refresh(self, fd):
+		"""
+		Record the current signature of a path without reporting a change.
+	"""
+		if fd in self._slots:
+			try:
+				self._store(self._slots[fd], self._signature(self._paths[fd]))
+			except Exception:
+				self.reset(fd)
+
+	def _stat_dir(self, dirpath, names):
+		"""
+		Returns a list of (fd, signature) for the watched paths in a directory.
+		The signature is None if the path no longer exists.  A directory
+		holding a single watched path is cheaper to stat() directly.
+	"""
+		found = {}
+		if _scandir is not None and len(names) > 1:
+			try:
+				for entry in _scandir(dirpath or '.'):
+					if entry.name in names:
+						try:
+							found[entry.name] = self._signature(st=entry.stat())
+						except OSError:
+							pass
+			except OSError:
+				found = None
+		else:
+			found = None
+		result = []
+		for name, fds in names.items():
+			for fd in fds:
+				if found is not None:
+					result.append((fd, found.get(name)))
+					continue
+				try:
+					sig = self._signature(self._paths[fd])
+				except Exception:
+					sig = None
+				result.append((fd, sig))
+		return result
+
+	def sweep(self, budget=None):
+		"""
+		Check the watched paths, returning lists of the fds of paths
+		that have changed and of paths that have gone.
+	"""
+		changed = []
+		gone = []
+		if not self._slots:
+			return changed, gone
+		if self._dir_order is None:
+			self._dir_order = list(self._dirs)
+			self._dir_order.sort()
+		start = time.time()
+		count = len(self._dir_order)
+		for n in range(count):
+			if self._cursor >= count:
+				self._cursor = 0
+			dirpath = self._dir_order[self._cursor]
+			self._cursor += 1
+			for fd, sig in self._stat_dir(dirpath, self._dirs[dirpath]):
+				if sig is None:
+					gone.append(fd)
+				elif self._store(self._slots[fd], sig):
+					changed.append(fd)
+			if budget is not None and time.time() - start >= budget:
+				break
+		return changed, gone
+
 class watch(object):
 	"""
 	Sets up an instance that can be included in a select/poll set.  The
@@ -48,8 +244,9 @@ class watch(object):
 	a polling mode which is much less efficient, but probably better than
 	nothing.
 
-	At the moment, inotify is not supported, so Linux systems will operate
-	in polling mode.
+	On Linux, the "inotifyx" extension is used if it is installed (WF_INOTIFYX),
+	otherwise inotify is accessed via the built-in taskforce.inotify module
+	(WF_INOTIFY).  Both behave identically.
 
 	Apart from simplifying the use of select.kqueue calls, the intent is to
 	mask changes that might be needed if linux inotify needs to be supported.
@@ -102,6 +299,11 @@ class watch(object):
 			   practical advantage over file system events so this
 			   param really exists for testing polling mode.
 
+	  poll_budget   -  In polling mode, the maximum time in seconds that
+			   a single scan() or get() should spend checking paths.
+			   When exceeded, the check resumes on the next call.
+			   The default is None (check all paths on each call).
+
 	  log		-  A logging instance.
 """
 	def __init__(self, polling=False, **params):
@@ -109,7 +311,8 @@ class watch(object):
 
 		self._mode_map = dict((val, nam) for nam, val in globals().items() if nam.startswith('WF_'))
 
-		#  Set up the access mode.  If select.kqueue() is callable, WF_KQUEUE
+		#  Set up the access mode.  If inotify is available, one of the inotify
+		#  modes will be used.  If select.kqueue() is callable, WF_KQUEUE
 		#  mode will be used, otherwise polling will be used.  The get_mode()
 		#  method supplies read-only access to th attribute.  The value is not
 		#  settable after the class is instantiated.
@@ -118,6 +321,8 @@ class watch(object):
 			self._mode = WF_POLLING
 		elif wf_inotifyx_available:
 			self._mode = WF_INOTIFYX
+		elif wf_inotify_available:
+			self._mode = WF_INOTIFY
 		elif 'kqueue' in dir(select) and callable(select.kqueue):
 			self._mode = WF_KQUEUE
 		else:
@@ -138,6 +343,26 @@ class watch(object):
 		#
 		self.fds_open = {}
 
+		#  Directory watches used to detect the appearance of pending paths.
+		#  _dir_watch maps a directory to its watch identity (an open fd in
+		#  WF_KQUEUE mode, a watch-descriptor in the inotify modes), and
+		#  _dir_idents is the inverse.  _dir_names maps each watched directory
+		#  to the pending paths within it, keyed by basename.
+		#
+		self._dir_watch = {}
+		self._dir_idents = {}
+		self._dir_names = {}
+
+		#  Holds pending paths whose directory could not be watched.  Only
+		#  these need an existence check in scan().  _dir_recheck is set
+		#  when the whole pending list needs checking on the next scan(),
+		#  which closes the race between a file appearing and its directory
+		#  watch being set up.
+		#
+		self._dir_unwatched = set()
+		self._dir_recheck = False
+		self._dir_stale = False
+
 		#  Provided to caller to observe the last set of changes.  The
 		#  value of the dict is the time the change was noted.
 		#
@@ -152,16 +377,20 @@ class watch(object):
 			#  call to fileno() will return the correct controlling fd.
 			#
 			self._kq = select.kqueue()
-		elif self._mode == WF_INOTIFYX:
-			#  Immediately create an inotifyx channel identified by a
+		elif self._mode in wf_inotify_modes:
+			#  Select the module providing inotify access.
+			#
+			self._inx = inotifyx if self._mode == WF_INOTIFYX else inotify
+
+			#  Immediately create an inotify channel identified by a
 			#  file descriptor.
 			#
-			self._inx_fd = inotifyx.init()
+			self._inx_fd = self._inx.init()
 
 			#  This is the standard mask used for watches.  It is setup
 			#  to only trigger events when somethingn changes.
 			#
-			self._inx_mask = inotifyx.IN_ALL_EVENTS & ~(inotifyx.IN_ACCESS | inotifyx.IN_CLOSE | inotifyx.IN_OPEN)
+			self._inx_mask = self._inx.IN_ALL_EVENTS & ~(self._inx.IN_ACCESS | self._inx.IN_CLOSE | self._inx.IN_OPEN)
 
 			# Record inode of watched paths to work around simfs bug 
 			#
@@ -169,10 +398,10 @@ class watch(object):
 		elif self._mode == WF_POLLING:
 			self._self_pipe()
 
-			self._poll_stat = {}
+			self._poll_table = _poll_table()
 
-			#  Holds paths that were removed or renamed until get() is
-			#  called.
+			#  Holds paths that were changed, removed or renamed until
+			#  get() is called.
 			#
 			self._poll_pending = {}
 
@@ -188,7 +417,7 @@ class watch(object):
 			try: self._kq.close()
 			except: pass
 			self._kq = None
-		elif self._mode == WF_INOTIFYX:
+		elif self._mode in wf_inotify_modes:
 			#  As we are storing inotify watch-descriptors rather
 			#  than file descriptors in fds_open, skip closing them.
 			#  They are automatically cleared when _inx_fd is closed
@@ -210,11 +439,17 @@ class watch(object):
 				try: os.close(fd)
 				except: pass
 				del self.fds_open[fd]
+			for fd in list(self._dir_idents):
+				try: os.close(fd)
+				except: pass
+		self._dir_watch = {}
+		self._dir_idents = {}
+		self._dir_names = {}
 
 	def fileno(self):
 		if self._mode == WF_KQUEUE:
 			return self._kq.fileno()
-		elif self._mode == WF_INOTIFYX:
+		elif self._mode in wf_inotify_modes:
 			return self._inx_fd
 		else:
 			return self._poll_fd
@@ -243,8 +478,8 @@ class watch(object):
 		Close the descriptor used for a path regardless
 		of mode.
 	"""
-		if self._mode == WF_INOTIFYX:
-			try: inotifyx.rm_watch(self._inx_fd, fd)
+		if self._mode in wf_inotify_modes:
+			try: self._inx.rm_watch(self._inx_fd, fd)
 			except: pass
 		else:
 			try: os.close(fd)
@@ -274,9 +509,9 @@ class watch(object):
 
 		log.debug("Path '%s' removed or renamed, handling removal", path)
 		self._close(fd)
-		if self._mode == WF_POLLING and fd in self._poll_stat:
-			del self._poll_stat[fd]
-		if self._mode == WF_INOTIFYX and path in self._inx_inode:
+		if self._mode == WF_POLLING:
+			self._poll_table.remove(fd)
+		if self._mode in wf_inotify_modes and path in self._inx_inode:
 			del self._inx_inode[path]
 		del self.fds_open[fd]
 		del self.paths_open[path]
@@ -289,25 +524,30 @@ class watch(object):
 				log.debug("Path '%s' reappearance check failed -- %s", path, str(e))
 			log.debug("Path '%s' marked as pending", path)
 			self.paths_pending[path] = True
+			self._dir_stale = True
 		else:
 			del self.paths[path]
 			raise Exception("Path '%s' has been removed or renamed" % (path,))
 
-	def _poll_get_stat(self, fd, path):
+	def _poll_sweep(self, **params):
 		"""
-		Check the status of an open path.  Note that we have to use stat() rather
-		than fstat() because we want to detect file removes and renames.
+		Check open paths for changes, recording any that are found until
+		get() is called.  Returns the number of changes found.
 	"""
-		try:
-			st = os.stat(path)
-			fstate = (st.st_mode, st.st_nlink, st.st_uid, st.st_gid, st.st_size, st.st_mtime)
-		except Exception as e:
-			log = self._getparam('log', self._discard)
-			log.debug("stat failed on %s -- %s", path, str(e))
-			self._poll_pending[path] = time.time()
-			self._disappeared(fd, path)
-			fstate = None
-		return fstate
+		log = self._getparam('log', self._discard, **params)
+		budget = self._getparam('poll_budget', None, **params)
+		changed, gone = self._poll_table.sweep(budget)
+		now = time.time()
+		for fd in changed:
+			path = self.fds_open[fd]
+			self._poll_pending[path] = now
+			log.debug("Change on '%s'", path)
+		for fd in gone:
+			path = self.fds_open[fd]
+			log.debug("stat failed on %s", path)
+			self._poll_pending[path] = now
+			self._disappeared(fd, path, **params)
+		return len(changed) + len(gone)
 
 	def _poll_trigger(self):
 		"""
@@ -324,12 +564,143 @@ class watch(object):
 			if fd in self.fds_open:
 				path = self.fds_open[fd]
 				del self.fds_open[fd]
-				if self._mode == WF_INOTIFYX and path in self._inx_inode:
+				if self._mode in wf_inotify_modes and path in self._inx_inode:
 					del self._inx_inode[path]
 				if path in self.paths_open:
 					del self.paths_open[path]
 			self._close(fd)
 
+	def _dir_add(self, dirpath, **params):
+		"""
+		Set up a watch on a directory that holds pending paths.  Returns
+		the watch identity, or None if the directory can't be watched.
+	"""
+		log = self._getparam('log', self._discard, **params)
+		if self._mode == WF_KQUEUE:
+			try:
+				fd = os.open(dirpath, os.O_RDONLY)
+			except Exception as e:
+				log.debug("Open failed on directory '%s' of pending path -- %s", dirpath, str(e))
+				return None
+			try:
+				ev = select.kevent(fd,
+					filter=select.KQ_FILTER_VNODE,
+					flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+					fflags=select.KQ_NOTE_WRITE | select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME)
+				self._kq.control([ev], 0, 0)
+			except Exception as e:
+				log.warning("kevent failed on directory '%s' of pending path -- %s", dirpath, str(e))
+				try: os.close(fd)
+				except: pass
+				return None
+			return fd
+		elif self._mode in wf_inotify_modes:
+			#  A directory that is itself a watched path shares the watch-descriptor,
+			#  so leave it to the existence check rather than change its mask.
+			#
+			if dirpath in self.paths_open:
+				return None
+			mask = (self._inx.IN_CREATE | self._inx.IN_MOVED_TO |
+					self._inx.IN_DELETE_SELF | self._inx.IN_MOVE_SELF | self._inx.IN_ONLYDIR)
+			try:
+				wd = self._inx.add_watch(self._inx_fd, dirpath, mask)
+			except Exception as e:
+				log.debug("inotify failed on directory '%s' of pending path -- %s", dirpath, str(e))
+				return None
+			if wd in self.fds_open:
+				try: self._inx.add_watch(self._inx_fd, dirpath, self._inx_mask)
+				except: pass
+				return None
+			return wd
+		return None
+
+	def _dir_forget(self, ident, **params):
+		"""
+		Remove a directory watch from the maps.  The caller is responsible
+		for releasing the watch itself.
+	"""
+		dirpath = self._dir_idents.get(ident)
+		if dirpath is None:
+			return None
+		del self._dir_idents[ident]
+		del self._dir_watch[dirpath]
+		if dirpath in self._dir_names:
+			del self._dir_names[dirpath]
+		return dirpath
+
+	def _dir_drop(self, dirpath, **params):
+		"""
+		Release the watch on a directory no longer holding pending paths.
+	"""
+		ident = self._dir_watch.get(dirpath)
+		if ident is None:
+			return
+		self._dir_forget(ident)
+		if self._mode == WF_KQUEUE:
+			try: os.close(ident)
+			except: pass
+		elif self._mode in wf_inotify_modes and ident not in self.fds_open:
+			try: self._inx.rm_watch(self._inx_fd, ident)
+			except: pass
+
+	def _dir_sync(self, **params):
+		"""
+		Adjust directory watches so that exactly the directories holding
+		pending paths are watched.  Pending paths in directories that can't
+		be watched are recorded for existence checks in scan().
+	"""
+		log = self._getparam('log', self._discard, **params)
+		self._dir_stale = False
+		if self._mode == WF_POLLING:
+			self._dir_unwatched = set(self.paths_pending)
+			return
+		want = {}
+		for path in self.paths_pending:
+			dirpath = os.path.dirname(path)
+			if not dirpath:
+				dirpath = '.'
+			if dirpath not in want:
+				want[dirpath] = {}
+			want[dirpath][os.path.basename(path)] = path
+		for dirpath in list(self._dir_watch):
+			if dirpath not in want:
+				log.debug("Removing watch on directory '%s', no pending paths remain", dirpath)
+				self._dir_drop(dirpath, **params)
+		unwatched = set()
+		for dirpath, names in want.items():
+			if dirpath not in self._dir_watch:
+				ident = self._dir_add(dirpath, **params)
+				if ident is None:
+					unwatched.update(names.values())
+					continue
+				log.debug("Watching directory '%s' for %d pending path%s", dirpath, len(names), ses(len(names)))
+				self._dir_watch[dirpath] = ident
+				self._dir_idents[ident] = dirpath
+				self._dir_recheck = True
+			self._dir_names[dirpath] = names
+		self._dir_unwatched = unwatched
+
+	def _dir_event(self, ident, name=None, gone=False, **params):
+		"""
+		Handle an event on a directory watch.  Returns True if a pending
+		path in the directory may have appeared.  inotify supplies the name
+		of the entry created, kqueue only reports that the directory changed
+		so the pending paths in the directory are checked for existence.
+	"""
+		log = self._getparam('log', self._discard, **params)
+		dirpath = self._dir_idents[ident]
+		names = self._dir_names.get(dirpath, {})
+		if gone:
+			log.debug("Watched directory '%s' removed or renamed", dirpath)
+			self._dir_drop(dirpath, **params)
+			return False
+		if name is not None:
+			return name in names
+		for path in names.values():
+			if os.path.exists(path):
+				return True
+		return False
+
 	def _trigger(self, fd, **params):
 		"""
 		We need events to fire on appearance because the code
@@ -358,17 +729,17 @@ class watch(object):
 				log.debug("Added timer event following pending file promotion")
 			except Exception as e:
 				log.error("Failed to add timer event following pending file promotion -- %s", str(e))
-		elif self._mode == WF_INOTIFYX:
+		elif self._mode in wf_inotify_modes:
 			if fd in self.fds_open:
 				try:
 					path = self.fds_open[fd]
-					nfd = inotifyx.add_watch(self._inx_fd, path, self._inx_mask|inotifyx.IN_OPEN)
+					nfd = self._inx.add_watch(self._inx_fd, path, self._inx_mask|self._inx.IN_OPEN)
 					if nfd != fd:
 						raise Exception("Assertion failed: IN_OPEN add_watch() set gave new wd")
 					tfd = os.open(path, os.O_RDONLY)
 					try: os.close(tfd)
 					except: pass
-					nfd = inotifyx.add_watch(self._inx_fd, path, self._inx_mask)
+					nfd = self._inx.add_watch(self._inx_fd, path, self._inx_mask)
 					if nfd != fd:
 						raise Exception("Assertion failed: IN_OPEN add_watch() clear gave new wd")
 				except Exception as e:
@@ -377,7 +748,9 @@ class watch(object):
 			else:
 				log.error("Pending file promotion of unknown wd %d failed", fd)
 		elif self._mode == WF_POLLING:
-			self._poll_stat[fd] = ()
+			if fd in self.fds_open:
+				self._poll_table.refresh(fd)
+				self._poll_pending[self.fds_open[fd]] = time.time()
 			self._poll_trigger()
 
 	def _add_file(self, path, **params):
@@ -414,7 +787,7 @@ class watch(object):
 				except: pass
 				raise e
 
-		elif self._mode == WF_INOTIFYX:
+		elif self._mode in wf_inotify_modes:
 			#  inotify doesn't need the target paths open, so now it is known to be
 			#  accessible, close the actual fd and use the watch-descriptor as the fd.
 			#
@@ -433,17 +806,22 @@ class watch(object):
 			try: os.close(fd)
 			except: pass
 			try:
-				fd = inotifyx.add_watch(self._inx_fd, path, self._inx_mask)
+				fd = self._inx.add_watch(self._inx_fd, path, self._inx_mask)
 				log.debug("path %s watched with wd %d", path, fd)
 			except Exception as e:
 				log.error("inotify failed on watched path '%s' -- %s", path, str(e))
 				raise e
 
+			#  If the path is a directory already watched for pending paths, the
+			#  watch-descriptor is now shared, so the directory watch is dropped
+			#  and its pending paths revert to existence checks.
+			#
+			if self._dir_forget(fd):
+				self._dir_stale = True
+
 		elif self._mode == WF_POLLING:
 			log.debug("path %s opened as fd %d", path, fd)
-			fstate = self._poll_get_stat(fd, path)
-			if fstate:
-				self._poll_stat[fd] = fstate
+			self._poll_table.add(fd, path)
 
 		self.paths_open[path] = fd
 		self.fds_open[fd] = path
@@ -471,18 +849,23 @@ class watch(object):
 						os.close(fd)
 					except Exception as e:
 						log.warning("close failed on watched file '%s' -- %s", path, str(e))
-				elif self._mode == WF_INOTIFYX:
+				elif self._mode in wf_inotify_modes:
 					try:
-						inotifyx.rm_watch(self._inx_fd, fd)
+						self._inx.rm_watch(self._inx_fd, fd)
 					except Exception as e:
 						log.warning("remove failed on watched file '%s' -- %s", path, str(e))
 					if path in self._inx_inode:
 						del self._inx_inode[path]
+
+					#  If a directory watch shared the watch-descriptor, it has
+					#  also gone, so forget it and let _dir_sync() replace it.
+					#
+					self._dir_forget(fd)
 				elif self._mode == WF_POLLING:
-					if fd in self._poll_stat:
-						del self._poll_stat[fd]
+					if fd in self._poll_table:
+						self._poll_table.remove(fd)
 					else:
-						log.warning("fd watched path '%s' missing from _poll_stat map", path)
+						log.warning("fd watched path '%s' missing from _poll_table", path)
 					try:
 						os.close(fd)
 					except Exception as e:
@@ -521,7 +904,9 @@ class watch(object):
 				log.debug("Added watch for path '%s' with ident %d", path, self.paths_open[path])
 		if failed:
 			self._clean_failed_fds(fdlist)
+			self._dir_sync(**params)
 			raise Exception("Failed to set watch on %s -- %s" % (str(failed), str(last_exc)))
+		self._dir_sync(**params)
 		log.debug("%d added, %d removed", added, removed)
 
 	def get(self, **params):
@@ -556,6 +941,10 @@ class watch(object):
 		if self.unprocessed_event:
 			log.debug("Will handle unprocessed event")
 
+		#  Set when a directory event indicates a pending path may have appeared.
+		#
+		appeared = False
+
 		if self._mode == WF_KQUEUE:
 			evagg = {}
 			while True:
@@ -576,6 +965,12 @@ class watch(object):
 							evagg[path].fflags |= ev.fflags
 						else:
 							evagg[path] = ev
+					elif ev.ident in self._dir_idents:
+						gone = (ev.fflags & (select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME)) != 0
+						if self._dir_event(ev.ident, gone=gone, **params):
+							appeared = True
+						elif gone:
+							self._dir_stale = True
 				if limit and len(evagg) >= limit:
 					break
 			for path, ev in evagg.items():
@@ -584,11 +979,11 @@ class watch(object):
 				self.last_changes[path] = time.time()
 				log.debug("Change on '%s'", path)
 
-		elif self._mode == WF_INOTIFYX:
+		elif self._mode in wf_inotify_modes:
 			evagg = {}
 			while True:
 				try:
-					evlist = inotifyx.get_events(self._inx_fd, timeout)
+					evlist = self._inx.get_events(self._inx_fd, timeout)
 				except IOError as e:
 					if e.errno == errno.EINTR:
 						break
@@ -596,16 +991,24 @@ class watch(object):
 				if not evlist:
 					break
 
-				log.debug("inotifyx.get_events() returned %d event%s", len(evlist), ses(len(evlist)))
+				log.debug("%s.get_events() returned %d event%s", self._inx.__name__, len(evlist), ses(len(evlist)))
 
 				for ev in evlist:
+					if ev.wd in self._dir_idents:
+						gone = (ev.mask & (self._inx.IN_DELETE_SELF | self._inx.IN_MOVE_SELF |
+									self._inx.IN_IGNORED)) != 0
+						if self._dir_event(ev.wd, name=ev.name, gone=gone, **params):
+							appeared = True
+						elif gone:
+							self._dir_stale = True
+						continue
 					if ev.wd in self.fds_open:
 						path = self.fds_open[ev.wd]
 						if path in evagg:
 							evagg[path].mask |= ev.mask
 						else:
 							evagg[path] = ev
-					elif ev.mask & inotifyx.IN_IGNORED:
+					elif ev.mask & self._inx.IN_IGNORED:
 						log.debug("skipping IN_IGNORED event on unknown wd %d", ev.wd)
 					else:
 						log.warning("attempt to handle unknown inotify event wd %d", ev.wd)
@@ -613,9 +1016,9 @@ class watch(object):
 					break
 			for path, ev in evagg.items():
 				log.debug("Change on '%s' -- %s", path, ev.get_mask_description())
-				if ev.mask & (inotifyx.IN_DELETE_SELF | inotifyx.IN_MOVE_SELF):
+				if ev.mask & (self._inx.IN_DELETE_SELF | self._inx.IN_MOVE_SELF):
 					self._disappeared(ev.wd, path, **params)
-				elif ev.mask & inotifyx.IN_ATTRIB:
+				elif ev.mask & self._inx.IN_ATTRIB:
 					file_move_del = False
 					try:
 						s = os.stat(path)
@@ -649,21 +1052,27 @@ class watch(object):
 					log.warning("Ignoring self-pipe read failure -- %s", str(e))
 					break
 			log.debug("Self-pipe read consumed %d byte%s", cnt, ses(cnt))
-			now = time.time()
+
+			#  Changes are normally recorded by scan() which then triggered
+			#  this call, so only check the paths here if nothing is recorded.
+			#
+			if not self._poll_pending:
+				self._poll_sweep(**params)
 			for path in self._poll_pending:
 				self.last_changes[path] = self._poll_pending[path]
 			self._poll_pending = {}
-			for fd in list(self._poll_stat):
-				path = self.fds_open[fd]
-				fstate = self._poll_get_stat(fd, path)
-				if fstate is None:
-					self.last_changes[path] = now
-				elif self._poll_stat[fd] != fstate:
-					self._poll_stat[fd] = fstate
-					self.last_changes[path] = now
-					log.debug("Change on '%s'", path)
 		else:
 			raise Exception("Unsupported polling mode " + self.get_mode_name())
+
+		#  A pending path has appeared, so commit() promotes it to a watched
+		#  path.  That triggers an event so the change will be reported by the
+		#  next get().
+		#
+		if appeared:
+			log.debug("Directory change indicates a pending path appeared, triggering commit()")
+			self.commit(**params)
+		elif self._dir_stale:
+			self._dir_sync(**params)
 		paths = list(self.last_changes)
 		paths.sort()
 		log.debug("Change was to %d path%s", len(paths), ses(len(paths)))
@@ -734,39 +1143,36 @@ class watch(object):
 		The method should be called frequently (perhaps every 1-5 seconds)
 		as part of idle processing in a select/poll loop.
 
-		The approach is intended to support file appearance and disappearance
-		using kqueue/kevent on BSD while retaining the ability in the
-		future to transparently support inotify on Linux without any code
-		or efficiency impact on callers.
-
-		For WF_KQUEUE and WF_INOTIFYX mode, processing consists of determining
-		that a pending path is now accessible, and then calling commit() to
-		make the necessary adjustments.  This will be efficient as long as the
-		list of pending paths is small.
-
-		At some point this should be optimized by watching the directory of
-		a pending target (assuming it exists).	If the directory changes to
-		indicate the pending path might have appeared, then the next get()
-		call should perform a scan().
-
-		For WF_POLLING mode, the entire list of open files is also scanned
-		looking for significant differences in the os.fstat info.
-
-		If/when inotify is supported here, it is expected that the scan()
-		method would be a no-op.
+		For WF_KQUEUE and the inotify modes, the directory of each pending
+		path is watched.  When an entry matching a pending path is created
+		or renamed into the directory, get() calls commit() to start watching
+		the path, so scan() has nothing to do for these paths.  Pending paths
+		whose directory does not exist or can't be watched are checked for
+		existence here, and if any is now accessible, commit() is called to
+		make the necessary adjustments.  An attempt is also made to watch
+		their directories in case they have since appeared.
+
+		For WF_POLLING mode, every pending path is checked, and the list of
+		open files is also scanned looking for significant differences in
+		the os.stat() info.  If the "poll_budget" param is set, the scan of
+		open files may be spread across multiple calls.
 	"""
 		log = self._getparam('log', self._discard, **params)
-		pending = len(self.paths_pending)
-		log.debug("Checking %d pending path%s", pending, ses(pending))
-		for path in self.paths_pending:
+		if self._dir_stale or self._dir_unwatched:
+			self._dir_sync(**params)
+		if self._dir_recheck:
+			self._dir_recheck = False
+			check = list(self.paths_pending)
+		else:
+			check = list(self._dir_unwatched)
+		pending = len(check)
+		log.debug("Checking %d of %d pending path%s", pending, len(self.paths_pending), ses(len(self.paths_pending)))
+		for path in check:
 			if os.path.exists(path):
 				log.debug("pending path %s now accessible, triggering commit()", path)
 				self.commit(**params)
 				return
 		if self._mode == WF_POLLING:
-			log.debug("Checking %d open path%s", len(self._poll_stat), ses(len(self._poll_stat)))
-			for fd in list(self._poll_stat):
-				fstate = self._poll_get_stat(fd, self.fds_open[fd])
-				if fstate is None or self._poll_stat[fd] != fstate:
-					self._poll_trigger()
-					break
+			log.debug("Checking %d open path%s", len(self._poll_table), ses(len(self._poll_table)))
+			if self._poll_sweep(**params):
+				self._poll_trigger()
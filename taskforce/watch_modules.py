@@ -17,12 +17,179 @@
 # ________________________________________________________________________
 #
 
-import sys, os, time, select, logging
+import sys, os, time, select, logging, json
 import modulefinder
 from . import watch_files
 from . import utils
 from .utils import ses
 
+#  The file type ModuleFinder uses for python source.  This moved from
+#  the "imp" module to a private modulefinder constant in python 3.
+#
+_PY_SOURCE = getattr(modulefinder, '_PY_SOURCE', None)
+if _PY_SOURCE is None:										# pragma: no cover
+	import imp
+	_PY_SOURCE = imp.PY_SOURCE
+
+class _edge_cache(object):
+	"""
+	Records the import statements found in each python source file so
+	that a file only needs to be parsed again if it changes.  Entries are
+	keyed on the real path of the file and are only valid while the file
+	mtime and size are unchanged.  Because the import statements depend
+	only on the file content, an entry can be shared by any command and
+	module path that reaches the file.
+
+	If a cache file is given, entries are loaded from it on creation and
+	save() writes back the entries used by this process.
+"""
+	#  Changing the layout of entries requires a new version.
+	#
+	version = 1
+
+	def __init__(self, cache_file=None, log=None):
+		self._cache_file = cache_file
+		self._log = log
+		self._entries = {}
+		self._used = set()
+		self._dirty = False
+		if cache_file:
+			self.load()
+
+	def _tag(self):
+		return '%d:%d.%d' % (self.version, sys.version_info[0], sys.version_info[1])
+
+	def load(self):
+		try:
+			with open(self._cache_file, 'rt') as f:
+				data = json.load(f)
+			if data.get('tag') != self._tag():
+				if self._log: self._log.info("Ignoring module cache '%s' from a different version", self._cache_file)
+				return
+			self._entries = data.get('entries', {})
+			if self._log: self._log.debug("Loaded %d module cache entries from '%s'",
+							len(self._entries), self._cache_file)
+		except Exception as e:
+			if self._log: self._log.debug("Module cache '%s' not loaded -- %s", self._cache_file, str(e))
+
+	def save(self):
+		"""
+		Write the cache file if it has changed.  The file is written
+		to a temporary path and renamed so readers never see a
+		partial file.
+	"""
+		if not self._cache_file or not self._dirty:
+			return
+		entries = dict((path, self._entries[path]) for path in self._used if path in self._entries)
+		temp = '%s.%d.tmp' % (self._cache_file, os.getpid())
+		try:
+			with open(temp, 'wt') as f:
+				json.dump({'tag': self._tag(), 'entries': entries}, f)
+			os.rename(temp, self._cache_file)
+			self._dirty = False
+			if self._log: self._log.debug("Saved %d module cache entries to '%s'", len(entries), self._cache_file)
+		except Exception as e:
+			if self._log: self._log.warning("Module cache save to '%s' failed -- %s", self._cache_file, str(e))
+			try: os.unlink(temp)
+			except: pass
+
+	def _key(self, path):
+		real = os.path.realpath(path)
+		st = os.stat(real)
+		return real, st.st_mtime, st.st_size
+
+	def lookup(self, path):
+		"""
+		Returns the recorded import calls for the file, or None if the
+		file is not cached or has changed.
+	"""
+		try:
+			real, mtime, size = self._key(path)
+		except Exception:
+			return None
+		entry = self._entries.get(real)
+		if entry is None or entry[0] != mtime or entry[1] != size:
+			return None
+		self._used.add(real)
+		return entry[2]
+
+	def store(self, path, calls):
+		try:
+			real, mtime, size = self._key(path)
+		except Exception:
+			return
+		self._entries[real] = [mtime, size, calls]
+		self._used.add(real)
+		self._dirty = True
+
+class _recorded_code(object):
+	"""
+	Stands in for a code object when scan_code() is replayed from the
+	cache.  It has no nested code objects because the recorded
+	operations already cover the whole file.
+"""
+	co_code = b''
+	co_consts = ()
+
+	def __init__(self, ops):
+		self.ops = ops
+
+class _finder(modulefinder.ModuleFinder):
+	"""
+	A ModuleFinder that replays the import operations of unchanged
+	python source files from an _edge_cache instead of compiling and
+	scanning them.  Module resolution still happens on every run so
+	the result follows changes to the module path.
+
+	The operations recorded are those produced by scan_opcodes(), so
+	replaying them through scan_code() has exactly the same effect as
+	scanning the file.
+
+	Note that ModuleFinder is an old-style class in python 2, so
+	super() can't be used.
+"""
+	def __init__(self, cache, *args, **kwargs):
+		modulefinder.ModuleFinder.__init__(self, *args, **kwargs)
+		self._cache = cache
+
+		#  Stack of operation lists for the source files being scanned.
+		#
+		self._recording = []
+
+	def load_module(self, fqname, fp, pathname, file_info):
+		if file_info[2] != _PY_SOURCE or not pathname:
+			return modulefinder.ModuleFinder.load_module(self, fqname, fp, pathname, file_info)
+		ops = self._cache.lookup(pathname)
+		if ops is not None:
+			m = self.add_module(fqname)
+			m.__file__ = pathname
+			self.scan_code(_recorded_code([(what, tuple(args)) for what, args in ops]), m)
+			return m
+		self._recording.append([])
+		try:
+			m = modulefinder.ModuleFinder.load_module(self, fqname, fp, pathname, file_info)
+		finally:
+			ops = self._recording.pop()
+		self._cache.store(pathname, ops)
+		return m
+
+	def _record(self, base, co):
+		if isinstance(co, _recorded_code):
+			for op in co.ops:
+				yield op
+			return
+		for what, args in base(self, co):
+			if self._recording:
+				self._recording[-1].append([what, list(args)])
+			yield what, args
+
+	def scan_opcodes(self, co):
+		return self._record(modulefinder.ModuleFinder.scan_opcodes, co)
+
+	if hasattr(modulefinder.ModuleFinder, 'scan_opcodes_25'):					# pragma: no cover
+		def scan_opcodes_25(self, co):
+			return self._record(modulefinder.ModuleFinder.scan_opcodes_25, co)
+
 class watch(object):
 	"""
 	Sets up an instance that can be included in a select/poll set.  The
@@ -41,6 +208,12 @@ class watch(object):
 			The default is to use sys.path.
 	  path       -  The PATH value to use to find commands.  Default
 			is the PATH environment value.
+	  cache_file -  Path of a file used to persist the import statements
+			found in each module between runs.  Modules are only
+			parsed again if their mtime or size changes.  The file
+			is written by scan() when there are new entries.  The
+			default is None, where the cache is held in memory.
+			Only available when instantiating the class.
 	  log	     -  A logging instance.
 
 	In addition, params supported by watch_files will be relayed to it.
@@ -53,6 +226,13 @@ class watch(object):
 		self.names = {}
 		self.modules = {}
 
+		#  Forward map of the module paths for each name, used to update
+		#  the inverted "modules" map incrementally.
+		#
+		self._name_modules = {}
+
+		self._cache = _edge_cache(params.get('cache_file'), log=self._getparam('log', self._discard))
+
 	def fileno(self):
 		return self._watch.fileno()
 
@@ -64,22 +244,21 @@ class watch(object):
 			val = default
 		return val
 
-	def _build(self, name, **params):
+	def _build(self, added, removed, **params):
 		"""
-		Rebuild operations by removing open modules that no longer need to be
-		watched, and adding new modules if they are not currently being watched.
-
-		This is done by comparing self.modules to watch_files.paths_open
+		Adjust the underlying file watch for paths that have been added
+		to or removed from self.modules.
 	"""
 		log = self._getparam('log', self._discard, **params)
 
-		#  Find all the modules that no longer need watching
-		#
 		rebuild = False
 		wparams = params.copy()
 		wparams['commit'] = False
-		for path in list(self._watch.paths_open):
-			if path in self.modules:
+
+		#  Remove the modules that no longer need watching
+		#
+		for path in removed:
+			if path not in self._watch.paths:
 				continue
 			try:
 				self._watch.remove(path, **wparams)
@@ -88,10 +267,10 @@ class watch(object):
 				log.warning("Remove of watched module '%s' failed -- %s", path, str(e))
 			log.debug("Removed watch for path '%s'", path)
 
-		#  Find all the modules that are new and should be watched
+		#  Add the modules that are new and should be watched
 		#
-		for path in list(self.modules):
-			if path not in self._watch.paths_open:
+		for path in added:
+			if path not in self._watch.paths:
 				try:
 					self._watch.add(path, **wparams)
 					rebuild = True
@@ -202,55 +381,60 @@ class watch(object):
 			raise Exception("Could not locate command '%s'" % (command_path,))
 		command = os.path.realpath(command)
 
-		#  It would be nice if ModuleFinder() would retain state between runs so
-		#  that it does not have to descend the tree for each command.  Unfortunately
-		#  all state appears to be held in its "modules" attribute which then accumulates
-		#  module references on each run_script() call.  That would wrongly attribute
-		#  modules to subsequent scripts so we have to re-instantiate the class for
-		#  each script.
+		#  ModuleFinder() accumulates module references on each run_script() call,
+		#  which would wrongly attribute modules to subsequent scripts, so a new
+		#  instance is needed for each script.  The expensive part, parsing each
+		#  file for imports, is shared via the edge cache.
 		#
-		finder = modulefinder.ModuleFinder(path=module_path)
+		finder = _finder(self._cache, path=module_path)
 		finder.run_script(command)
 
-		#  If the name was used previously, remove all references
-		#
-		if name in self.names:
-			log.debug("Removing existing entries for '%s'", name)
-			self.remove(name)
-		self.names[name] = command
-
-		#  Build an inverted list of files and associated command names, starting
-		#  with the command path itself.
-		#  
-		rebuild = False
-		if command in self.modules:
-			if name in self.modules[command]:
-				log.debug("Name '%s' already present in '%s'", name, command)
-			else:
-				log.debug("Command for '%s' added to '%s'", name, command)
-				self.modules[command].append(name)
-		else:
-			log.debug("Command '%s' added for '%s'", command, name)
-			self.modules[command] = [name]
-			rebuild = True
+		paths = set([command])
 		for modname, mod in list(finder.modules.items()):
 			path = mod.__file__
 			if not path:
 				log.debug("Skipping module '%s' -- no __file__ in module", modname)
 				continue
-			path = os.path.realpath(path)
+			paths.add(os.path.realpath(path))
+
+		#  Update the inverted list of files and associated command names by
+		#  applying the difference from any previous entry for the name.
+		#
+		old_paths = self._name_modules.get(name, set())
+		if name in self.names:
+			log.debug("Updating existing entries for '%s'", name)
+		self.names[name] = command
+		self._name_modules[name] = paths
+
+		added = []
+		for path in paths - old_paths:
 			if path in self.modules:
-				if name in  self.modules[path]:
-					log.debug("Name '%s' already present in '%s'", name, command)
-				else:
-					log.debug("'%s' added to '%s'", name, path)
-					self.modules[path].append(name)
+				log.debug("'%s' added to '%s'", name, path)
+				self.modules[path].append(name)
 			else:
 				log.debug("'%s' added for '%s'", path, name)
 				self.modules[path] = [name]
-				rebuild = True
-		if rebuild:
-			self._build(name, **params)
+				added.append(path)
+		removed = self._unlink(name, old_paths - paths)
+		if added or removed:
+			self._build(added, removed, **params)
+
+	def _unlink(self, name, paths):
+		"""
+		Remove the name from the inverted list for each path, returning
+		a list of paths no longer referenced by any name.
+	"""
+		removed = []
+		for path in paths:
+			names = self.modules.get(path)
+			if names is None:
+				continue
+			if name in names:
+				names.remove(name)
+			if len(names) == 0:
+				del self.modules[path]
+				removed.append(path)
+		return removed
 
 	def remove(self, name, **params):
 		"""
@@ -264,15 +448,9 @@ class watch(object):
 			log.error("Attempt to remove '%s' which was never added", name)
 			raise Exception("Command '%s' has never been added" % (name,))
 		del self.names[name]
-		rebuild = False
-		for path in list(self.modules):
-			if name in self.modules[path]:
-				self.modules[path].remove(name)
-			if len(self.modules[path]) == 0:
-				del self.modules[path]
-				rebuild = True
-		if rebuild:
-			self._build(name, **params)
+		removed = self._unlink(name, self._name_modules.pop(name, set()))
+		if removed:
+			self._build([], removed, **params)
 
 	def scan(self):
 		"""
@@ -280,5 +458,9 @@ class watch(object):
 		the file watcher is in WF_POLLING mode but even in WF_KQUEUE,
 		it is needed to reattach module files that are replaced via
 		a rename, as, for example, is done by rsync.
+
+		If there is a module cache file, it is also updated here if any
+		modules have been parsed since the last save.
 	"""
 		self._watch.scan()
+		self._cache.save()
@@ -0,0 +1,319 @@
+# ________________________________________________________________________
+#
+#  Copyright (C) 2014 Andrew Fullford
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ________________________________________________________________________
+#
+
+"""
+Pre-fork spawner ("zygote") for task processes.
+
+Forking the legion duplicates its whole address space for every process
+started.  The zygote is a separate python process, exec'ed fresh when the
+legion starts managing, which forks task processes from its own small
+image on request.
+
+The legion and zygote talk over a socketpair using newline-terminated
+JSON messages:
+
+    legion -> zygote    {"op": "spawn", "id": N, "spec": {...}}
+    zygote -> legion    {"op": "ready"}
+			{"op": "spawned", "id": N, "pid": PID}
+			{"op": "error", "id": N, "error": TEXT}
+			{"op": "exit", "pid": PID, "status": STATUS}
+
+The zygote loads the process start code once, then reports "ready".
+Until then, and whenever the zygote fails to answer promptly, the legion
+forks processes itself.
+
+The processes are children of the zygote, so the zygote reaps them and
+reports each exit status back to the legion.  The zygote exits when the
+legion closes its end of the socket.  Processes still running then are
+reparented to init, so the legion must watch them some other way.  The
+spawner's running() method lists them.
+"""
+
+import sys, os, time, errno, select, socket, signal, fcntl, json, logging
+from . import utils
+
+#  Run by the zygote's python interpreter.  The package directory is
+#  inserted so the zygote uses the same taskforce package as the legion.
+#
+_bootstrap = 'import sys; sys.path.insert(0, %r); from taskforce import zygote; zygote.main(int(sys.argv[1]))'
+
+def _encode(msg):
+	return (json.dumps(msg, default=str) + '\n').encode('utf-8')
+
+class spawner(object):
+	"""
+	Starts a zygote process and passes spawn requests to it.  The
+	instance has a fileno() method so it can be registered with a
+	poll set, becoming readable when the zygote reports process exits.
+
+	Params are:
+
+	  timeout	-  The maximum time in seconds to wait for the zygote
+			   to respond to a spawn request.  The default is 1.
+			   The legion's event loop is blocked while waiting.
+
+	  log		-  A logging instance.
+"""
+	def __init__(self, **params):
+		self._params = params
+		self._discard = logging.getLogger(__name__)
+		self._discard.addHandler(logging.NullHandler())
+		log = self._params.get('log', self._discard)
+
+		self._buf = b''
+		self._exits = []
+		self._running = set()
+		self._ready = False
+		self._seq = 0
+		self._sock, remote = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+		remote_fd = remote.fileno()
+		pkg_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+		pid = os.fork()
+		if pid == 0:
+			try:
+				fl = fcntl.fcntl(remote_fd, fcntl.F_GETFD)
+				fcntl.fcntl(remote_fd, fcntl.F_SETFD, fl & ~fcntl.FD_CLOEXEC)
+				utils.closeall(exclude=[0, 1, 2, remote_fd])
+				os.execv(sys.executable, [sys.executable, '-c', _bootstrap % (pkg_dir,), str(remote_fd)])
+			except:
+				pass
+			os._exit(87)
+		remote.close()
+		self.pid = pid
+		log.debug("Zygote started as pid %d", pid)
+
+	def fileno(self):
+		return self._sock.fileno() if self._sock else None
+
+	def closed(self):
+		return self._sock is None
+
+	def close(self):
+		"""
+		Close the connection, which causes the zygote to exit.  Processes
+		it has started continue to run but their exits will no longer be
+		reported.
+	"""
+		if self._sock:
+			try: self._sock.close()
+			except: pass
+			self._sock = None
+
+	def _read(self, timeout):
+		"""
+		Read whatever arrives within "timeout" seconds and return the
+		complete messages received.  Raises an exception if the zygote
+		has gone away.
+	"""
+		msgs = []
+		rlist, _, _ = select.select([self._sock], [], [], timeout)
+		if not rlist:
+			return msgs
+		data = self._sock.recv(65536)
+		if not data:
+			raise Exception("Zygote pid %d closed its connection" % (self.pid,))
+		self._buf += data
+		while b'\n' in self._buf:
+			line, self._buf = self._buf.split(b'\n', 1)
+			msgs.append(json.loads(line.decode('utf-8')))
+		return msgs
+
+	def _async_msg(self, msg):
+		"""
+		Handle messages that are not replies to a spawn request.  Returns
+		True if the message was handled.
+	"""
+		if msg.get('op') == 'exit':
+			self._running.discard(msg['pid'])
+			self._exits.append((msg['pid'], msg['status']))
+			return True
+		if msg.get('op') == 'ready':
+			self._ready = True
+			return True
+		return False
+
+	def ready(self, timeout=0):
+		"""
+		Returns True once the zygote has reported it is ready to start
+		processes, waiting up to "timeout" seconds for it to do so.
+	"""
+		log = self._params.get('log', self._discard)
+		deadline = time.time() + timeout
+		try:
+			while self._sock and not self._ready:
+				for msg in self._read(max(0, deadline - time.time())):
+					self._async_msg(msg)
+				if time.time() >= deadline:
+					break
+		except Exception as e:
+			log.error("Zygote connection failed -- %s", str(e))
+			self.close()
+		return self._ready
+
+	def spawn(self, spec):
+		"""
+		Ask the zygote to start a process.  "spec" is as built by
+		task._exec_process().  Returns the pid, or None if the zygote
+		could not start the process, in which case the caller should
+		fork the process itself.  Exits reported while waiting are
+		held for the next get().
+	"""
+		log = self._params.get('log', self._discard)
+		if not self.ready():
+			log.debug("Zygote is not ready, forking '%s'", spec.get('name'))
+			return None
+		timeout = self._params.get('timeout', 1)
+		self._seq += 1
+		try:
+			self._sock.sendall(_encode({'op': 'spawn', 'id': self._seq, 'spec': spec}))
+			deadline = time.time() + timeout
+			while True:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					raise Exception("No response from zygote pid %d after %s" % (self.pid, utils.deltafmt(timeout)))
+				for msg in self._read(remaining):
+					if self._async_msg(msg) or msg.get('id') != self._seq:
+						continue
+					if msg.get('op') == 'spawned':
+						self._running.add(msg['pid'])
+						return msg['pid']
+					log.warning("Zygote could not start '%s' -- %s", spec.get('name'), msg.get('error'))
+					return None
+		except Exception as e:
+			log.error("Zygote spawn failed, processes will be forked by the legion -- %s", str(e))
+			self.close()
+			return None
+
+	def get(self):
+		"""
+		Returns a list of (pid, status) tuples for processes that have
+		exited since the last call.  After the zygote has gone away,
+		closed() will be True.
+	"""
+		log = self._params.get('log', self._discard)
+		if self._sock:
+			try:
+				while True:
+					msgs = self._read(0)
+					if not msgs:
+						break
+					for msg in msgs:
+						self._async_msg(msg)
+			except Exception as e:
+				log.error("Zygote connection failed -- %s", str(e))
+				self.close()
+		exits = self._exits
+		self._exits = []
+		return exits
+
+	def has_exits(self):
+		return len(self._exits) > 0
+
+	def running(self):
+		"""
+		Returns the pids of processes the zygote started whose exits have
+		not been reported.
+	"""
+		return list(self._running)
+
+def _child(sock, wakeup_fds, spec, exec_child, log):
+	"""
+	Runs in a process forked by the zygote.  The zygote's own descriptors
+	and signal settings are discarded so the process starts as it would
+	if forked by the legion, then "exec_child" execs the process.
+"""
+	try:
+		sock.close()
+		for fd in wakeup_fds:
+			os.close(fd)
+		signal.set_wakeup_fd(-1)
+		for sig in [signal.SIGCHLD, signal.SIGTERM, signal.SIGHUP]:
+			signal.signal(sig, signal.SIG_DFL)
+		signal.signal(signal.SIGINT, signal.SIG_IGN)
+	except:
+		os._exit(88)
+	exec_child(spec, log)
+
+def main(fd):
+	"""
+	The zygote event loop.  "fd" is the zygote's end of the socketpair.
+"""
+	log = logging.getLogger(__name__)
+	log.addHandler(logging.NullHandler())
+
+	sock = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+	os.close(fd)
+
+	#  SIGCHLD wakes the loop via the wakeup fd.  Termination signals are
+	#  ignored because the zygote should only exit when the legion does.
+	#
+	wakeup_r, wakeup_w = os.pipe()
+	for pfd in [wakeup_r, wakeup_w]:
+		fl = fcntl.fcntl(pfd, fcntl.F_GETFL)
+		fcntl.fcntl(pfd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+	signal.set_wakeup_fd(wakeup_w)
+	signal.signal(signal.SIGCHLD, lambda sig, frame: None)
+	for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGHUP]:
+		signal.signal(sig, signal.SIG_IGN)
+
+	#  Load the start code once here rather than in each forked child.
+	#
+	from .task import _exec_child
+	sock.sendall(_encode({'op': 'ready'}))
+
+	buf = b''
+	while True:
+		try:
+			rlist, _, _ = select.select([sock, wakeup_r], [], [])
+		except (select.error, OSError, IOError) as e:
+			ecode = getattr(e, 'errno', None)
+			if ecode is None:
+				ecode = e.args[0]
+			if ecode == errno.EINTR:
+				continue
+			raise
+		if wakeup_r in rlist:
+			try: os.read(wakeup_r, 1024)
+			except OSError: pass
+		while True:
+			try:
+				(pid, status) = os.waitpid(-1, os.WNOHANG)
+			except OSError:
+				pid = 0
+			if pid <= 0:
+				break
+			sock.sendall(_encode({'op': 'exit', 'pid': pid, 'status': status}))
+		if sock in rlist:
+			data = sock.recv(65536)
+			if not data:
+				break
+			buf += data
+			while b'\n' in buf:
+				line, buf = buf.split(b'\n', 1)
+				msg = json.loads(line.decode('utf-8'))
+				if msg.get('op') != 'spawn':
+					continue
+				try:
+					pid = os.fork()
+				except Exception as e:
+					sock.sendall(_encode({'op': 'error', 'id': msg.get('id'), 'error': str(e)}))
+					continue
+				if pid == 0:
+					_child(sock, [wakeup_r, wakeup_w], msg['spec'], _exec_child, log)
+				sock.sendall(_encode({'op': 'spawned', 'id': msg.get('id'), 'pid': pid}))
@@ -339,6 +339,20 @@ how it is typically used.
 		self.log.info("Closeall restricted to single fd %d gave %d", fd, res)
 		assert res == fd
 
+		#  Where open fds can be listed, a sparse fd well beyond the
+		#  gap heuristic is still closed.
+		#
+		if utils.open_fds() is not None:
+			fd = os.open(os.devnull, os.O_RDONLY)
+			high = min(maxfd - 1, fd + 2 * utils.closeall.beyond_last_fd)
+			os.dup2(fd, high)
+			os.close(fd)
+			assert high in utils.open_fds()
+			res = utils.closeall(exclude=fd_set)
+			self.log.info("Closeall with sparse fd %d gave %s", high, str(res))
+			assert res == high
+			assert high not in self.now_open(maxfd)
+
 		res = utils.log_filenos(self.log)
 		self.log.info("Fd of own logging: %s", str(res))
 		assert res[0] > 0
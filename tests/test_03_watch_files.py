@@ -17,8 +17,9 @@
 # ________________________________________________________________________
 #
 
-import os, sys, logging, errno, time, gc
+import os, sys, logging, errno, time, gc, struct
 import taskforce.poll as poll
+import taskforce.inotify as inotify
 import taskforce.utils as utils
 import taskforce.watch_files as watch_files
 import support
@@ -81,7 +82,7 @@ class Test(object):
 		assert len(self.file_list) > 1
 		snoop.remove(self.file_list[1])
 		remove_fds = len(support.find_open_fds())
-		if snoop.get_mode() == watch_files.WF_INOTIFYX:
+		if snoop.get_mode() in watch_files.wf_inotify_modes:
 			#  inotify doesn't need open files for watches
 			self.log.info("%d files open after remove, %d expected", remove_fds, added_fds)
 			assert remove_fds == added_fds
@@ -102,7 +103,7 @@ class Test(object):
 		assert len(self.file_list) > 1
 		snoop.remove(self.file_list[1])
 		remove_fds = len(support.find_open_fds())
-		if snoop.get_mode() == watch_files.WF_INOTIFYX:
+		if snoop.get_mode() in watch_files.wf_inotify_modes:
 			#  inotify doesn't need open files for watches
 			self.log.info("%d files open after remove, %d expected", remove_fds, added_fds)
 			assert remove_fds == added_fds
@@ -205,3 +206,106 @@ class Test(object):
 		delta = time.time() - start
 		self.log.info("%d rename tests successful, %.3f secs/test", test+1, delta/(test+1))
 		wf.close()
+
+	def Test_I_pending(self):
+		"""
+		Check that a pending path is detected when it appears.  Apart from polling
+		mode, this should not need a scan() call.
+	"""
+		global default_mode
+		path = os.path.join(env.temp_dir, "test_pending")
+		try: os.unlink(path)
+		except: pass
+		snoop = watch_files.watch(log=self.log, timeout=0.1, limit=3)
+		snoop.add(path, missing=True)
+		assert path in snoop.paths_pending
+
+		pset = poll.poll()
+		pset.register(snoop, poll.POLLIN)
+		with open(path, 'w') as f:
+			f.write(path + '\n')
+		if default_mode == watch_files.WF_POLLING:
+			snoop.scan()
+		detected = False
+		limit = time.time() + 5
+		try:
+			while not detected and time.time() < limit:
+				evlist = pset.poll(500)
+				if not evlist:
+					self.log.info("poll() timeout waiting on pending path")
+					continue
+				for changed in snoop.get():
+					self.log.info('Change detected on %s', changed)
+					if changed == path:
+						detected = True
+		finally:
+			try: os.unlink(path)
+			except: pass
+		assert detected
+		assert path in snoop.paths_open
+		assert not snoop._dir_watch
+
+		del snoop
+		gc.collect()
+
+	def Test_J_poll_budget(self):
+		"""
+		Check that a zero poll budget spreads the polling scan across
+		calls, one directory per call.
+	"""
+		subdir = os.path.join(env.temp_dir, "test_subdir")
+		subfile = os.path.join(subdir, "test_sub")
+		if not os.path.isdir(subdir):
+			os.mkdir(subdir)
+		with open(subfile, 'w') as f:
+			f.write(subfile + '\n')
+		try:
+			snoop = watch_files.watch(polling=True, log=self.log, poll_budget=0)
+			snoop.add(self.file_list + [subfile])
+
+			#  Changing the file in the second directory is only seen on the second scan.
+			#
+			with open(subfile, 'a') as f:
+				f.write(subfile + '\n')
+			snoop.scan()
+			assert not snoop._poll_pending
+			snoop.scan()
+			assert subfile in snoop._poll_pending
+			assert snoop.get() == [subfile]
+
+			snoop.close()
+			del snoop
+			gc.collect()
+		finally:
+			try: os.unlink(subfile)
+			except: pass
+			try: os.rmdir(subdir)
+			except: pass
+
+	def Test_K_inotify_decode(self):
+		"""
+		Check that a buffer packed with several inotify events, as one
+		read() returns, is split at each event's NUL-padded name.
+	"""
+		def event(wd, mask, cookie, name=b'', pad=0):
+			if name:
+				name += b'\0' * pad
+			return struct.pack('iIII', wd, mask, cookie, len(name)) + name
+
+		data = (event(1, inotify.IN_DELETE_SELF, 0) +
+				event(2, inotify.IN_MOVED_FROM, 7, b'test_a', pad=10) +
+				event(2, inotify.IN_MOVED_TO, 7, b'sixteen_chars_ab', pad=16) +
+				event(3, inotify.IN_CREATE | inotify.IN_ISDIR, 0, b'x', pad=15))
+		events = inotify.decode_events(data)
+		self.log.info("Decoded %s", ', '.join(str(e) for e in events))
+		assert [(e.wd, e.mask, e.cookie, e.name) for e in events] == [
+				(1, inotify.IN_DELETE_SELF, 0, None),
+				(2, inotify.IN_MOVED_FROM, 7, 'test_a'),
+				(2, inotify.IN_MOVED_TO, 7, 'sixteen_chars_ab'),
+				(3, inotify.IN_CREATE | inotify.IN_ISDIR, 0, 'x')]
+		assert events[3].get_mask_description() == 'IN_CREATE|IN_ISDIR'
+
+		#  A truncated trailing header is not decoded.
+		#
+		assert len(inotify.decode_events(data + event(4, inotify.IN_MODIFY, 0)[:8])) == 4
+		assert inotify.decode_events(b'') == []
@@ -154,3 +154,42 @@ class Test(object):
 		del_fds = len(support.find_open_fds())
 		self.log.info("%d files open after auto object delete", del_fds)
 		assert del_fds == self.start_fds
+
+	def Test_E_cache(self):
+		cache_file = os.path.join(env.temp_dir, "module_cache.json")
+		try: os.unlink(cache_file)
+		except: pass
+		try:
+			snoop = watch_modules.watch(log=self.log, module_path=working_dir, cache_file=cache_file)
+			snoop.add(self.test_module)
+			snoop.scan()
+			assert os.path.exists(cache_file)
+			expected = set(snoop.modules)
+			del snoop
+			gc.collect()
+
+			#  A new instance should resolve the same modules without parsing any
+			#  file, so there should be nothing new to save.
+			#
+			snoop = watch_modules.watch(log=self.log, module_path=working_dir, cache_file=cache_file)
+			snoop.add(self.test_module)
+			self.log.info("Found %d modules via cache, %d expected", len(snoop.modules), len(expected))
+			assert set(snoop.modules) == expected
+			assert not snoop._cache._dirty
+
+			#  Re-adding the same name should leave the inverted list unchanged.
+			#
+			snoop.add(self.test_module)
+			assert set(snoop.modules) == expected
+			for path in snoop.modules:
+				assert snoop.modules[path] == [self.test_module]
+			del snoop
+			gc.collect()
+		finally:
+			try: os.unlink(cache_file)
+			except: pass
+
+	def Test_F_cleanup_test(self):
+		del_fds = len(support.find_open_fds())
+		self.log.info("%d files open after cache test, %d expected", del_fds, self.start_fds)
+		assert del_fds == self.start_fds
@@ -17,10 +17,15 @@
 # ________________________________________________________________________
 #
 
-import os, sys, time, logging, errno, re, pwd, grp
+import os, sys, time, signal, socket, logging, errno, re, pwd, grp, json
 import support
 import taskforce.poll as poll
 import taskforce.task as task
+import taskforce.utils as utils
+import taskforce.zygote as zygote
+import taskforce.capture as capture
+import taskforce.httpd as httpd
+import taskforce.status as status
 
 env = support.env(base='.')
 
@@ -97,6 +102,48 @@ class Test(object):
 			f.write('\n'.join(roles) + '\n')
 		os.rename(fname, env.roles_file)
 
+	def conf_write(self, name, conf):
+		"""
+		Write "conf" to the named config file in the temp directory,
+		replacing any prior version in one step, and return its path.
+	"""
+		conf_file = os.path.join(env.temp_dir, name)
+		if conf_file not in self.file_list:
+			self.file_list.append(conf_file)
+		with open(conf_file + '.tmp', 'w') as f:
+			f.write(json.dumps(conf))
+		os.rename(conf_file + '.tmp', conf_file)
+		return conf_file
+
+	def conf_legion(self, name, conf, **params):
+		"""
+		Write "conf" as for conf_write() and return a legion loaded
+		from it.
+	"""
+		l = task.legion(log=self.log, **params)
+		l.set_config_file(self.conf_write(name, conf))
+		return l
+
+	def run_legion(self, l, done, manage=True, timeout=10):
+		"""
+		Step the legion as its event loop would until "done()" is true or
+		the timeout expires, and return the final "done()" result.  With
+		"manage" false, exits are reaped and output is read but nothing
+		is started, as is needed while the legion is stopping.
+	"""
+		deadline = time.time() + timeout
+		while not done() and time.time() < deadline:
+			time.sleep(0.05)
+			l._reap()
+			for reader in list(l._outputs):
+				if not reader.read():
+					l._output_del(reader)
+			if manage:
+				l._deadlines_run()
+				l._manage_dirty()
+			l._probe_run()
+		return done()
+
 	def Test_A_check_config(self):
 		self.set_path('PATH', env.examples_bin)
 		self.set_path('PYTHONPATH', env.base_dir)
@@ -134,7 +181,8 @@ class Test(object):
 
 		new_roles = env.test_roles
 		self.log.info("Checking startup of %s roles", new_roles)
-		db_started = tf.search([r"Task 'db_server' already started"], log=self.log)
+		db_started = tf.search([r"Task 'db_server' state '\w+' -> 'started'",
+					r"Task 'ws_server' state '\w+' -> 'started'"], log=self.log)
 		assert db_started
 		kids = len(support.proctree().processes[tf.pid].children) 
 		assert self.find_children(tf, roles=new_roles) == expected_frontback_process_count
@@ -143,7 +191,7 @@ class Test(object):
 		new_roles = env.test_roles[0]
 		self.log.info("Switching to role %s", new_roles)
 		self.set_roles(new_roles)
-		db_stopped = tf.search([r"Task 'db_server' (still|pid)", r"Task 'ws_server' already started"],
+		db_stopped = tf.search([r"Task 'db_server' (still|pid)", r"Task 'db_server' state '\w+' -> 'stopped'"],
 														log=self.log)
 		assert db_stopped
 		children_found = self.find_children(tf, roles=new_roles)
@@ -156,9 +204,8 @@ class Test(object):
 		self.log.info("Switching to role %s", new_roles)
 		self.set_roles(new_roles)
 		db_restarted = tf.search([
-			r"Task 'db_server' already started",
-			r"Task 'db_server' a[l]ready started",  #  Bit of a kludge to be sure we see this at least twice
-			r"Task 'httpd' already started" ], log=self.log)
+			r"Task 'db_server' state '\w+' -> 'started'",
+			r"Task 'ws_server' state '\w+' -> 'stopped'" ], log=self.log)
 		assert db_restarted
 		assert self.find_children(tf, roles=new_roles) == expected_backend_process_count
 		self.log.info("Switch to %s ok, pid to check is %d", new_roles, tf.pid)
@@ -184,7 +231,8 @@ class Test(object):
 		tf = support.taskforce(env, [], log=self.log)
 
 		self.log.info("Checking startup of %s roles", new_roles)
-		db_started = tf.search([r"Task 'db_server' already started"], log=self.log)
+		db_started = tf.search([r"Task 'db_server' state '\w+' -> 'started'",
+					r"Task 'ws_server' state '\w+' -> 'started'"], log=self.log)
 		assert db_started
 		kids = len(support.proctree().processes[tf.pid].children) 
 		assert self.find_children(tf, roles=new_roles) == expected_frontback_process_count
@@ -192,3 +240,758 @@ class Test(object):
 
 		support.check_procsim_errors(self.__module__, env, log=self.log)
 		tf.close()
+
+	def Test_E_incremental_reload(self):
+		"""
+		Check that a config reload only re-applies tasks whose config changed,
+		unless a global section changed.  The tasks are "off" so nothing runs.
+	"""
+		conf = {'tasks': {
+				'task_a': {'control': 'off', 'commands': {'start': ['/bin/true']}},
+				'task_b': {'control': 'off', 'commands': {'start': ['/bin/true']}}
+			}}
+		l = self.conf_legion('incremental.conf', conf)
+		task_a = l.task_get('task_a')
+		task_b = l.task_get('task_b')
+		a_conf = task_a._config_pending
+		b_conf = task_b._config_pending
+
+		conf['tasks']['task_b']['defines'] = {'test': 'changed'}
+		self.conf_write('incremental.conf', conf)
+		l._load_config()
+		assert task_a._config_pending is a_conf
+		assert task_b._config_pending is not b_conf
+		assert task_b._config_pending['defines']['test'] == 'changed'
+
+		conf['defines'] = {'test': 'global'}
+		self.conf_write('incremental.conf', conf)
+		l._load_config()
+		assert task_a._config_pending is not a_conf
+
+	def Test_F_context_cache(self):
+		"""
+		Check that task contexts are reused until the task config,
+		the legion config, or the environment changes.
+	"""
+		conf = {'tasks': {'task_a': {'control': 'off', 'commands': {'start': ['/bin/true']},
+					     'defines': {'test': 'original'}}}}
+		l = self.conf_legion('context.conf', conf)
+		task_a = l.task_get('task_a')
+
+		context = task_a._context_build(pending=True)
+		assert context['test'] == 'original'
+		assert task_a._context_build(pending=True) is context
+
+		task_a.set_config(dict(conf['tasks']['task_a'], defines={'test': 'changed'}))
+		context = task_a._context_build(pending=True)
+		assert context['test'] == 'changed'
+		assert task_a._context_build(pending=True) is context
+
+		task_a.update_config(count=1)
+		assert task_a._context_build(pending=True) is not context
+		context = task_a._context_build(pending=True)
+
+		os.environ['TASKFORCE_CONTEXT_TEST'] = 'set'
+		try:
+			l._apply()
+			context = task_a._context_build(pending=True)
+			assert context['TASKFORCE_CONTEXT_TEST'] == 'set'
+		finally:
+			del os.environ['TASKFORCE_CONTEXT_TEST']
+		l._apply()
+		assert 'TASKFORCE_CONTEXT_TEST' not in task_a._context_build(pending=True)
+
+	def Test_G_fmt_context(self):
+		"""
+		Check the compiled formatting matches the iterated str.format() behavior.
+	"""
+		context = {'a': '{b}/a', 'b': 'base', 'n': None, 'x': '{y}', 'y': '{x}', 'l': [1, 2]}
+		assert task._fmt_context('plain', context) == 'plain'
+		assert task._fmt_context('{a}', context) == 'base/a'
+		assert task._fmt_context(['{b:>6}', '{{b}}'], context) == ['  base', 'base']
+		assert task._fmt_context('{n}', context) is None
+		assert task._fmt_context('{l[1]}', context) == '2'
+		assert task._fmt_context('{a}{missing}', context) == '{a}{missing}'
+		assert task._fmt_context('{a}}', context) == '{a}}'
+
+		#  A cycle gives the same answer as the full number of passes.
+		#
+		assert task._fmt_context('{x}', context) == '{x}'
+		assert task._fmt_context('-{{{y}}}', context) == '-{x}'
+
+	def Test_H_start_order(self):
+		"""
+		Check the start order, the dependents index, and cycle reporting.
+	"""
+		conf = {'tasks': {
+				'task_a': {'control': 'wait', 'commands': {'start': ['/bin/true']}, 'requires': ['task_c']},
+				'task_b': {'control': 'wait', 'commands': {'start': ['/bin/true']}, 'requires': ['task_a', 'task_c']},
+				'task_c': {'control': 'wait', 'commands': {'start': ['/bin/true']}},
+				'task_d': {'control': 'off', 'commands': {'start': ['/bin/true']}}
+			}}
+		l = task.legion(log=self.log)
+		l._config_file = self.conf_write('order.conf', conf)
+		for name in conf['tasks']:
+			task.task(name, l, log=self.log).set_config(conf['tasks'][name])
+		task_a = l.task_get('task_a')
+		task_b = l.task_get('task_b')
+		task_c = l.task_get('task_c')
+		task_d = l.task_get('task_d')
+
+		order = l.task_list()
+		assert [t.get_name() for t in order] == ['task_c', 'task_a', 'task_b']
+		assert l.task_list() == order
+		assert l.task_scoped('task_a') is task_a
+		assert l.task_scoped('task_d') is None
+		assert l.task_dependents(task_c) == set([task_a, task_b])
+		assert l.task_dependents(task_b) == set()
+
+		task_c.set_config(dict(conf['tasks']['task_c'], requires=['task_b']))
+		try:
+			l.task_list()
+			assert False, "Cycle was not detected"
+		except task.TaskError as e:
+			self.log.info("Cycle error: %s", str(e))
+			assert "'task_a' -> 'task_c' -> 'task_b' -> 'task_a'" in str(e)
+
+		task_c.set_config(dict(conf['tasks']['task_c'], requires=['task_d']))
+		try:
+			l.task_list()
+			assert False, "Out of scope requirement was not detected"
+		except task.TaskError as e:
+			assert "requires 'task_d' which is not in scope" in str(e)
+
+	def Test_I_pidfd_reap(self):
+		"""
+		Check that a child exit is delivered via its pidfd when pidfd
+		reaping is selected.
+	"""
+		l = task.legion(log=self.log, pidfd=True)
+		if not l._pidfd_mode:
+			self.log.info("pidfd reaping not available, skipping test")
+			return
+		l._pset = poll.poll()
+		t = task.task('pidfd_test', l, log=self.log)
+		pid = os.fork()
+		if pid == 0:
+			os._exit(3)
+		l.proc_add(task.event_target(t, 'command_exit', key=pid, arg='test', log=self.log))
+		assert pid in l._pidfds
+
+		evlist = l._pset.poll(5000)
+		assert len(evlist) == 1
+		item, mask = evlist[0]
+		assert isinstance(item, task._pidfd_watch) and item.pid == pid
+		assert l._reap_pidfd(item)
+		assert pid not in l._procs
+		assert pid not in l._pidfds
+		l._pset = None
+
+	def Test_J_spawn(self):
+		"""
+		Check the posix_spawn path runs a command, and that commands
+		needing the child's pid fall back to forking.
+	"""
+		if not hasattr(os, 'posix_spawn'):
+			self.log.info("posix_spawn() not available, skipping test")
+			return
+		out_file = os.path.join(env.temp_dir, 'spawn.out')
+		self.file_list.append(out_file)
+		context = os.environ.copy()
+		context.update({'Task_name': 'spawn_test', 'Task_pid': None, 'msg': 'spawned'})
+
+		cmd = ['sh', '-c', 'echo {msg} $Task_instance > ' + out_file]
+		pid = task._exec_process(cmd, context, instance=3, log=self.log, spawn=True)
+		assert os.waitpid(pid, 0) == (pid, 0)
+		with open(out_file, 'r') as f:
+			assert f.read().strip() == 'spawned 3'
+
+		cmd = ['sh', '-c', 'echo {Task_pid} > ' + out_file]
+		pid = task._exec_process(cmd, context, log=self.log, spawn=True)
+		assert os.waitpid(pid, 0) == (pid, 0)
+		with open(out_file, 'r') as f:
+			assert f.read().strip() == str(pid)
+
+	def Test_K_zygote(self):
+		"""
+		Check a process started by the zygote runs with the expected
+		environment and that its exit is reported back.
+	"""
+		out_file = os.path.join(env.temp_dir, 'zygote.out')
+		self.file_list.append(out_file)
+		context = os.environ.copy()
+		context.update({'Task_name': 'zygote_test', 'Task_pid': None, 'msg': 'forked'})
+
+		z = zygote.spawner(log=self.log)
+		try:
+			assert z.ready(10)
+			cmd = ['sh', '-c', 'echo {msg} {Task_pid} $PPID > ' + out_file + '; exit 3']
+			pid = task._exec_process(cmd, context, log=self.log, zygote=z)
+			assert pid != z.pid
+
+			exits = []
+			deadline = time.time() + 10
+			while not exits and time.time() < deadline:
+				poll_set = poll.poll()
+				poll_set.register(z, poll.POLLIN)
+				poll_set.poll(1000)
+				exits = z.get()
+			self.log.info("Zygote reported exits: %s", exits)
+			assert exits == [(pid, 3 << 8)]
+			with open(out_file, 'r') as f:
+				assert f.read().split() == ['forked', str(pid), str(z.pid)]
+		finally:
+			z.close()
+			os.waitpid(z.pid, 0)
+
+	def Test_K_zygote_lost(self):
+		"""
+		Check that a task process started by the zygote is still watched
+		after the zygote dies, and is restarted when it exits.
+	"""
+		conf = {'tasks': {
+				'task_zyg': {
+					'control': 'wait',
+					'commands': {'start': ['sleep', '30']},
+					'backoff': {'delay': 0}
+				}
+			}}
+		l = self.conf_legion('zygote_lost.conf', conf)
+		t = l.task_get('task_zyg')
+		l._zygote_start()
+		assert l._zygote.ready(10)
+		zygote_pid = l._zygote.pid
+
+		#  Restart the process so it is started by the zygote.
+		#
+		first_pid = t.get_pids()[0]
+		os.kill(first_pid, signal.SIGKILL)
+		assert self.run_legion(l, lambda: t.get_pids() and t.get_pids() != [first_pid])
+		zyg_pid = t.get_pids()[0]
+		assert utils.proc_stat(zyg_pid)[1] == zygote_pid
+
+		os.kill(zygote_pid, signal.SIGKILL)
+		assert self.run_legion(l, lambda: l._zygote is None)
+		assert t.get_pids() == [zyg_pid]
+		assert t._proc_state[0].daemon
+		assert zyg_pid not in l._procs
+
+		os.kill(zyg_pid, signal.SIGKILL)
+		assert self.run_legion(l, lambda: t.get_pids() and t.get_pids() != [zyg_pid])
+		assert not t._proc_state[0].daemon
+
+		l.stop_all()
+		assert self.run_legion(l, lambda: not t.get_pids(), manage=False)
+
+	def Test_L_start_dependents(self):
+		"""
+		Check that a task waiting on a "once" task is started as soon
+		as the once task exits, and that start latency is recorded.
+	"""
+		conf = {'tasks': {
+				'task_a': {'control': 'once', 'commands': {'start': ['/bin/true']}},
+				'task_b': {'control': 'once', 'commands': {'start': ['/bin/true']}, 'requires': ['task_a']}
+			}}
+		l = self.conf_legion('dependents.conf', conf)
+		task_a = l.task_get('task_a')
+		task_b = l.task_get('task_b')
+
+		assert task_a.get_pids()
+		assert not task_b.get_pids()
+		assert task_a._start_latency is not None
+
+		assert self.run_legion(l, lambda: not task_a.get_pids(), manage=False)
+		assert task_a._stopped
+		assert task_b in l._dirty
+
+		l._manage_dirty()
+		assert task_b._started
+		assert task_b._start_latency >= 0
+		assert not l._dirty
+
+		assert self.run_legion(l, lambda: not task_b.get_pids(), manage=False)
+
+	def Test_M_schedule(self):
+		"""
+		Check that a task is managed when its scheduled time arrives,
+		and that duplicate and superseded entries are dropped.
+	"""
+		l = task.legion(log=self.log)
+		assert l._deadline_next() is None
+		assert not l._deadlines_run()
+
+		conf = {'tasks': {
+				'sched': {'control': 'wait', 'start_delay': 1, 'commands': {'start': ['sleep', '30']}}
+			}}
+		l = self.conf_legion('schedule.conf', conf)
+		t = l.task_get('sched')
+
+		#  The task stays "starting" until its start_delay deadline.
+		#
+		assert t.get_state() == 'starting'
+		when = l._deadline_next()
+		assert when is not None and when > time.time()
+		assert not l._deadlines_run()
+		assert t.get_state() == 'starting'
+
+		entries = len(l._deadlines)
+		l.schedule(t, when)
+		assert len(l._deadlines) == entries
+
+		#  A due entry is superseded once the task has been managed.
+		#
+		l.schedule(t, time.time() - 1)
+		l._task_manage(t)
+		assert l._deadline_next() == when
+		assert len(l._deadlines) == entries
+
+		time.sleep(max(0, when - time.time()) + 0.1)
+		assert l._deadlines_run()
+		assert t.get_state() == 'started'
+		assert l._deadline_next() is None
+
+		l.stop_all()
+		assert self.run_legion(l, lambda: not t.get_pids(), manage=False)
+
+	def Test_N_task_state(self):
+		"""
+		Check the task state follows a "once" task through its run, that
+		the process exit queues the task for management, and that idle
+		cycles do not manage it otherwise.
+	"""
+		conf = {'tasks': {
+				'task_once': {'control': 'once', 'commands': {'start': ['/bin/true']}}
+			}}
+		l = self.conf_legion('state.conf', conf)
+		t = l.task_get('task_once')
+		assert t.get_state() == 'started'
+		assert t not in l._dirty
+
+		assert self.run_legion(l, lambda: not t.get_pids(), manage=False)
+		assert t.get_state() == 'stopped'
+		assert t in l._dirty
+
+		l._manage_dirty()
+		assert t.get_state() == 'stopped'
+		assert not t.get_pids()
+		assert not l._dirty
+
+		#  An idle cycle with nothing queued or due leaves the task alone.
+		#
+		managed = []
+		t.manage = lambda: managed.append(t)
+		l._manage_now = time.time()
+		l._last_idle_run = l._manage_now - l._timeout - 1
+		assert l._manage_timed(False)
+		assert not managed
+
+	def Test_O_restart_backoff(self):
+		"""
+		Check that a crash-looping instance is restarted with increasing
+		delays, parked at the crash limit, and released by a config change.
+	"""
+		conf = {'tasks': {
+				'task_crash': {
+					'control': 'wait',
+					'commands': {'start': ['/bin/false']},
+					'backoff': {'delay': 0.1, 'factor': 2, 'crash_limit': 3}
+				}
+			}}
+		l = self.conf_legion('backoff.conf', conf)
+		t = l.task_get('task_crash')
+		proc = t._proc_state[0]
+		assert proc.instance == 0
+
+		#  Each restart waits for a deadline, so every backed off delay
+		#  is seen between the steps.
+		#
+		delays = []
+		def parked():
+			if proc.pid is None and proc.next_start and proc.exited:
+				delay = round(proc.next_start - proc.exited, 2)
+				if not delays or delays[-1] != delay:
+					delays.append(delay)
+			return proc.parked
+		assert self.run_legion(l, parked)
+		assert proc.restarts == 3
+		assert delays == [0.1, 0.2, 0.4]
+
+		t.manage()
+		assert not t.get_pids()
+
+		t.update_config(count=1)
+		t.apply()
+		assert not proc.parked
+		assert proc.restarts == 0
+
+		l.stop_all()
+		assert self.run_legion(l, lambda: not t.get_pids(), manage=False)
+
+	def Test_P_rolling_restart(self):
+		"""
+		Check that a command change with "rolling" set replaces the
+		processes one at a time rather than stopping them all.
+	"""
+		conf = {'tasks': {
+				'task_pool': {
+					'control': 'wait',
+					'count': 3,
+					'commands': {'start': ['sleep', '30']},
+					'rolling': {'batch': 1, 'delay': 0.1},
+					'backoff': {'delay': 0}
+				}
+			}}
+
+		l = self.conf_legion('rolling.conf', conf)
+		t = l.task_get('task_pool')
+		old_pids = set(t.get_pids())
+		assert len(old_pids) == 3
+
+		conf['tasks']['task_pool']['commands']['start'] = ['sleep', '31']
+		self.conf_write('rolling.conf', conf)
+		l._load_config()
+		assert t._roll()
+
+		running = [3]
+		def rolled():
+			running.append(len(t.get_pids()))
+			return not t._roll()
+		assert self.run_legion(l, rolled, timeout=20)
+		pids = set(t.get_pids())
+		assert len(pids) == 3
+		assert not (pids & old_pids)
+		assert min(running) >= 2
+
+		l.stop_all()
+		assert self.run_legion(l, lambda: not t.get_pids(), manage=False)
+
+	def Test_Q_output_capture(self):
+		"""
+		Check that task output is captured to a file and to the
+		in-memory buffer, with both fork and spawn starts.
+	"""
+		for spawn in [False, True]:
+			out_file = os.path.join(env.temp_dir, 'capture.out')
+			self.file_list.append(out_file)
+			conf = {'tasks': {
+					'task_out': {
+						'control': 'once',
+						'commands': {'start': ['/bin/sh', '-c', 'echo hello; echo partial >&2; printf tail']},
+						'output': {'file': out_file, 'buffer': 4096}
+					}
+				}}
+			l = self.conf_legion('capture.conf', conf, spawn=spawn)
+			t = l.task_get('task_out')
+			assert len(l._outputs) == 1
+			assert self.run_legion(l, lambda: not l._outputs)
+
+			with open(out_file) as f:
+				assert f.read() == 'hello\npartial\ntail\n'
+			assert t._output.buffers[0].lines() == ['hello', 'partial', 'tail']
+			t.close()
+			os.unlink(out_file)
+
+	def Test_R_logs(self):
+		"""
+		Check the output ring buffer wraps and pages by offset, and that
+		/status/logs returns and follows buffered output.
+	"""
+		buf = capture.ring(8)
+		buf.add(b'abcdef')
+		buf.add(b'ghij')
+		assert (buf.start, buf.end) == (2, 10)
+		assert buf.read() == (2, b'cdefghij')
+		assert buf.read(5, 2) == (5, b'fg')
+		assert buf.read(-3) == (7, b'hij')
+		assert buf.read(0, 3) == (2, b'cde')
+		buf.add(b'0123456789ab')
+		assert buf.read() == (14, b'456789ab')
+		assert not buf.wait(buf.end, 0.01)
+
+		l = task.legion(log=self.log)
+		t = task.task('task_logs', l, log=self.log)
+		t._output = capture.output('task_logs', buffer=1024, log=self.log)
+		t._output.write(0, b'first\nsecond\n')
+
+		service = httpd.HttpService()
+		service.listen = os.path.join(env.temp_dir, 's.logs')
+		self.file_list.append(service.listen)
+		server = httpd.server(service, log=self.log)
+		try:
+			st = status.http(l, server, log=self.log)
+
+			code, content, content_type = st.logs('/status/logs')
+			assert code == 200
+			assert json.loads(content) == {'task_logs': {'0': {'start': 0, 'end': 13}}}
+
+			code, content, content_type = st.logs('/status/logs/task_logs?offset=-7&limit=4')
+			ans = json.loads(content)
+			assert (ans['offset'], ans['next'], ans['text']) == (6, 10, 'seco')
+
+			code, content, content_type = st.logs('/status/logs/task_logs?instance=3')
+			assert code == 404
+
+			code, content, content_type = st.logs('/status/logs/task_logs?follow=1&offset=6&timeout=0.5')
+			assert content_type == 'text/plain'
+			parts = [next(content)]
+			t._output.write(0, b'third\n')
+			parts.append(next(content))
+			assert b''.join(parts) == b'second\nthird\n'
+			assert list(content) == []
+		finally:
+			server.close()
+
+	def Test_S_nowait(self):
+		"""
+		Check that a "nowait" task's daemon takes over its process slot
+		from the start command, and that it is restarted when the probe
+		finds it gone or its "check" command fails.
+	"""
+		pid_file = os.path.join(env.temp_dir, 'nowait.pid')
+		fail_file = os.path.join(env.temp_dir, 'nowait.fail')
+		self.file_list.append(pid_file)
+		self.file_list.append(fail_file)
+		conf = {'tasks': {
+				'task_daemon': {
+					'control': 'nowait',
+					'pidfile': pid_file,
+					'commands': {
+						'start': ['/bin/sh', '-c', 'sleep 30 </dev/null >/dev/null 2>&1 & echo $! > ' + pid_file],
+						'check': ['test', '!', '-f', fail_file]
+					},
+					'backoff': {'delay': 0}
+				}
+			}}
+		l = self.conf_legion('nowait.conf', conf)
+		t = l.task_get('task_daemon')
+		proc = t._proc_state[0]
+
+		def daemon_pid():
+			with open(pid_file) as f:
+				return int(f.read())
+
+		assert self.run_legion(l, lambda: proc.daemon)
+		first_pid = daemon_pid()
+		assert t.get_pids() == [first_pid]
+		assert l._probe_next is not None
+
+		os.kill(first_pid, signal.SIGKILL)
+		assert self.run_legion(l, lambda: proc.daemon and proc.pid != first_pid)
+		second_pid = daemon_pid()
+		assert t.get_pids() == [second_pid]
+		assert proc.restarts == 1
+
+		with open(fail_file, 'w') as f:
+			f.write('fail\n')
+		assert self.run_legion(l, lambda: proc.pid != second_pid)
+		os.unlink(fail_file)
+		assert self.run_legion(l, lambda: proc.daemon)
+		assert second_pid not in utils.pids_alive([second_pid])
+
+		l.stop_all()
+		assert self.run_legion(l, lambda: not t.get_pids())
+		assert l._checks_running == 0
+
+	def Test_T_adopt(self):
+		"""
+		Check that "adopt" task processes are left running when the legion
+		exits and are taken over by the next legion, both when they are
+		still its children and when they have been orphaned.
+	"""
+		pid_file = os.path.join(env.temp_dir, 'adopt.pid')
+		self.file_list.append(pid_file)
+		conf = {'tasks': {
+				'task_kept': {
+					'control': 'adopt',
+					'count': 2,
+					'commands': {'start': ['sleep', '30']}
+				},
+				'task_orphan': {
+					'control': 'adopt',
+					'commands': {'start': ['sleep', '30']},
+					'backoff': {'delay': 0}
+				}
+			}}
+
+		#  Leave a process for "task_orphan" that is not a child of this
+		#  process, as if left by a legion that has since gone.
+		#
+		os.system("Task_name=task_orphan Task_instance=0 sleep 30 </dev/null >/dev/null 2>&1 & echo $! > " + pid_file)
+		with open(pid_file) as f:
+			orphan_pid = int(f.read())
+
+		l = self.conf_legion('adopt.conf', conf)
+		kept = set(l.task_get('task_kept').get_pids())
+		assert len(kept) == 2
+		t = l.task_get('task_orphan')
+		assert t.get_pids() == [orphan_pid]
+		assert t._proc_state[0].daemon
+
+		l.schedule_exit()
+		l.stop_all()
+		time.sleep(0.2)
+		assert utils.pids_alive(kept) == kept
+
+		l = self.conf_legion('adopt.conf', conf)
+		t = l.task_get('task_kept')
+		assert set(t.get_pids()) == kept
+		assert not [proc for proc in t._proc_state if proc.daemon]
+
+		t = l.task_get('task_orphan')
+		assert t.get_pids() == [orphan_pid]
+		os.kill(orphan_pid, signal.SIGKILL)
+		assert self.run_legion(l, lambda: t.get_pids() and t.get_pids() != [orphan_pid])
+		assert not t._proc_state[0].daemon
+
+		l.stop_all()
+		assert self.run_legion(l, lambda: not [t for t in l._tasks if t.get_pids()], manage=False)
+
+	def Test_U_handoff(self):
+		"""
+		Check that a legion handing off keeps its processes, HTTP
+		service, and output capture running, and that a new legion
+		loaded with the handed off state takes them over along with
+		the state of its tasks.
+	"""
+		sock_path = os.path.join(env.temp_dir, 's.handoff')
+		self.file_list.append(sock_path)
+		conf = {
+			'settings': {'http': [{'listen': sock_path}]},
+			'tasks': {
+				'task_kept': {
+					'control': 'wait',
+					'count': 2,
+					'commands': {'start': ['/bin/sh', '-c', 'echo one; sleep 1; echo two; exec sleep 30']},
+					'output': {'buffer': 4096}
+				},
+				'task_done': {'control': 'once', 'commands': {'start': ['/bin/true']}},
+				'task_crash': {
+					'control': 'wait',
+					'commands': {'start': ['/bin/false']},
+					'backoff': {'delay': 0, 'crash_limit': 1}
+				}
+			}}
+		l = self.conf_legion('handoff.conf', conf, handoff=True)
+		t = l.task_get('task_kept')
+		kept = set(t.get_pids())
+		assert len(kept) == 2
+		started = t._started
+		sock_ino = os.stat(sock_path).st_ino
+
+		done = l.task_get('task_done')
+		crash = l.task_get('task_crash')
+		assert self.run_legion(l, lambda: done._stopped and crash._proc_state[0].parked)
+		stopped = done._stopped
+
+		l._exiting = l._resetting = time.time()
+		assert l.is_handing_off()
+		l.stop_all()
+		reset = l._handoff_save()
+		assert isinstance(reset, task.LegionReset)
+		assert task.handoff_env in reset.env
+		assert len(reset.fds) == 4
+		assert not l._http_servers and not l._outputs
+		assert os.stat(sock_path).st_ino == sock_ino
+		assert utils.pids_alive(kept) == kept
+
+		os.environ.update(reset.env)
+		l = task.legion(log=self.log, handoff=True)
+		assert task.handoff_env not in os.environ
+		assert len(l._handoff['procs']) == 2
+		l.set_config_file(os.path.join(env.temp_dir, 'handoff.conf'))
+		l._handoff_finish()
+		t = l.task_get('task_kept')
+		assert set(t.get_pids()) == kept
+		assert t._started == started
+		assert not [proc for proc in t._proc_state if proc.daemon]
+		done = l.task_get('task_done')
+		assert done.get_state() == 'stopped'
+		assert done._stopped == stopped
+		crash = l.task_get('task_crash')
+		assert crash._proc_state[0].parked
+		assert len(l._outputs) == 2
+		assert l._http_servers[0].fileno() >= 0
+		assert os.stat(sock_path).st_ino == sock_ino
+
+		def all_read():
+			buffers = t._output.buffers
+			return len(buffers) == 2 and all('two' in buf.lines() for buf in buffers.values())
+		assert self.run_legion(l, all_read)
+		assert not done.get_pids() and done._stopped == stopped
+		assert not crash.get_pids() and crash._proc_state[0].parked
+
+		l.stop_all()
+		assert self.run_legion(l, lambda: not t.get_pids(), manage=False)
+		for reader in list(l._outputs):
+			l._output_del(reader)
+		for server in l._http_servers:
+			server.close()
+
+	def Test_V_sockets(self):
+		"""
+		Check that listening sockets in a task's "sockets" config are
+		opened once by the legion, passed to every instance with the
+		LISTEN_FDS protocol, and kept across process restarts.
+	"""
+		sock_path = os.path.join(env.temp_dir, 's.shared')
+		script = os.path.join(env.temp_dir, 'listen_fds.py')
+		out_base = os.path.join(env.temp_dir, 'sockets.out.')
+		for path in [sock_path, script, out_base + '0', out_base + '1']:
+			self.file_list.append(path)
+		with open(script, 'w') as f:
+			f.write("""import os, sys, time, socket, json
+fds = range(3, 3 + int(os.environ['LISTEN_FDS']))
+ans = {
+	'pid_ok': os.environ['LISTEN_PID'] == str(os.getpid()),
+	'names': os.environ['LISTEN_FDNAMES'],
+	'addrs': [socket.fromfd(fd, family, socket.SOCK_STREAM).getsockname()
+			for fd, family in zip(fds, [socket.AF_INET, socket.AF_UNIX])]
+}
+with open(sys.argv[1] + '.tmp', 'w') as f:
+	f.write(json.dumps(ans))
+os.rename(sys.argv[1] + '.tmp', sys.argv[1])
+time.sleep(30)
+""")
+		conf = {'tasks': {
+				'task_sock': {
+					'control': 'wait',
+					'count': 2,
+					'commands': {'start': [sys.executable, script, out_base + '{Task_instance}']},
+					'sockets': [{'listen': '127.0.0.1:0'}, {'listen': sock_path, 'name': 'local'}],
+					'backoff': {'delay': 0}
+				}
+			}}
+		l = self.conf_legion('sockets.conf', conf)
+		t = l.task_get('task_sock')
+		assert len(l._sockets) == 2
+		tcp_addr = l._sockets[('stream', '127.0.0.1:0')].getsockname()
+		expected = [list(tcp_addr), sock_path]
+
+		def read_out(instance):
+			path = out_base + str(instance)
+			self.run_legion(l, lambda: os.path.exists(path))
+			with open(path) as f:
+				ans = json.loads(f.read())
+			os.unlink(path)
+			return ans
+
+		for instance in [0, 1]:
+			ans = read_out(instance)
+			assert ans['pid_ok']
+			assert ans['names'] == 'task_sock:local'
+			assert ans['addrs'] == expected
+
+		sockets = dict(l._sockets)
+		os.kill(t._proc_state[0].pid, signal.SIGKILL)
+		ans = read_out(0)
+		assert ans['addrs'] == expected
+		assert l._sockets == sockets
+
+		client = socket.create_connection(tcp_addr, timeout=5)
+		client.close()
+
+		l.stop_all()
+		assert self.run_legion(l, lambda: not t.get_pids(), manage=False)
+		t.close()
+		assert not l._sockets
+		assert not os.path.exists(sock_path)
@@ -556,3 +556,33 @@ class Test(object):
 		assert taskforce.httpd.truthy('False') is False
 		assert taskforce.httpd.truthy(self) is False
 		assert taskforce.httpd.truthy('NeitherTrueNorYesNorFalseNorNo') is False
+
+	def Test_N_stream(self):
+		"""
+		Check that a response with iterable content is sent chunked.
+	"""
+		self.log.info("Starting %s", my(self))
+		gc.collect()
+
+		def streamer(path, **params):
+			def gen():
+				for part in [u'one\n', b'two\n', '', u'three\n']:
+					yield part
+			return (200, gen(), 'text/plain')
+
+		http_service = taskforce.httpd.HttpService()
+		http_service.listen = self.tcp_address
+		httpd = taskforce.httpd.server(http_service, log=self.log)
+		httpd.register_get(r'/stream', streamer)
+		try:
+			conn = HTTPConnection(self.tcp_host, self.tcp_port, timeout=5)
+			conn.request('GET', '/stream')
+			httpd.handle_request()
+			resp = conn.getresponse()
+			assert resp.status == 200
+			assert resp.getheader('Transfer-Encoding') == 'chunked'
+			assert resp.read() == b'one\ntwo\nthree\n'
+			conn.close()
+		finally:
+			httpd.close()
+			del httpd
@@ -33,6 +33,11 @@ class Test(object):
 	tcp_address = '127.0.0.1:' + str(tcp_port)
 	expected_ws_server_count = 4
 
+	#  Extra taskforce arguments, set by tests that rerun these
+	#  tests with a different runner.
+	#
+	runner_args = []
+
 	@classmethod
 	def setUpAll(self):
 		self.log = support.logger()
@@ -127,7 +132,7 @@ class Test(object):
 		self.set_roles(env.test_roles)
 		self.log.info("Base dir '%s', tmp dir '%s'", env.base_dir, env.temp_dir)
 
-		cargs = ['--expires', '120']
+		cargs = ['--expires', '120'] + self.runner_args
 		cargs.extend(['--certfile', '' if use_ssl is None else env.cert_file])
 		cargs.extend(['--http', address])
 		if allow_control:
@@ -309,3 +309,82 @@ class Test(object):
 			assert delta < 0.1
 
 		self.close_pipe()
+
+	def Test_D_edge_oneshot(self):
+		log_level = self.log.getEffectiveLevel()
+
+		poll_fd, poll_send = self.self_pipe()
+
+		poll = taskforce.poll.poll()
+		if taskforce.poll.PL_EPOLL not in poll.get_available_modes():
+			self.log.warning("%s PL_EPOLL is not available so test skipped", my(self))
+			self.close_pipe()
+			return
+		poll.set_mode(taskforce.poll.PL_EPOLL)
+		poll.register(poll_fd, taskforce.poll.POLLIN, edge=True)
+
+		#  Edge-triggered so an undrained fd only reports once
+		os.write(poll_send, '\0\0'.encode('utf-8'))
+		evlist = poll.poll(timeout=30)
+		self.dump_evlist(poll, 'edge active poll', evlist)
+		assert evlist == [(poll_fd, taskforce.poll.POLLIN)]
+		evlist = poll.poll(timeout=30)
+		self.dump_evlist(poll, 'edge repeat poll', evlist)
+		assert evlist == []
+		assert len(os.read(poll_fd, 10)) == 2
+
+		#  Registering again changes the registration rather than failing
+		poll.register(poll_fd, taskforce.poll.POLLIN, oneshot=True)
+		os.write(poll_send, '\0'.encode('utf-8'))
+		evlist = poll.poll(timeout=30)
+		self.dump_evlist(poll, 'oneshot active poll', evlist)
+		assert evlist == [(poll_fd, taskforce.poll.POLLIN)]
+		assert len(os.read(poll_fd, 10)) == 1
+
+		#  One-shot is disabled after the first event until rearmed
+		os.write(poll_send, '\0'.encode('utf-8'))
+		evlist = poll.poll(timeout=30)
+		self.dump_evlist(poll, 'oneshot disabled poll', evlist)
+		assert evlist == []
+		poll.modify(poll_fd, taskforce.poll.POLLIN)
+		evlist = poll.poll(timeout=30)
+		self.dump_evlist(poll, 'oneshot rearmed poll', evlist)
+		assert evlist == [(poll_fd, taskforce.poll.POLLIN)]
+		assert len(os.read(poll_fd, 10)) == 1
+
+		#  Unregister of an fd closed after registration is not an error
+		self.close_pipe()
+		poll.unregister(poll_fd)
+
+		#  An fd closed without being unregistered can be registered again
+		#  once its number is reused
+		poll_fd, poll_send = self.self_pipe()
+		poll.register(poll_fd, taskforce.poll.POLLIN)
+		self.close_pipe()
+		reused_fd, poll_send = self.self_pipe()
+		self.log.info("%s fd %d closed, new pipe has fd %d", my(self), poll_fd, reused_fd)
+		poll.register(reused_fd, taskforce.poll.POLLIN)
+		os.write(poll_send, '\0'.encode('utf-8'))
+		evlist = poll.poll(timeout=30)
+		self.dump_evlist(poll, 'reused fd poll', evlist)
+		assert evlist == [(reused_fd, taskforce.poll.POLLIN)]
+		poll.unregister(reused_fd)
+		self.close_pipe()
+
+		#  Flags are rejected by modes that can't support them
+		poll_fd, poll_send = self.self_pipe()
+		poll = taskforce.poll.poll()
+		poll.set_mode(taskforce.poll.PL_SELECT)
+		try:
+			#  Mask the log message as we expect a failure
+			self.log.setLevel(logging.CRITICAL)
+			poll.register(poll_fd, taskforce.poll.POLLIN, edge=True)
+			self.log.setLevel(log_level)
+			expected_error_occurred = False
+		except Exception as e:
+			self.log.setLevel(log_level)
+			self.log.info("%s Received expected error -- %s", my(self), str(e))
+			expected_error_occurred = True
+		assert expected_error_occurred
+
+		self.close_pipe()
@@ -0,0 +1,149 @@
+# ________________________________________________________________________
+#
+#  Copyright (C) 2014 Andrew Fullford
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ________________________________________________________________________
+#
+
+import os, sys, time, json
+import taskforce.task as task
+import taskforce.httpd as httpd
+import taskforce.http
+import support
+from support import get_caller as my
+import test_07_control as control
+
+#  The asyncio runner needs python 3.8.  Older pythons have nothing to
+#  test here.
+#
+if sys.version_info >= (3, 8):
+	import asyncio
+	import taskforce.aio as aio
+	base = control.Test
+else:
+	base = object
+
+env = control.env
+
+class Test(base):
+	"""
+	Reruns the test_07_control tests with taskforce under the asyncio
+	runner, then checks the runner's parts directly.
+"""
+	unx_address = os.path.join(env.temp_dir, 's.' + __module__)
+	tcp_port = 32780 + env.port_offset
+	tcp_address = '127.0.0.1:' + str(tcp_port)
+	direct_address = '127.0.0.1:' + str(32781 + env.port_offset)
+	runner_args = ['--asyncio']
+
+	def new_loop(self):
+		loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+		return loop
+
+	def Test_D_aio_poll_set(self):
+		"""
+		Check a registered fd queues its item and wakes the runner when
+		it becomes readable, and that unregister drops it.
+	"""
+		loop = self.new_loop()
+		r, w = os.pipe()
+		try:
+			wake = asyncio.Event()
+			pset = aio._poll_set(loop, wake)
+			pset.register(r)
+			assert pset.take() == []
+			os.write(w, b'x')
+			loop.run_until_complete(asyncio.wait_for(wake.wait(), 5))
+			assert pset.take() == [r]
+
+			wake.clear()
+			pset.unregister(r)
+			loop.run_until_complete(asyncio.sleep(0.1))
+			assert not wake.is_set()
+			assert pset.take() == []
+			pset.close()
+		finally:
+			os.close(r)
+			os.close(w)
+			loop.close()
+
+	def Test_E_aio_tls_stream(self):
+		"""
+		Serve an https service through the poll set, checking both a
+		plain response and a streamed one.
+	"""
+		service = httpd.HttpService()
+		service.listen = self.direct_address
+		service.certfile = env.cert_file
+		server = httpd.server(service, log=self.log)
+
+		def parts(path, **params):
+			def gen():
+				for i in range(3):
+					time.sleep(0.1)
+					yield 'part %d\n' % (i,)
+			return (200, gen(), 'text/plain')
+		server.register_get('/stream', parts)
+		server.register_get('/text', lambda path, **params: (200, 'text\n', 'text/plain'))
+
+		def fetch():
+			httpc = taskforce.http.Client(address=self.direct_address, use_ssl=False, log=self.log)
+			return [httpc.get('/text')[1], httpc.get('/stream')[1]]
+
+		loop = self.new_loop()
+		try:
+			pset = aio._poll_set(loop, asyncio.Event())
+			pset.register(server)
+			resp = loop.run_until_complete(loop.run_in_executor(None, fetch))
+			self.log.info("%s Responses %s", my(self), resp)
+			assert resp == ['text\n', 'part 0\npart 1\npart 2\n']
+			pset.close()
+		finally:
+			server.close()
+			loop.close()
+
+	def Test_F_aio_host_subprocess(self):
+		"""
+		Run host subprocesses alongside a managed legion and check the
+		legion leaves their exits to asyncio.
+	"""
+		conf_file = os.path.join(env.temp_dir, 'aio_host.conf')
+		self.file_list.append(conf_file)
+		conf = {'tasks': {'sleeper': {'control': 'once', 'commands': {'start': ['sleep', '0.5']}}}}
+		with open(conf_file, 'w') as f:
+			f.write(json.dumps(conf))
+
+		loop = self.new_loop()
+		try:
+			l = task.legion(log=self.log)
+			l.set_config_file(conf_file)
+			t = l.task_get('sleeper')
+			runner = loop.create_task(aio.manage(l))
+
+			procs = loop.run_until_complete(asyncio.gather(*[
+					asyncio.create_subprocess_exec('sh', '-c', 'sleep 0.2; exit 7') for i in range(5)]))
+			codes = loop.run_until_complete(asyncio.gather(*[proc.wait() for proc in procs]))
+			self.log.info("%s Host subprocess exit codes %s", my(self), codes)
+			assert codes == [7] * 5
+
+			give_up = time.time() + 10
+			while t.get_pids() and time.time() < give_up:
+				loop.run_until_complete(asyncio.sleep(0.1))
+			assert not t.get_pids()
+
+			l.schedule_exit()
+			loop.run_until_complete(asyncio.wait_for(runner, 10))
+		finally:
+			loop.close()